@@ -3,8 +3,11 @@
 # "catalogURL": "http://catalog",
 import random
 import time
-from MQTT_base import *
+import json
 from sensor import Sensor
+from log import setupLogging, getLogger
+
+log = getLogger("ACCELEROMETER")
 
 class Accelerometer(Sensor):
     def __init__(self, pi):
@@ -40,8 +43,8 @@ class Accelerometer(Sensor):
         message['e'][0]['v']=self.read_fall_detection()    
         message['e'][0]['t']=time.time()
         
-        self.client.publish(f'{self.topic}/acceleration/{self.deviceID}',message)
-        print(f"published Message: \n {message}")
+        self.client.publish(f'{self.topic}/acceleration',message)
+        log.debug("published message: %s", message)
 
 # Signal handling for shutdown with stopping the container
 import signal
@@ -64,6 +67,7 @@ if __name__ == '__main__':
     except FileNotFoundError as e:
         print(f"ACCELEROMETER: Json settings file not found")
         exit(1)
+    setupLogging(settings.get('logging', {}))
     accelerometer = None
     try:
         accelerometer = Accelerometer(settings)
@@ -0,0 +1,158 @@
+# CATALOG ADMISSION CONTROL
+# when the whole stack restarts every sensor and service registers and heartbeats at the same time;
+# instead of queueing all of them the catalog admits a bounded number of requests and rejects the others
+# with 429 (client over its rate) or 503 (catalog busy), both with a Retry-After header.
+# Heartbeats and registrations (POST and PUT of devices and services, and the GET of a single one to check that
+# it is still registered) and lease renewals are shed first, so the user-facing operations and the data path
+# (e.g. GET /devices/<ID>/channel of the thingspeak adaptor, the lists read by the bot) keep being served.
+# The rates are per client: behind the router of the sharded deployment (see catalog_router.py) every request of
+# a shard comes from the router, which sends the address of its client in X-Forwarded-For. The header is used
+# only for the requests coming from one of the "routers" of the settings (IPs or host names), so that the other
+# clients cannot choose their own bucket.
+
+import random
+import socket
+import threading
+import time
+
+import cherrypy
+
+HEARTBEAT_COLLECTIONS = ["devices", "services", "leases"]
+
+
+# HTTPError that also sets the Retry-After header
+class Rejected(cherrypy.HTTPError):
+    def __init__(self, status, message, retry_after):
+        super().__init__(status=status, message=message)
+        self.retry_after = retry_after
+
+    def set_response(self):
+        super().set_response()
+        cherrypy.serving.response.headers['Retry-After'] = str(self.retry_after)
+
+
+# in-flight limit of a thread pool, a tenth of the threads (at least one) is kept to reject the requests over it
+def spareLimit(threads):
+    return max(1, threads - max(1, threads // 10))
+
+
+# the addresses of the routers are looked up again after this time, their containers can be restarted
+ROUTERS_TTL = 60
+
+
+# registrations and heartbeats are the POST and PUT on a heartbeat collection and the GET of a single entity,
+# the lists and the other GETs (e.g. /devices/<ID>/channel) are user traffic
+def priority(method, uri):
+    if len(uri) == 0 or uri[0] not in HEARTBEAT_COLLECTIONS:
+        return 'user'
+    if method in ('POST', 'PUT') or (method == 'GET' and len(uri) == 2):
+        return 'heartbeat'
+    return 'user'
+
+
+# threads: size of the thread pool serving the requests (cherrypy), None if the requests do not hold a thread (ASGI)
+class AdmissionController(object):
+    def __init__(self, settings={}, threads=None):
+        self.max_inflight = settings.get("maxInFlight", 64)
+        # with one thread per request at most threads requests are in progress, and the others wait in the accept
+        # queue before being admitted: the limit is kept below the pool size, so that the spare threads reject the
+        # requests over the limit at once instead of leaving them in the queue
+        if threads is not None and self.max_inflight > spareLimit(threads):
+            print(f"Catalog: maxInFlight {self.max_inflight} not below the thread pool ({threads}), "
+                  f"using {spareLimit(threads)}")
+            self.max_inflight = spareLimit(threads)
+        # heartbeats can use only part of the capacity, the rest is kept for user-facing requests
+        self.max_inflight_heartbeats = min(self.max_inflight,
+                                           settings.get("maxInFlightHeartbeats", max(1, self.max_inflight // 2)))
+        # token bucket for each client and priority: rate in requests per second and burst size
+        self.rates = {
+            'heartbeat': (settings.get("heartbeatRate", 2), settings.get("heartbeatBurst", 10)),
+            'user': (settings.get("userRate", 20), settings.get("userBurst", 50))
+        }
+        self.retry_after = settings.get("retryAfter", 5)
+        self.routers = settings.get("routers", [])
+        self.router_addresses = set()
+        self.routers_resolved = None
+        self.inflight = {'heartbeat': 0, 'user': 0}
+        self.buckets = {}
+        self.rejected = {429: 0, 503: 0}
+        self.lock = threading.Lock()
+
+# the retry time is randomized, so that rejected clients do not come back all together
+    def retryAfter(self):
+        return self.retry_after + random.randint(0, self.retry_after)
+
+    def reject(self, status, message):
+        self.rejected[status] += 1
+        raise Rejected(status, message, self.retryAfter())
+
+    def takeToken(self, client, kind, now):
+        rate, burst = self.rates[kind]
+        tokens, last = self.buckets.get((client, kind), (burst, now))
+        tokens = min(burst, tokens + (now - last) * rate)
+        if tokens < 1:
+            self.buckets[(client, kind)] = (tokens, now)
+            return False
+        self.buckets[(client, kind)] = (tokens - 1, now)
+        return True
+
+# addresses of the routers, a name that cannot be resolved (e.g. the router is not started yet) is skipped;
+# the lookup is done without the lock, two threads resolving together only repeat it
+    def routerAddresses(self, now):
+        if self.routers_resolved is None or now - self.routers_resolved > ROUTERS_TTL:
+            addresses = set()
+            for router in self.routers:
+                try:
+                    addresses.update(socket.gethostbyname_ex(router)[2])
+                except OSError:
+                    pass
+            self.router_addresses = addresses
+            self.routers_resolved = now
+        return self.router_addresses
+
+# client of a request: the last address of X-Forwarded-For, the one added by the router, if the peer is a router
+    def clientOf(self, peer, forwarded=None):
+        if not forwarded or not self.routers:
+            return peer
+        if peer not in self.routerAddresses(time.monotonic()):
+            return peer
+        return forwarded.split(',')[-1].strip() or peer
+
+# forget the clients that have a full bucket, to keep the table small
+    def prune(self, now):
+        for key, (tokens, last) in list(self.buckets.items()):
+            rate, burst = self.rates[key[1]]
+            if tokens + (now - last) * rate >= burst:
+                del self.buckets[key]
+
+# admit a request or raise Rejected, the returned priority must be passed to release
+    def admit(self, client, method, uri):
+        kind = priority(method, uri)
+        now = time.monotonic()
+        with self.lock:
+            if len(self.buckets) > 10000:
+                self.prune(now)
+            total = self.inflight['heartbeat'] + self.inflight['user']
+            if total >= self.max_inflight:
+                self.reject(503, 'Catalog: too many requests in progress, retry later')
+            if kind == 'heartbeat' and self.inflight['heartbeat'] >= self.max_inflight_heartbeats:
+                self.reject(503, 'Catalog: too many heartbeats in progress, retry later')
+            if not self.takeToken(client, kind, now):
+                self.reject(429, f'Catalog: rate limit exceeded for client {client}, retry later')
+            self.inflight[kind] += 1
+        return kind
+
+    def release(self, kind):
+        with self.lock:
+            self.inflight[kind] -= 1
+
+
+# cherrypy tool, enabled with 'tools.admission.on' and 'tools.admission.controller' in the mount config
+def admissionTool(controller):
+    request = cherrypy.serving.request
+    uri = tuple(part for part in request.path_info.split('/') if part)
+    client = controller.clientOf(request.remote.ip, request.headers.get('X-Forwarded-For'))
+    kind = controller.admit(client, request.method, uri)
+    request.hooks.attach('on_end_request', controller.release, kind=kind)
+
+cherrypy.tools.admission = cherrypy.Tool('on_start_resource', admissionTool)
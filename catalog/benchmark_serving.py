@@ -0,0 +1,134 @@
+# Side-by-side benchmark of the catalog serving modes (cherrypy threaded server vs ASGI)
+# usage: python3 benchmark_serving.py [clients ...]        (default: 1000 5000 clients)
+# every mode is started in a separate process on a temporary catalog, then each client opens one
+# keep-alive connection, stays idle for a while (like a sensor between two heartbeats) and then
+# sends a few GET /services requests on the same connection.
+
+import asyncio
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+HOST = '127.0.0.1'
+REQUESTS_PER_CLIENT = 5
+IDLE_TIME = 2
+MODES = {'cherrypy': 8090, 'asgi': 8091}
+
+
+# serve a temporary catalog with the given mode, used in the child process
+def serve(mode, port, directory):
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    os.chdir(directory)
+    import catalog
+    settings = {"CatalogFileName": "catalog.json", "ThingspeakAdaptorURL": "http://localhost:1", "apiPort": port,
+                "serverMode": mode, "admission": {"enabled": False}}
+    catalog.start_api(catalog.Catalog(settings), int(port), settings)
+
+
+def seed(directory, services=50):
+    data = {"devices": [], "patients": [], "medications": [], "chats": [],
+            "services": [{"ID": i, "serviceName": f"service{i}", "last_update": time.time()} for i in range(1, services + 1)]}
+    with open(os.path.join(directory, 'catalog.json'), 'w') as f:
+        json.dump(data, f)
+
+
+async def read_response(reader):
+    head = await reader.readuntil(b'\r\n\r\n')
+    status = int(head.split(b' ', 2)[1])
+    length = 0
+    for line in head.split(b'\r\n'):
+        if line.lower().startswith(b'content-length:'):
+            length = int(line.split(b':', 1)[1])
+    await reader.readexactly(length)
+    return status
+
+
+async def client(port, start_event, latencies, errors):
+    try:
+        reader, writer = await asyncio.open_connection(HOST, port)
+    except OSError:
+        errors['connect'] += 1
+        return
+    await start_event.wait()
+    await asyncio.sleep(IDLE_TIME)
+    try:
+        for _ in range(REQUESTS_PER_CLIENT):
+            t0 = time.perf_counter()
+            writer.write(f'GET /services HTTP/1.1\r\nHost: {HOST}\r\n\r\n'.encode())
+            status = await asyncio.wait_for(read_response(reader), timeout=60)
+            if status != 200:
+                errors['status'] += 1
+            latencies.append(time.perf_counter() - t0)
+    except (OSError, asyncio.IncompleteReadError, asyncio.TimeoutError):
+        errors['request'] += 1
+    finally:
+        writer.close()
+
+
+async def run_clients(port, clients):
+    latencies = []
+    errors = {'connect': 0, 'request': 0, 'status': 0}
+    start_event = asyncio.Event()
+    tasks = []
+    for _ in range(clients):
+        tasks.append(asyncio.ensure_future(client(port, start_event, latencies, errors)))
+        await asyncio.sleep(0)
+    await asyncio.sleep(1)  # let all connections be accepted
+    t0 = time.perf_counter()
+    start_event.set()
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - t0 - IDLE_TIME
+    return latencies, errors, elapsed
+
+
+def wait_ready(port, timeout=20):
+    import socket
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            socket.create_connection((HOST, port), timeout=1).close()
+            return True
+        except OSError:
+            time.sleep(0.2)
+    return False
+
+
+def percentile(values, p):
+    if not values:
+        return float('nan')
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def main(client_counts):
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    print(f"{'mode':10}{'clients':>9}{'req/s':>10}{'p50 ms':>10}{'p99 ms':>10}{'errors':>30}")
+    for clients in client_counts:
+        for mode, port in MODES.items():
+            with tempfile.TemporaryDirectory() as directory:
+                seed(directory)
+                server = subprocess.Popen([sys.executable, os.path.abspath(__file__), '--serve', mode, str(port), directory],
+                                          stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+                try:
+                    if not wait_ready(port):
+                        print(f"{mode:10}{clients:>9}  server did not start")
+                        continue
+                    latencies, errors, elapsed = asyncio.run(run_clients(port, clients))
+                finally:
+                    server.kill()
+                    server.wait()
+            throughput = len(latencies) / elapsed if elapsed > 0 else 0
+            print(f"{mode:10}{clients:>9}{throughput:>10.0f}{percentile(latencies, 0.5) * 1000:>10.1f}"
+                  f"{percentile(latencies, 0.99) * 1000:>10.1f}{str(errors):>30}")
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == '--serve':
+        serve(sys.argv[2], sys.argv[3], sys.argv[4])
+    else:
+        main([int(n) for n in sys.argv[1:]] or [1000, 5000])
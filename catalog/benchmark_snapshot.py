@@ -0,0 +1,72 @@
+# Startup time of the catalog with the JSON file and with the binary snapshot
+# usage: python3 benchmark_snapshot.py [entities]        (default: 100000 entities)
+# the catalog is filled with patients, devices, medications, services and chats in the same
+# proportions of a real deployment (3 devices and 1 medication per patient)
+
+import json
+import os
+import sys
+import tempfile
+import time
+
+from snapshot import LazyCatalog, packSnapshot, writeSnapshot
+
+
+def generate(entities):
+    patients_number = max(1, entities // 5)
+    catalog = {"devices": [], "services": [], "patients": [], "medications": [], "chats": []}
+    now = time.time()
+    for p in range(1, patients_number + 1):
+        patient = {"ID": p, "name": f"name{p}", "surname": f"surname{p}", "age": 70, "last_update": now,
+                   "thingspeak_info": {"channelID": 3000000 + p, "write_api_key": "RTMILK8JW81BQF0J", "read_api_key": "VLHFMPL4NVVYARZ0"},
+                   "devices": [], "medications": [{"medicationID": p}]}
+        for d in range(3):
+            deviceID = 3 * (p - 1) + d + 1
+            patient["devices"].append({"deviceID": deviceID})
+            catalog["devices"].append({"ID": deviceID, "IP": "localhost", "port": 9090, "location": "", "patientID": str(p),
+                                       "deviceType": "heart_rate_sensor", "commands": ["heart_rate"], "unit": "bpm", "last_update": now})
+        catalog["medications"].append({"patientID": p, "name": "aspirin", "dosage": "100mg", "hour": 8, "ID": p, "last_update": now})
+        catalog["patients"].append(patient)
+    for s in range(1, 11):
+        catalog["services"].append({"ID": s, "serviceName": f"service{s}", "last_update": now})
+        catalog["chats"].append({"ID": str(100000 + s), "last_update": now})
+    return catalog
+
+
+def timed(function):
+    t0 = time.perf_counter()
+    result = function()
+    return result, (time.perf_counter() - t0) * 1000
+
+
+def main(entities):
+    catalog = generate(entities)
+    total = sum(len(value) for value in catalog.values())
+    with tempfile.TemporaryDirectory() as directory:
+        json_name = os.path.join(directory, 'catalog.json')
+        snapshot_name = os.path.join(directory, 'catalog.snapshot')
+        with open(json_name, 'w') as f:
+            json.dump(catalog, f, indent=4)
+        writeSnapshot(snapshot_name, packSnapshot(catalog))
+        print(f"{total} entities, catalog.json {os.path.getsize(json_name) / 1e6:.1f} MB, "
+              f"snapshot {os.path.getsize(snapshot_name) / 1e6:.1f} MB")
+
+        def load_json():
+            with open(json_name) as f:
+                return json.load(f)
+        _, json_ms = timed(load_json)
+        print(f"json.load of catalog.json (every start, and every request before): {json_ms:10.1f} ms")
+
+        lazy, open_ms = timed(lambda: LazyCatalog(snapshot_name))
+        print(f"snapshot open (serving from here):                            {open_ms:10.3f} ms")
+        _, services_ms = timed(lambda: lazy["services"])
+        print(f"first services access (heartbeats of the services):           {services_ms:10.3f} ms")
+        _, devices_ms = timed(lambda: lazy["devices"])
+        print(f"first devices access:                                         {devices_ms:10.1f} ms")
+        _, all_ms = timed(lazy.load)
+        print(f"remaining collections:                                        {all_ms:10.1f} ms")
+        lazy.close()
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
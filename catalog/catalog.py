@@ -7,6 +7,10 @@ import json
 import time
 import requests
 import threading
+import sys
+from admission import AdmissionController
+from index import CatalogIndex, STRING_IDS, indexKey
+from snapshot import LazyCatalog, SnapshotError, collectSnapshot, encodeSnapshot, packSnapshot, writeSnapshot
 
 
 # Function to get the catalog from a JSON file, with a backup option in case the file is corrupted or not found
@@ -20,7 +24,7 @@ def getCatalog(json_name, backup={}):
             catalog = backup
         else:
             print(f"Catalog: File {json_name} not found, creating a new one")
-            catalog = {"devices": [], "services": [], "patients": [], "medications": [], "chats": []}
+            catalog = {"devices": [], "services": [], "patients": [], "medications": [], "chats": [], "leases": []}
         with open(json_name, "w") as f:
             json.dump(catalog, f, indent=4)
     except json.JSONDecodeError:
@@ -29,11 +33,11 @@ def getCatalog(json_name, backup={}):
             catalog = backup
         else:
             print(f"Catalog: Json file corrupted, creating a new one")
-            catalog = {"devices": [], "services": [], "patients": [], "medications": [], "chats": []}
+            catalog = {"devices": [], "services": [], "patients": [], "medications": [], "chats": [], "leases": []}
         with open(json_name, "w") as f:
             json.dump(catalog, f, indent=4)
     # Ensure all keys are present in the catalog
-    for key in ["devices", "services", "patients", "medications", "chats"]:
+    for key in ["devices", "services", "patients", "medications", "chats", "leases"]:
         if key not in catalog:
             if backup != {} and key in backup:
                 print(f"Catalog: Key {key} not found, restoring from backup")
@@ -43,33 +47,84 @@ def getCatalog(json_name, backup={}):
                 catalog[key] = []
     return catalog
 
+# the catalog is loaded from the binary snapshot, decoding each collection only when it is used;
+# catalog.json is read only if the snapshot is missing or corrupted (e.g. at the first start)
+def loadCatalog(json_name, snapshot_name):
+    try:
+        return LazyCatalog(snapshot_name)
+    except FileNotFoundError:
+        print(f"Catalog: Snapshot {snapshot_name} not found, loading {json_name}")
+    except SnapshotError as e:
+        print(f"Catalog: {e}, loading {json_name}")
+    catalog = LazyCatalog()
+    catalog.update(getCatalog(json_name))
+    writeSnapshot(snapshot_name, packSnapshot(catalog))
+    catalog.open(snapshot_name)
+    return catalog
+
+# collections modified by a request on each URI, to be saved in the next snapshot
+# key of the single entity responses, e.g. GET /devices/1 -> {"device": ...}
+SINGULAR = {"devices": "device", "services": "service", "patients": "patient", "medications": "medication", "chats": "chat", "leases": "lease"}
+CHANGED_COLLECTIONS = {
+    "devices": ["devices", "patients"],
+    "services": ["services"],
+    "patients": ["patients", "devices", "medications"],
+    "medications": ["medications", "patients"],
+    "chats": ["chats"],
+    "leases": ["leases"]
+}
+
+# every entity has a version, incremented at each change, used for optimistic concurrency:
+# an update with an If-Match header is applied only if the entity still has that version
+def checkVersion(entity, ifMatch):
+    if ifMatch is None or ifMatch.strip() == '*':
+        return
+    expected = ifMatch.strip()
+    if expected.startswith('W/'):
+        expected = expected[2:]
+    if expected.strip('"') != str(entity.get('version', 0)):
+        raise cherrypy.HTTPError(status=412, message=f"Catalog: entity with ID {entity['ID']} has been modified, current version is {entity.get('version', 0)}")
+
+def newVersion(entity, previous=None):
+    entity['version'] = (previous if previous is not None else entity).get('version', 0) + 1
+
+# the entities are never changed in place: a changed entity is a copy that takes the position of the old one,
+# so the persistence thread encodes the collections it has copied without holding the lock (see saveSnapshot)
+def replaceEntity(catalog, collection, position, changes):
+    entity = dict(catalog[collection][position])
+    entity.update(changes)
+    newVersion(entity)
+    catalog[collection][position] = entity
+    return entity
+
 # device management functions
 
 def addDevice(catalog, device):
     device['last_update']=time.time()
-    for patient in catalog["patients"]:
+    device['version'] = 1
+    for position, patient in enumerate(catalog["patients"]):
         if int(patient['ID']) == int(device['patientID']):
-            if 'devices' not in patient:
-                patient['devices'] = []
-            for d in patient['devices']:
+            for d in patient.get('devices', []):
                 if int(d['deviceID']) == int(device['ID']):
                     raise cherrypy.HTTPError(status=400, message=f"Catalog: Device with ID {device['ID']} already exists for patient with ID {device['patientID']}")
-            patient['devices'].append({'deviceID': device['ID']})
+            replaceEntity(catalog, "patients", position, {'devices': patient.get('devices', []) + [{'deviceID': device['ID']}]})
             catalog["devices"].append(device)
             output = f"Device with ID {device['ID']} has been added to patient with ID {device['patientID']}"
             # print(output)
             return output
     raise cherrypy.HTTPError(status=404, message=f"Patient with ID {device['patientID']} not found for device with ID {device['ID']}")
 
-def updateDevice(catalog, device):
+def updateDevice(catalog, device, ifMatch=None):
     device['last_update'] = time.time()
-    if 'devicetype' not in device or 'ID' not in device:
+    if 'deviceType' not in device or 'ID' not in device:
         raise cherrypy.HTTPError(status=400, message='Catalog: missing deviceType or ID in device update')
     for i, d in enumerate(catalog["devices"]):
         # Check if the device ID and device type match
         # This is to ensure that even if there are errors with the device IDs, 
         # only the correct device can update their information
         if d['ID'] == device['ID'] and d['deviceType'] == device['deviceType']:
+            checkVersion(d, ifMatch)
+            newVersion(device, d)
             catalog["devices"][i] = device
     output = f"Device with ID {device['ID']} has been updated"
     return output
@@ -82,12 +137,12 @@ def removeDevice(catalog, deviceID):
     for idx, device in enumerate(catalog["devices"]):
         if int(device['ID']) == int(deviceID):
             # Remove the device from the patient's devices list
-            for patient in catalog["patients"]:
+            for position, patient in enumerate(catalog["patients"]):
                 if int(patient['ID']) == int(device['patientID']):
                     if 'devices' in patient:
                         for d in patient['devices']:
                             if int(d['deviceID']) == int(device['ID']):
-                                patient['devices'].remove(d)
+                                replaceEntity(catalog, "patients", position, {'devices': [x for x in patient['devices'] if x is not d]})
                                 break
             # Remove the device from the catalog
             catalog["devices"].pop(idx)
@@ -100,12 +155,13 @@ def removeDevice(catalog, deviceID):
 
 def addService(catalog, service):
     service['last_update']=time.time()
+    service['version'] = 1
     catalog["services"].append(service)
     output = f"Service with ID {service['ID']} has been added"
     # print(output)
     return output
 
-def updateService(catalog, service):
+def updateService(catalog, service, ifMatch=None):
     service['last_update'] = time.time()
     if 'serviceName' not in service:
         raise cherrypy.HTTPError(status=400, message='Catalog: missing serviceName in service update')
@@ -114,6 +170,8 @@ def updateService(catalog, service):
         # This is to ensure that even if there are errors with the service IDs,
         # only the correct service can update their information
         if s['ID'] == service['ID'] and s['serviceName'] == service['serviceName']:
+            checkVersion(s, ifMatch)
+            newVersion(service, s)
             catalog["services"][i] = service
     output = f"Service with ID {service['ID']} has been updated"
     return output
@@ -133,31 +191,38 @@ def removeService(catalog, serviceID):
 
 # patient management functions
 
+# the channel is created before adding the patient, without holding the catalog lock,
+# since the thingspeak adaptor can call back the catalog
+def createChannel(patient, thingspeak_url):
+    channel_data = requests.post(f'{thingspeak_url}/channels', json={"patientID": patient['ID']}, headers={"Content-Type": "application/json"})# , headers={"Content-Type": "application/json"} vedere se si può togliere
+    if channel_data.status_code != 200:
+        raise cherrypy.HTTPError(status=400, message=f"Error creating channel for patient with ID {patient['ID']}: {channel_data.text}")
+    return channel_data.json()
+
 # need to remember to add first the patient and then add the sensors or the medications
 # assigned to the patient, otherwise they will not be added
-def addPatient(catalog, patient, thingspeak_url):
+def addPatient(catalog, patient, thingspeak_info):
     patient["last_update"] = time.time()
-    channel_data = requests.post(f'{thingspeak_url}/channels', json={"patientID": patient['ID']}, headers={"Content-Type": "application/json"})# , headers={"Content-Type": "application/json"} vedere se si può togliere
-    if channel_data.status_code == 200:
-        patient['thingspeak_info'] = channel_data.json()
-        patient['devices'] = []  # Initialize devices list for the patient
-        patient['medications'] = []  # Initialize medications list for the patient
-        catalog["patients"].append(patient)
-        output = f"Patient with ID {patient['ID']} has been added"
-    else:
-        raise cherrypy.HTTPError(status=400, message=f"Error creating channel for patient with ID {patient['ID']}: {channel_data.text}")
+    patient['version'] = 1
+    patient['thingspeak_info'] = thingspeak_info
+    patient['devices'] = []  # Initialize devices list for the patient
+    patient['medications'] = []  # Initialize medications list for the patient
+    catalog["patients"].append(patient)
+    output = f"Patient with ID {patient['ID']} has been added"
     # print(output)
     return output
 
-def updatePatient(catalog, patient):
+def updatePatient(catalog, patient, ifMatch=None):
     patient['last_update'] = time.time()
     for i, p in enumerate(catalog["patients"]):
         if p['ID'] == patient['ID']:
+            checkVersion(p, ifMatch)
+            newVersion(patient, p)
             catalog["patients"][i] = patient
     output = f"Patient with ID {patient['ID']} has been updated"
     return output
 
-def removePatient(catalog, patientID, thingspeak_adaptor_url):
+def deleteChannel(patientID, thingspeak_adaptor_url):
     try:
         patientID = int(patientID)
     except ValueError:
@@ -168,6 +233,9 @@ def removePatient(catalog, patientID, thingspeak_adaptor_url):
         raise cherrypy.HTTPError(status=400, message=f"Error requesting Thingspeak deletion for patient {patientID}: {e}")
     if response.status_code != 200:
         raise cherrypy.HTTPError(status=400, message=f"Error deleting Thingspeak channel for patient {patientID}: {response.text}")
+
+def removePatient(catalog, patientID):
+    patientID = int(patientID)
     for idx, patient in enumerate(catalog["patients"]):
         if int(patient['ID']) == int(patientID):
             # Remove all devices and medications assigned to this patient
@@ -183,25 +251,26 @@ def removePatient(catalog, patientID, thingspeak_adaptor_url):
 # medication management functions
 
 def addMedication(catalog, medication):
-    for patient in catalog["patients"]:
+    for position, patient in enumerate(catalog["patients"]):
         if int(patient['ID']) == int(medication['patientID']):
             medication['last_update'] = time.time()
-            if 'medications' not in patient:
-                patient['medications'] = []
-            for m in patient['medications']:
+            medication['version'] = 1
+            for m in patient.get('medications', []):
                 if int(m['medicationID']) == int(medication['ID']):
                     raise cherrypy.HTTPError(status=400, message=f"Catalog: Medication with ID {medication['ID']} already exists for patient with ID {medication['patientID']}")
-            patient['medications'].append({'medicationID': medication['ID']})
+            replaceEntity(catalog, "patients", position, {'medications': patient.get('medications', []) + [{'medicationID': medication['ID']}]})
             catalog["medications"].append(medication)
             output = f"Medication with ID {medication['ID']} has been added"
             # print(output)
             return output
     raise cherrypy.HTTPError(status=404, message=f"Patient with ID {medication['patientID']} not found for medication with ID {medication['ID']}")
 
-def updateMedication(catalog, medication):  
+def updateMedication(catalog, medication, ifMatch=None):  
     medication['last_update'] = time.time()
     for i, m in enumerate(catalog["medications"]):
         if m['ID'] == medication['ID']:
+            checkVersion(m, ifMatch)
+            newVersion(medication, m)
             catalog["medications"][i] = medication
     output = f"Medication with ID {medication['ID']} has been updated"
     return output
@@ -209,12 +278,12 @@ def updateMedication(catalog, medication):
 def removeMedication(catalog, medicationID):
     for i, m in enumerate(catalog["medications"]):
         if int(m['ID']) == int(medicationID):
-            for patient in catalog["patients"]:
+            for position, patient in enumerate(catalog["patients"]):
                 if int(patient['ID']) == int(m['patientID']):
                     if 'medications' in patient:
                         for med in patient['medications']:
                             if int(med['medicationID']) == int(medicationID):
-                                patient['medications'].remove(med)
+                                replaceEntity(catalog, "patients", position, {'medications': [x for x in patient['medications'] if x is not med]})
                                 break
             catalog["medications"].pop(i)
             output = f"Medication with ID {medicationID} has been removed"
@@ -226,15 +295,18 @@ def removeMedication(catalog, medicationID):
 
 def addChat(catalog, chat):
     chat['last_update'] = time.time()
+    chat['version'] = 1
     catalog["chats"].append(chat)
     output = f"Chat with ID {chat['ID']} has been added"
     # print(output)
     return output
 
-def updateChat(catalog, chat):
+def updateChat(catalog, chat, ifMatch=None):
     chat['last_update'] = time.time()
     for i, c in enumerate(catalog["chats"]):
         if str(c['ID']) == str(chat['ID']):
+            checkVersion(c, ifMatch)
+            newVersion(chat, c)
             catalog["chats"][i] = chat
     output = f"Chat with ID {chat['ID']} has been updated"
     return output
@@ -248,6 +320,94 @@ def removeChat(catalog, chatID):
             return output
     raise cherrypy.HTTPError(status=404, message=f"Chat with ID {chatID} not found")
 
+# lease management functions
+# a lease gives one catalog manager instance the ownership of a partition of the catalog (the lease ID)
+# for "duration" seconds; the expiration is set by the clock of the catalog, and a lease held by another
+# owner can be taken over only after it has expired
+
+def addLease(catalog, lease):
+    lease['last_update'] = time.time()
+    lease['expires'] = lease['last_update'] + float(lease.get('duration', 30))
+    lease['version'] = 1
+    catalog["leases"].append(lease)
+    output = f"Lease with ID {lease['ID']} has been added"
+    return output
+
+def updateLease(catalog, lease, ifMatch=None):
+    now = time.time()
+    for i, l in enumerate(catalog["leases"]):
+        if int(l['ID']) == int(lease['ID']):
+            checkVersion(l, ifMatch)
+            if l.get('owner') != lease['owner'] and l.get('expires', 0) > now:
+                raise cherrypy.HTTPError(status=409, message=f"Catalog: Lease with ID {lease['ID']} is held by {l.get('owner')}")
+            lease['last_update'] = now
+            lease['expires'] = now + float(lease.get('duration', 30))
+            newVersion(lease, l)
+            catalog["leases"][i] = lease
+    output = f"Lease with ID {lease['ID']} has been updated"
+    return output
+
+def removeLease(catalog, leaseID):
+    try:
+        leaseID = int(leaseID)
+    except ValueError:
+        raise cherrypy.HTTPError(status=400, message='Catalog: Lease ID must be an integer')
+    for idx, lease in enumerate(catalog["leases"]):
+        if int(lease['ID']) == leaseID:
+            catalog["leases"].pop(idx)
+            output = f"Lease with ID {leaseID} has been removed"
+            return output
+    raise cherrypy.HTTPError(status=404, message=f"Lease with ID {leaseID} not found")
+
+# partial update: only the fields in the body are changed, the other fields of the entity are kept
+def patchEntity(catalog, collection, entityID, changes, ifMatch=None):
+    if collection in ["devices", "medications"] and 'patientID' in changes:
+        raise cherrypy.HTTPError(status=400, message=f'Catalog: patientID cannot be changed with PATCH')
+    for position, entity in enumerate(catalog[collection]):
+        if str(entity['ID']) == str(entityID):
+            checkVersion(entity, ifMatch)
+            changes = {key: value for key, value in changes.items() if key not in ['ID', 'version']}
+            changes['last_update'] = time.time()
+            replaceEntity(catalog, collection, position, changes)
+            return f"{collection[:-1].capitalize()} with ID {entityID} has been updated"
+    raise cherrypy.HTTPError(status=404, message=f"{collection[:-1].capitalize()} with ID {entityID} not found")
+
+# bulk removal: all the entities with the given IDs are removed with one pass over the collection,
+# and devices and medications are removed from the lists of their patients
+BACK_REFERENCES = {"devices": "deviceID", "medications": "medicationID"}
+
+def removeEntities(catalog, collection, keys):
+    removed = []
+    kept = []
+    for entity in catalog[collection]:
+        try:
+            key = indexKey(collection, entity['ID'])
+        except (KeyError, TypeError, ValueError):
+            key = None
+        if key in keys:
+            removed.append(entity)
+        else:
+            kept.append(entity)
+    catalog[collection] = kept
+    if collection in BACK_REFERENCES and removed:
+        field = BACK_REFERENCES[collection]
+        patients = {}
+        for entity in removed:
+            patients.setdefault(str(entity.get('patientID')), set()).add(indexKey(collection, entity['ID']))
+        for position, patient in enumerate(catalog["patients"]):
+            references = patients.get(str(patient['ID']))
+            if references is None or collection not in patient:
+                continue
+            kept_references = [r for r in patient[collection] if indexKey(collection, r[field]) not in references]
+            if len(kept_references) != len(patient[collection]):
+                replaceEntity(catalog, "patients", position, {collection: kept_references})
+    return [entity['ID'] for entity in removed]
+
+# read the JSON body of the current cherrypy request
+def readBody():
+    json_body = cherrypy.request.body.read()
+    return json.loads(json_body.decode('utf-8'))
+
 class Catalog(object):
     exposed = True
 
@@ -259,90 +419,141 @@ class Catalog(object):
         self.json_name=settings["CatalogFileName"]
         self.thingspeak_adaptor_url=settings["ThingspeakAdaptorURL"] 
         self.api_port=settings["apiPort"]
-        self.backup = {}
-        getCatalog(self.json_name)
+        self.snapshot_name=settings.get("SnapshotFileName", "catalog.snapshot")
+        self.snapshot_interval=settings.get("snapshotInterval", 1)
+        # the catalog is kept in memory and protected by a lock, the collections modified
+        # since the last snapshot are saved by the persistence thread
+        self.lock = threading.RLock()
+        self.changed = set()
+        self.catalog = loadCatalog(self.json_name, self.snapshot_name)
+        # snapshots written before the leases collection existed
+        if "leases" not in self.catalog:
+            self.catalog["leases"] = []
+            self.changed.add("leases")
+        self.index = CatalogIndex(self.catalog)
         self.start()
 
     def start(self):
-        backup_thread = threading.Thread(target=self.backupCatalog, daemon=True)
-        backup_thread.start()
+        persist_thread = threading.Thread(target=self.persistLoop, daemon=True)
+        persist_thread.start()
 
-# function to create a backup copy of the catalog, called by second thread
-    def backupCatalog(self):
+# function to save the snapshot every snapshotInterval seconds and a JSON backup copy of the catalog
+# every 60 seconds, called by second thread
+    def persistLoop(self):
+        last_backup = time.time()
         while True:
-            time.sleep(60)
+            time.sleep(self.snapshot_interval)
             try:
-                self.backup = getCatalog(self.json_name, self.backup)
+                self.saveSnapshot()
+                if time.time() - last_backup > 60:
+                    self.backupCatalog()
+                    last_backup = time.time()
             except Exception as e:
-                print(f"Catalog: Error during backup: {e}")
-                
+                print(f"Catalog: Error saving catalog: {e}")
+
+    def saveSnapshot(self):
+        with self.lock:
+            if not self.changed:
+                return False
+            changed = self.changed
+            # the lists of the changed collections are copied, the requests do not wait for the encoding
+            collections = collectSnapshot(self.catalog, changed)
+            self.changed = set()
+        try:
+            writeSnapshot(self.snapshot_name, encodeSnapshot(collections))
+        except Exception:
+            with self.lock:
+                self.changed.update(changed)
+            raise
+        with self.lock:
+            self.catalog.open(self.snapshot_name)
+        return True
+
+# the human readable catalog.json is written from the snapshot file, without holding the lock
+    def backupCatalog(self):
+        backup = LazyCatalog(self.snapshot_name)
+        try:
+            with open(self.json_name, "w") as f:
+                json.dump(backup.load(), f, indent=4)
+        finally:
+            backup.close()
 
     def GET(self, *uri, **params):
-        catalog=getCatalog(self.json_name, self.backup)
+        with self.lock:
+            return self.getEntity(uri, params)
+
+    def parseID(self, collection, entityID):
+        try:
+            indexKey(collection, entityID)
+        except ValueError:
+            raise cherrypy.HTTPError(status=400, message=f'Catalog: invalid {SINGULAR[collection]}ID')
+        return entityID
+
+# GET /devices/<ID>/channel returns the device, its patientID and the thingspeak_info of the patient in one response
+    def resolveDevice(self, deviceID):
+        try:
+            output = self.index.resolveDevice(self.parseID("devices", deviceID))
+        except KeyError as e:
+            raise cherrypy.HTTPError(status=404, message=f'Catalog: Patient {e} not found for device {deviceID}')
+        if output is None:
+            raise cherrypy.HTTPError(status=404, message='Catalog: Device not found')
+        return output
+
+# GET /<collection>?ids=1,2,3 returns the entities with the given IDs, in the same order,
+# and the IDs that are not in the catalog under "missing"
+    def getEntities(self, collection, ids):
+        entities = []
+        missing = []
+        for entityID in ids.split(','):
+            entityID = entityID.strip()
+            if not entityID:
+                continue
+            entity = self.index.get(collection, self.parseID(collection, entityID))
+            if entity is None:
+                missing.append(entityID if collection in STRING_IDS else int(entityID))
+            else:
+                entities.append(entity)
+        return json.dumps({collection: entities, "missing": missing})
+
+    def getEntity(self, uri, params):
+        catalog=self.catalog
         if len(uri)==0:
             raise cherrypy.HTTPError(status=400, message='Catalog: GET with empty URI')
         elif uri[0]=='all':
-            return json.dumps(catalog)
-        elif uri[0]=='devices':
-            if len(uri) > 1:
-                try:
-                    deviceID = int(uri[1])
-                except ValueError:
-                    raise cherrypy.HTTPError(status=400, message='Catalog: invalid deviceID')
-                # print(f"Catalog: GET deviceID: {deviceID}")
-                for device in catalog["devices"]:
-                    if int(device['ID']) == int(deviceID):
-                        return json.dumps({"device": device})
-                raise cherrypy.HTTPError(status=404, message='Catalog: Device not found')
-            return json.dumps({"devices":catalog["devices"]})
-        elif uri[0]=='services':
+            return json.dumps(catalog.load())
+        elif uri[0]=='devices' and len(uri) > 2 and uri[2]=='channel':
+            return self.resolveDevice(uri[1])
+        elif uri[0] in SINGULAR:
             if len(uri) > 1:
-                try:
-                    serviceID = int(uri[1])
-                except ValueError:
-                    raise cherrypy.HTTPError(status=400, message='Catalog: invalid serviceID')
-                # print(f"Catalog: GET serviceID: {serviceID}")
-                for service in catalog["services"]:
-                    if int(service['ID']) == int(serviceID):
-                        return json.dumps({"service": service})
-                raise cherrypy.HTTPError(status=404, message='Catalog: Service not found')
-            return json.dumps({"services":catalog["services"]})
-        elif uri[0]=='patients':
-            if len(uri) > 1:
-                try:
-                    patientID = int(uri[1])
-                except ValueError:
-                    raise cherrypy.HTTPError(status=400, message='Catalog: invalid patientID')
-                for patient in catalog["patients"]:
-                    if int(patient['ID']) == int(patientID):
-                        return json.dumps({"patient": patient})
-                raise cherrypy.HTTPError(status=404, message='Catalog: Patient not found')
-            return json.dumps({"patients":catalog["patients"]})
-        elif uri[0]=='medications':
-            if len(uri) > 1:
-                try:
-                    medicationID = int(uri[1])
-                except ValueError:
-                    raise cherrypy.HTTPError(status=400, message='Catalog: invalid medicationID')
-                for medication in catalog["medications"]:
-                    if int(medication['ID']) == int(medicationID):
-                        return json.dumps({"medication": medication})
-                raise cherrypy.HTTPError(status=404, message='Catalog: Medication not found')
-            return json.dumps({"medications":catalog["medications"]})
-        elif uri[0]=='chats':
-            if len(uri) > 1:
-                for chat in catalog["chats"]:
-                    if str(chat['ID']) == str(uri[1]):
-                        return json.dumps({"chat": chat})
-                raise cherrypy.HTTPError(status=404, message='Catalog: Chat not found')
-            return json.dumps({"chats":catalog["chats"]})
+                entity = self.index.get(uri[0], self.parseID(uri[0], uri[1]))
+                if entity is None:
+                    raise cherrypy.HTTPError(status=404, message=f'Catalog: {SINGULAR[uri[0]].capitalize()} not found')
+                return json.dumps({SINGULAR[uri[0]]: entity})
+            if 'ids' in params:
+                return self.getEntities(uri[0], params['ids'])
+            return json.dumps({uri[0]: catalog[uri[0]]})
         else:
             raise cherrypy.HTTPError(status=400, message='Catalog: GET URI not managed')
         
     def POST(self,*uri,**params):
-        catalog=getCatalog(self.json_name,self.backup)
-        json_body = cherrypy.request.body.read()
-        body = json.loads(json_body.decode('utf-8'))
+        return self.handlePOST(uri, params, readBody())
+
+# the handlers below do not depend on the cherrypy request object, so that they can
+# be served also by the ASGI server (see catalog_asgi.py)
+    def handlePOST(self, uri, params, body):
+        thingspeak_info = None
+        if len(uri) > 0 and uri[0] == 'patients' and 'ID' in body:
+            with self.lock:
+                if self.index.contains("patients", self.parseID("patients", body['ID'])):
+                    raise cherrypy.HTTPError(status=400, message=f'Catalog: Patient with ID {body["ID"]} already in catalog')
+            thingspeak_info = createChannel(body, self.thingspeak_adaptor_url)
+        with self.lock:
+            output = self.addEntity(uri, params, body, thingspeak_info)
+        print(output)
+        return output
+
+    def addEntity(self, uri, params, body, thingspeak_info=None):
+        catalog=self.catalog
         if 'ID' not in body:
             raise cherrypy.HTTPError(status=400, message='Catalog: missing ID in POST body')
         try:
@@ -354,15 +565,15 @@ class Catalog(object):
         elif uri[0]=='devices':
             if 'patientID' not in body:
                 raise cherrypy.HTTPError(status=400, message='Catalog: missing patientID in POST body')
-            if not any(int(d['ID']) == int(body['ID']) for d in catalog["devices"]):
-                if not any(int(p['ID']) == int(body['patientID']) for p in catalog["patients"]):
+            if not self.index.contains("devices", body['ID']):
+                if not self.index.contains("patients", self.parseID("patients", body['patientID'])):
                     raise cherrypy.HTTPError(status=404, message=f'Catalog: Patient not found for device')
                 else:    
                     output=addDevice(catalog, body)
             else:
                 raise cherrypy.HTTPError(status=400, message=f'Catalog: Device with ID {body["ID"]} already in catalog')
         elif uri[0]=='services':
-            if not any(int(s['ID']) == int(body['ID']) for s in catalog["services"]):
+            if not self.index.contains("services", body['ID']):
                 output=addService(catalog, body)
             else:
                 raise cherrypy.HTTPError(status=400, message=f'Catalog: Service with ID {body["ID"]} already in catalog')
@@ -370,8 +581,8 @@ class Catalog(object):
             print(f"Catalog: POST body: {body}",flush=True)
             if 'ID' not in body:
                 raise cherrypy.HTTPError(status=400, message='Catalog: missing ID for patient')
-            if not any(int(p['ID']) == int(body['ID']) for p in catalog["patients"]):
-                output=addPatient(catalog, body,self.thingspeak_adaptor_url)
+            if not self.index.contains("patients", body['ID']):
+                output=addPatient(catalog, body, thingspeak_info)
             else:
                 raise cherrypy.HTTPError(status=400, message=f'Catalog: Patient with ID {body["ID"]} already in catalog')
         elif uri[0]=='medications':
@@ -379,7 +590,7 @@ class Catalog(object):
                 raise cherrypy.HTTPError(status=400, message='Catalog: missing patientID in POST body')
             if 'ID' not in body:
                 raise cherrypy.HTTPError(status=400, message='Catalog: missing ID for medication')
-            if not any(int(m['ID']) == int(body['ID']) for m in catalog["medications"]):
+            if not self.index.contains("medications", body['ID']):
                 output=addMedication(catalog, body)
             else:
                 raise cherrypy.HTTPError(status=400, message=f'Catalog: Medication with ID {body["ID"]} already in catalog')
@@ -387,88 +598,189 @@ class Catalog(object):
             # print(f"Catalog: POST body: {body}",flush=True)
             if 'ID' not in body:
                 raise cherrypy.HTTPError(status=400, message='Catalog: missing ID for chat')
-            if not any(str(c['ID']) == str(body['ID']) for c in catalog["chats"]):
+            if not self.index.contains("chats", body['ID']):
                 output=addChat(catalog, body)
             else:
                 raise cherrypy.HTTPError(status=401, message=f'Catalog: Chat with ID {body["ID"]} already in catalog')
+        elif uri[0]=='leases':
+            if 'owner' not in body:
+                raise cherrypy.HTTPError(status=400, message='Catalog: missing owner for lease')
+            if not self.index.contains("leases", body['ID']):
+                output=addLease(catalog, body)
+            else:
+                raise cherrypy.HTTPError(status=400, message=f'Catalog: Lease with ID {body["ID"]} already in catalog')
         else:
             raise cherrypy.HTTPError(status=400, message='Catalog: POST URI not managed')
-        try:
-            json.dump(catalog,open(self.json_name,"w"),indent=4)
-        except Exception as e:
-            print(f"Catalog: Error saving catalog: {e}")
-        print(output)
+        self.index.added(uri[0])
+        self.changed.update(CHANGED_COLLECTIONS[uri[0]])
         return output
     
     def PUT(self,*uri,**params):
-        catalog=getCatalog(self.json_name, self.backup)
-        json_body = cherrypy.request.body.read()
-        body = json.loads(json_body.decode('utf-8'))
+        return self.handlePUT(uri, params, readBody(), cherrypy.request.headers.get('If-Match'))
+
+    def handlePUT(self, uri, params, body, ifMatch=None):
+        with self.lock:
+            return self.updateEntity(uri, params, body, ifMatch)
+
+    def updateEntity(self, uri, params, body, ifMatch=None):
+        catalog=self.catalog
         if len(uri)==0:
             raise cherrypy.HTTPError(status=400, message='Catalog: PUT with empty URI')
         if 'ID' not in body:
             raise cherrypy.HTTPError(status=400, message='Catalog: missing ID in PUT body')
         elif uri[0]=='devices':
-            if not any(int(d['ID']) == int(body['ID']) for d in catalog["devices"]):
-                raise cherrypy.HTTPError(status=400, message='Catalog: Device not found')
+            if not self.index.contains("devices", self.parseID("devices", body['ID'])):
+                raise cherrypy.HTTPError(status=404, message='Catalog: Device not found')
             else:
-                output=updateDevice(catalog, body)
+                output=updateDevice(catalog, body, ifMatch)
         elif uri[0]=='services':
-            if not any(int(d['ID']) == int(body['ID']) for d in catalog["services"]):
-                raise cherrypy.HTTPError(status=400, message='Catalog: Service not found')
+            if not self.index.contains("services", self.parseID("services", body['ID'])):
+                raise cherrypy.HTTPError(status=404, message='Catalog: Service not found')
             else:
-                output=updateService(catalog, body)
+                output=updateService(catalog, body, ifMatch)
         elif uri[0]=='patients':
-            if not any(int(d['ID']) == int(body['ID']) for d in catalog["patients"]):
-                raise cherrypy.HTTPError(status=400, message='Catalog: Patient not found')
+            if not self.index.contains("patients", self.parseID("patients", body['ID'])):
+                raise cherrypy.HTTPError(status=404, message='Catalog: Patient not found')
             else:
-                output=updatePatient(catalog, body)
+                output=updatePatient(catalog, body, ifMatch)
         elif uri[0]=='medications':
-            if not any(int(m['ID']) == int(body['ID']) for m in catalog["medications"]):
-                raise cherrypy.HTTPError(status=400, message='Catalog: Medication not found')
+            if not self.index.contains("medications", self.parseID("medications", body['ID'])):
+                raise cherrypy.HTTPError(status=404, message='Catalog: Medication not found')
             else:
-                output=updateMedication(catalog, body)
+                output=updateMedication(catalog, body, ifMatch)
         elif uri[0]=='chats':
-            if not any(str(c['ID']) == str(body['ID']) for c in catalog["chats"]):
-                raise cherrypy.HTTPError(status=400, message='Catalog: Chat not found')
+            if not self.index.contains("chats", body['ID']):
+                raise cherrypy.HTTPError(status=404, message='Catalog: Chat not found')
             else:
-                output=updateChat(catalog, body)
+                output=updateChat(catalog, body, ifMatch)
+        elif uri[0]=='leases':
+            if 'owner' not in body:
+                raise cherrypy.HTTPError(status=400, message='Catalog: missing owner for lease')
+            if not self.index.contains("leases", self.parseID("leases", body['ID'])):
+                raise cherrypy.HTTPError(status=404, message='Catalog: Lease not found')
+            else:
+                output=updateLease(catalog, body, ifMatch)
         else:
             raise cherrypy.HTTPError(status=400, message='Catalog: PUT URI not managed')
-        try:
-            json.dump(catalog,open(self.json_name,"w"),indent=4)
-        except Exception as e:
-            print(f"Catalog: Error saving catalog: {e}")
+        self.index.changed(uri[0], body['ID'])
+        self.changed.update(CHANGED_COLLECTIONS[uri[0]])
+        return output
+
+# PATCH /<collection>/<ID> or PATCH /<collection> with the ID in the body
+    def PATCH(self,*uri,**params):
+        return self.handlePATCH(uri, params, readBody(), cherrypy.request.headers.get('If-Match'))
+
+    def handlePATCH(self, uri, params, body, ifMatch=None):
+        if len(uri)==0:
+            raise cherrypy.HTTPError(status=400, message='Catalog: PATCH with empty URI')
+        # leases are changed only with PUT, that checks their owner and expiration
+        if uri[0] not in CHANGED_COLLECTIONS or uri[0] == 'leases':
+            raise cherrypy.HTTPError(status=400, message='Catalog: PATCH URI not managed')
+        if len(uri) > 1:
+            entityID = uri[1]
+        elif 'ID' in body:
+            entityID = body['ID']
+        else:
+            raise cherrypy.HTTPError(status=400, message='Catalog: missing ID in PATCH')
+        with self.lock:
+            output = patchEntity(self.catalog, uri[0], entityID, body, ifMatch)
+            self.index.changed(uri[0], entityID)
+            self.changed.update(CHANGED_COLLECTIONS[uri[0]])
         return output
-    
 
     def DELETE(self,*uri,**params):
-        catalog=getCatalog(self.json_name, self.backup)
+        if len(uri) > 1 and uri[0] == 'patients':
+            deleteChannel(uri[1], self.thingspeak_adaptor_url)
+        with self.lock:
+            return self.removeEntity(uri, params)
+
+    def removeEntity(self, uri, params):
+        catalog=self.catalog
         if len(uri)==0:
             raise cherrypy.HTTPError(status=400, message='Catalog: DELETE with empty URI')
         if len(uri) < 2:
-            raise cherrypy.HTTPError(status=400, message='Catalog: no ID provided for deletion')
+            if 'ids' not in params:
+                raise cherrypy.HTTPError(status=400, message='Catalog: no ID provided for deletion')
+            output=self.deleteEntities(uri[0], params['ids'])
         elif uri[0]=='devices':
             output=removeDevice(catalog,uri[1])
         elif uri[0]=='services':
             output=removeService(catalog,uri[1])
         elif uri[0]=='patients':
-            output=removePatient(catalog, int(uri[1]), self.thingspeak_adaptor_url)
+            output=removePatient(catalog, uri[1])
         elif uri[0]=='medications':
             output=removeMedication(catalog, int(uri[1]))
         elif uri[0]=='chats':
             output=removeChat(catalog, uri[1])
+        elif uri[0]=='leases':
+            output=removeLease(catalog, uri[1])
         else:
             raise cherrypy.HTTPError(status=400, message='Catalog: DELETE URI not managed')
-        try:
-            json.dump(catalog,open(self.json_name,"w"),indent=4)
-        except Exception as e:
-            print(f"Catalog: Error saving catalog: {e}")
+        self.index.invalidate(CHANGED_COLLECTIONS[uri[0]])
+        self.changed.update(CHANGED_COLLECTIONS[uri[0]])
         return output
 
+# DELETE /<collection>?ids=1,2,3 removes the entities with the given IDs under one lock, returns the removed IDs
+# and the IDs that are not in the catalog under "missing"; patients are removed one at a time, with their channel
+    def deleteEntities(self, collection, ids):
+        if collection not in CHANGED_COLLECTIONS or collection == 'patients':
+            raise cherrypy.HTTPError(status=400, message='Catalog: bulk DELETE URI not managed')
+        keys = {}
+        for entityID in ids.split(','):
+            entityID = entityID.strip()
+            if entityID:
+                keys[indexKey(collection, self.parseID(collection, entityID))] = entityID
+        removed = removeEntities(self.catalog, collection, keys)
+        found = {indexKey(collection, entityID) for entityID in removed}
+        missing = [entityID if collection in STRING_IDS else int(entityID) for key, entityID in keys.items() if key not in found]
+        return json.dumps({"removed": removed, "missing": missing})
+
     def stop(self):
         print("Stopping Catalog")
-        self.update_thread.join()
+        self.saveSnapshot()
+
+# configuration of the cherrypy server: the connections waiting for a thread are bounded by acceptQueueSize,
+# the ones over it are answered 503 by the server at once
+def serverConfig(api_port, settings={}):
+    return {'server.socket_host': '0.0.0.0', 'server.socket_port': api_port, 'engine.autoreload.on': False,
+            'server.thread_pool': settings.get("threadPool", 10),
+            'server.accepted_queue_size': settings.get("acceptQueueSize", 100),
+            'server.accepted_queue_timeout': 0}
+
+# start the REST server, either with the threaded cherrypy server or with the asyncio (ASGI) one
+# the ASGI mode serves the same Catalog object, but idle keep-alive connections do not hold a thread
+# requests are admitted by the admission controller (see admission.py) unless "admission" is disabled in settings
+def start_api(catalog, api_port, settings={}):
+    mode = settings.get("serverMode", "cherrypy")
+    admission = None
+    if settings.get("admission", {}).get("enabled", True):
+        threads = settings.get("threadPool", 10) if mode == "cherrypy" else None
+        admission = AdmissionController(settings.get("admission", {}), threads)
+    if mode == "asgi":
+        from catalog_asgi import serve
+        print(f"Catalog: serving with ASGI server on port {api_port}")
+        serve(catalog, api_port, settings.get("asgi", {}), admission)
+        return
+    if mode != "cherrypy":
+        raise ValueError(f"Unknown serverMode '{mode}', it must be 'cherrypy' or 'asgi'")
+    conf = {
+        '/': {
+            'request.dispatch': cherrypy.dispatch.MethodDispatcher(),
+            'tools.sessions.on': True,
+            'tools.admission.on': admission is not None,
+            'tools.admission.controller': admission
+        }
+    }
+    cherrypy.config.update(serverConfig(api_port, settings))
+    # cherrypy.config.update({'server.socket_port': int(settings["apiPort"])})
+    cherrypy.tree.mount(catalog, '/', conf)
+    try:
+        cherrypy.engine.start()
+        cherrypy.engine.block()
+    except (KeyboardInterrupt, SystemExit):
+        catalog.stop()
+        cherrypy.engine.exit()
+        print("Catalog REST server stopped.")
 
 # Signal handling for shutdown with stopping the container
 import signal
@@ -487,8 +799,10 @@ signal.signal(signal.SIGTERM, handle_stop)
 if __name__ == '__main__':
     # if previous devices are present and theyare not used anymore, 
     # they will be removed by the device manager
+    # a different settings file can be given as argument, e.g. to start a shard or the router
+    settings_file = sys.argv[1] if len(sys.argv) > 1 else 'settings.json'
     try:
-        with open('settings.json') as f:
+        with open(settings_file) as f:
             settings = json.load(f)
     except json.JSONDecodeError as e:
         print(f"CATALOG: Error loading json settings: {e}")
@@ -496,21 +810,10 @@ if __name__ == '__main__':
     except FileNotFoundError as e:
         print(f"CATALOG: Json settings file not found")
         exit(1)
-    catalog = Catalog(settings)
-    conf = {
-        '/': {
-            'request.dispatch': cherrypy.dispatch.MethodDispatcher(),
-            'tools.sessions.on': True
-        }
-    }
-    cherrypy.config.update({'server.socket_host': '0.0.0.0', 'server.socket_port': 80, 'engine.autoreload.on': False})
-    # cherrypy.config.update({'server.socket_port': int(settings["apiPort"])})
-    cherrypy.tree.mount(catalog, '/', conf)
-    try:
-        cherrypy.engine.start()
-        cherrypy.engine.block()
-    except (KeyboardInterrupt, SystemExit):
-        catalog.stop()
-        cherrypy.engine.exit()
-        print("Catalog REST server stopped.")
-
+    # with a list of shards the process is the routing layer of a sharded catalog
+    if "shards" in settings:
+        from catalog_router import CatalogRouter
+        catalog = CatalogRouter(settings)
+    else:
+        catalog = Catalog(settings)
+    start_api(catalog, 80, settings)
@@ -0,0 +1,117 @@
+# CATALOG ASGI SERVER
+# asyncio serving mode for the catalog, selected with "serverMode": "asgi" in settings.json
+# The routes and their semantics are the ones of the Catalog class: the same GET/DELETE and
+# handlePOST/handlePUT methods are called, and cherrypy.HTTPError is mapped to the same status codes.
+# Connections are handled by the event loop, so thousands of idle keep-alive or long-poll
+# clients only cost a socket each; the handlers (file access, requests to the thingspeak adaptor)
+# are blocking, so they run on a bounded pool of worker threads.
+
+import asyncio
+import json
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qsl, unquote
+
+import cherrypy
+
+from admission import Rejected
+
+
+class CatalogASGI(object):
+    def __init__(self, catalog, workers=16, admission=None):
+        self.catalog = catalog
+        self.admission = admission
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='catalog_asgi')
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+            return
+        if scope['type'] != 'http':
+            return
+        method = scope['method']
+        uri = tuple(unquote(part) for part in scope['path'].split('/') if part)
+        params = dict(parse_qsl(scope['query_string'].decode('latin-1')))
+        request_headers = dict(scope.get('headers', []))
+        ifMatch = request_headers.get(b'if-match')
+        if ifMatch is not None:
+            ifMatch = ifMatch.decode('latin-1')
+        body = b''
+        if method in ('POST', 'PUT', 'PATCH'):
+            more_body = True
+            while more_body:
+                message = await receive()
+                body += message.get('body', b'')
+                more_body = message.get('more_body', False)
+        loop = asyncio.get_event_loop()
+        headers = [(b'content-type', b'text/html;charset=utf-8')]
+        kind = None
+        try:
+            # requests waiting for a worker thread are bounded by the admission controller
+            if self.admission is not None:
+                client = scope['client'][0] if scope.get('client') else ''
+                forwarded = request_headers.get(b'x-forwarded-for')
+                client = self.admission.clientOf(client, forwarded.decode('latin-1') if forwarded else None)
+                kind = self.admission.admit(client, method, uri)
+            output = await loop.run_in_executor(self.executor, self.dispatch, method, uri, params, body, ifMatch)
+            status = 200
+        except cherrypy.HTTPError as e:
+            status, output = e.code, e._message
+            if isinstance(e, Rejected):
+                headers.append((b'retry-after', str(e.retry_after).encode()))
+        except Exception as e:
+            print(f"Catalog: Error serving {method} {scope['path']}: {e}")
+            status, output = 500, f"Catalog: internal error: {e}"
+        finally:
+            if kind is not None:
+                self.admission.release(kind)
+        output = output.encode('utf-8')
+        headers.append((b'content-length', str(len(output)).encode()))
+        await send({
+            'type': 'http.response.start',
+            'status': status,
+            'headers': headers,
+        })
+        await send({'type': 'http.response.body', 'body': output})
+
+# call the Catalog handler for the method, in a worker thread
+    def dispatch(self, method, uri, params, body, ifMatch=None):
+        if method == 'GET':
+            return self.catalog.GET(*uri, **params)
+        if method == 'DELETE':
+            return self.catalog.DELETE(*uri, **params)
+        if method in ('POST', 'PUT', 'PATCH'):
+            try:
+                body = json.loads(body.decode('utf-8'))
+            except ValueError:
+                raise cherrypy.HTTPError(status=400, message=f'Catalog: invalid JSON body in {method}')
+            if method == 'POST':
+                return self.catalog.handlePOST(uri, params, body)
+            if method == 'PATCH':
+                return self.catalog.handlePATCH(uri, params, body, ifMatch)
+            return self.catalog.handlePUT(uri, params, body, ifMatch)
+        raise cherrypy.HTTPError(status=405, message=f'Catalog: method {method} not allowed')
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self.executor.shutdown(wait=False)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+
+# run the catalog with uvicorn on the given port
+def serve(catalog, api_port, asgi_settings={}, admission=None):
+    import uvicorn
+    app = CatalogASGI(catalog, workers=asgi_settings.get("workers", 16), admission=admission)
+    uvicorn.run(app,
+                host='0.0.0.0',
+                port=int(api_port),
+                loop='asyncio',
+                lifespan='on',
+                access_log=False,
+                log_level=asgi_settings.get("logLevel", "warning"),
+                backlog=asgi_settings.get("backlog", 8192),
+                timeout_keep_alive=asgi_settings.get("keepAliveTimeout", 75))
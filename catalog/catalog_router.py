@@ -0,0 +1,300 @@
+# CATALOG ROUTER
+# routing layer for the sharded deployment of the catalog
+# patients are partitioned by a hash of their patientID over several catalog instances (shards),
+# and their devices and medications are stored on the same shard of their patient.
+# Services, chats and leases do not belong to any patient, so they are kept on the first shard.
+# The router exposes the same URL API of the catalog: requests for a single patient go to one shard,
+# list endpoints are sent to all shards in parallel and the results are merged (scatter/gather).
+# A device or medication is on the shard of its patient: when only its ID is known, the shard is found with a GET
+# on all shards (only reads are scattered), and the writes are then sent to that shard only.
+
+import collections
+import json
+import zlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import cherrypy
+import requests
+
+# collections partitioned by patientID, the others are stored on the first shard
+PARTITIONED = ["patients", "devices", "medications"]
+COLLECTIONS = ["devices", "services", "patients", "medications", "chats", "leases"]
+# key used in the single entity responses of the catalog, e.g. GET /devices/1 -> {"device": ...}
+SINGULAR = {"devices": "device", "services": "service", "patients": "patient", "medications": "medication", "chats": "chat", "leases": "lease"}
+
+
+def shardIndex(patientID, shards_number):
+    try:
+        patientID = int(patientID)
+    except (TypeError, ValueError):
+        raise cherrypy.HTTPError(status=400, message='Catalog router: patientID must be an integer')
+    return zlib.crc32(str(patientID).encode()) % shards_number
+
+
+class CatalogRouter(object):
+    exposed = True
+
+    def __init__(self, settings):
+        if settings is None:
+            raise ValueError("Settings cannot be None")
+        if "shards" not in settings or not settings["shards"]:
+            raise ValueError("Settings must contain the list of catalog 'shards' URLs")
+        self.shards = [url.rstrip('/') for url in settings["shards"]]
+        self.timeout = settings.get("shardTimeout", 10)
+        # one session per shard, so that connections to the shards are kept alive and reused
+        self.sessions = [requests.Session() for _ in self.shards]
+        self.executor = ThreadPoolExecutor(max_workers=max(4, 2 * len(self.shards)), thread_name_prefix='catalog_router')
+        # shard where a device or medication has been seen, to avoid scatter requests on single lookups,
+        # the least recently used are evicted
+        self.locations = collections.OrderedDict()
+        self.locations_size = settings.get("locationCacheSize", 10000)
+        self.lock = threading.Lock()
+
+    def stop(self):
+        print("Stopping Catalog router")
+        self.executor.shutdown(wait=False)
+
+# X-Forwarded-For of the request being served, with the address of its client: the shards rate limit the
+# clients of the router, not the router itself (see admission.py); read on the thread serving the request
+    def forwardedFor(self):
+        request = cherrypy.serving.request
+        forwarded = request.headers.get('X-Forwarded-For')
+        return f"{forwarded}, {request.remote.ip}" if forwarded else request.remote.ip
+
+# send a request to a shard, any connection error is reported as 503
+    def forward(self, shard, method, uri, params=None, body=None, ifMatch=None, forwarded=None):
+        url = f"{self.shards[shard]}/{'/'.join(str(u) for u in uri)}"
+        headers = {'X-Forwarded-For': forwarded or self.forwardedFor()}
+        if ifMatch is not None:
+            headers['If-Match'] = ifMatch
+        try:
+            return self.sessions[shard].request(method, url, params=params, headers=headers,
+                                                data=json.dumps(body) if body is not None else None,
+                                                timeout=self.timeout)
+        except requests.exceptions.RequestException as e:
+            raise cherrypy.HTTPError(status=503, message=f'Catalog router: shard {self.shards[shard]} not reachable: {e}')
+
+# send the same request to all shards in parallel
+    def scatter(self, method, uri, params=None, body=None, ifMatch=None):
+        forwarded = self.forwardedFor()
+        futures = [self.executor.submit(self.forward, shard, method, uri, params, body, ifMatch, forwarded) for shard in range(len(self.shards))]
+        return [future.result() for future in futures]
+
+    def output(self, response):
+        if response.status_code != 200:
+            raise cherrypy.HTTPError(status=response.status_code, message=response.text)
+        return response.text
+
+    def remember(self, collection, entityID, shard):
+        with self.lock:
+            self.locations[(collection, str(entityID))] = shard
+            self.locations.move_to_end((collection, str(entityID)))
+            while len(self.locations) > self.locations_size:
+                self.locations.popitem(last=False)
+
+    def forget(self, collection, entityID):
+        with self.lock:
+            self.locations.pop((collection, str(entityID)), None)
+
+# shard that owns a request, None if it must be found by asking all shards
+    def owner(self, collection, entityID=None, body=None):
+        if collection not in PARTITIONED:
+            return 0
+        if collection == "patients":
+            if body is not None:
+                return shardIndex(body.get('ID'), len(self.shards))
+            return shardIndex(entityID, len(self.shards))
+        if body is not None and 'patientID' in body:
+            return shardIndex(body['patientID'], len(self.shards))
+        with self.lock:
+            shard = self.locations.get((collection, str(entityID)))
+            if shard is not None:
+                self.locations.move_to_end((collection, str(entityID)))
+            return shard
+
+# look for a single device or medication with a GET on all shards, its shard is the one of its patient;
+# returns (shard, response of the shard that has it), or (None, 404 or error response) if no shard has it
+    def locate(self, collection, entityID, params=None):
+        last = None
+        for response in self.scatter('GET', (collection, entityID), params):
+            if response.status_code == 200:
+                shard = shardIndex(response.json()[SINGULAR[collection]]['patientID'], len(self.shards))
+                self.remember(collection, entityID, shard)
+                return shard, response
+            if last is None or last.status_code == 404:
+                last = response
+        return None, last
+
+# send a write to the shard that owns the entity, found with locate for a device or medication if not known;
+# the patientID in the body of a PUT (the whole entity) gives its shard, a PATCH may carry only some fields
+    def write(self, method, uri, entityID, params=None, body=None, ifMatch=None):
+        shard = self.owner(uri[0], entityID, body if method == 'PUT' else None)
+        if shard is None:
+            shard, response = self.locate(uri[0], entityID)
+            if shard is None:
+                return response
+            return self.forward(shard, method, uri, params, body, ifMatch)
+        response = self.forward(shard, method, uri, params, body, ifMatch)
+        # the known location of a device or medication may be stale
+        if response.status_code == 404 and uri[0] in ["devices", "medications"]:
+            self.forget(uri[0], entityID)
+            located, _ = self.locate(uri[0], entityID)
+            if located is not None and located != shard:
+                response = self.forward(located, method, uri, params, body, ifMatch)
+        return response
+
+# merge the lists returned by all shards
+    def gather(self, uri, params):
+        responses = self.scatter('GET', uri, params)
+        for response in responses:
+            if response.status_code != 200:
+                raise cherrypy.HTTPError(status=response.status_code, message=response.text)
+        merged = {}
+        for response in responses:
+            for key, value in response.json().items():
+                merged.setdefault(key, []).extend(value)
+        for key in merged:
+            merged[key].sort(key=lambda entity: str(entity.get('ID')))
+        return json.dumps(merged)
+
+# GET /<collection>?ids=... on all shards: an ID is missing only if no shard has it
+    def gatherIDs(self, uri, params):
+        responses = self.scatter('GET', uri, params)
+        for response in responses:
+            if response.status_code != 200:
+                raise cherrypy.HTTPError(status=response.status_code, message=response.text)
+        found = {}
+        missing = None
+        for response in responses:
+            result = response.json()
+            for entity in result[uri[0]]:
+                found[str(entity['ID'])] = entity
+            shard_missing = [str(entityID) for entityID in result["missing"]]
+            missing = set(shard_missing) if missing is None else missing & set(shard_missing)
+        entities = []
+        missing_ids = []
+        for entityID in params['ids'].split(','):
+            entityID = entityID.strip()
+            if not entityID:
+                continue
+            key = entityID if uri[0] == "chats" else str(int(entityID))
+            if key in found:
+                entities.append(found[key])
+            elif key in missing:
+                missing_ids.append(entityID if uri[0] == "chats" else int(entityID))
+        return json.dumps({uri[0]: entities, "missing": missing_ids})
+
+# DELETE /<collection>?ids=... on all shards: each shard removes the IDs it has,
+# an ID is missing only if no shard had it
+    def deleteIDs(self, uri, params):
+        responses = self.scatter('DELETE', uri, params)
+        for response in responses:
+            if response.status_code != 200:
+                raise cherrypy.HTTPError(status=response.status_code, message=response.text)
+        removed = []
+        missing = None
+        for response in responses:
+            result = response.json()
+            removed.extend(result["removed"])
+            missing = set(result["missing"]) if missing is None else missing & set(result["missing"])
+        for entityID in removed:
+            self.forget(uri[0], entityID)
+        return json.dumps({"removed": removed, "missing": sorted(missing)})
+
+    def GET(self, *uri, **params):
+        if len(uri) == 0:
+            raise cherrypy.HTTPError(status=400, message='Catalog: GET with empty URI')
+        if uri[0] == 'all':
+            return self.gather(uri, params)
+        if uri[0] not in COLLECTIONS:
+            raise cherrypy.HTTPError(status=400, message='Catalog: GET URI not managed')
+        if len(uri) == 1:
+            if uri[0] in PARTITIONED:
+                if 'ids' in params:
+                    return self.gatherIDs(uri, params)
+                return self.gather(uri, params)
+            return self.output(self.forward(0, 'GET', uri, params))
+        shard = self.owner(uri[0], uri[1])
+        if shard is None and len(uri) == 2:
+            return self.output(self.locate(uri[0], uri[1], params)[1])
+        if shard is None:
+            # e.g. GET /devices/<ID>/channel, sent to the shard of the device
+            shard, response = self.locate(uri[0], uri[1])
+            if shard is None:
+                return self.output(response)
+        response = self.forward(shard, 'GET', uri, params)
+        # the known location of a device or medication may be stale
+        if response.status_code == 404 and uri[0] in ["devices", "medications"]:
+            self.forget(uri[0], uri[1])
+            located, _ = self.locate(uri[0], uri[1])
+            if located is not None and located != shard:
+                response = self.forward(located, 'GET', uri, params)
+        return self.output(response)
+
+    def POST(self, *uri, **params):
+        json_body = cherrypy.request.body.read()
+        return self.handlePOST(uri, params, json.loads(json_body.decode('utf-8')))
+
+    def handlePOST(self, uri, params, body):
+        if len(uri) == 0:
+            raise cherrypy.HTTPError(status=400, message='Catalog: POST with empty URI')
+        if uri[0] not in COLLECTIONS:
+            raise cherrypy.HTTPError(status=400, message='Catalog: POST URI not managed')
+        if uri[0] in ["devices", "medications"] and 'patientID' not in body:
+            raise cherrypy.HTTPError(status=400, message='Catalog: missing patientID in POST body')
+        if 'ID' not in body:
+            raise cherrypy.HTTPError(status=400, message='Catalog: missing ID in POST body')
+        if uri[0] in ["devices", "medications"]:
+            # IDs must stay unique over all the shards, not only on the shard of the patient
+            for response in self.scatter('GET', (uri[0], body['ID'])):
+                if response.status_code == 200:
+                    raise cherrypy.HTTPError(status=400, message=f'Catalog: {SINGULAR[uri[0]].capitalize()} with ID {body["ID"]} already in catalog')
+        shard = self.owner(uri[0], body=body)
+        output = self.output(self.forward(shard, 'POST', uri, params, body))
+        if uri[0] in ["devices", "medications"]:
+            self.remember(uri[0], body['ID'], shard)
+        return output
+
+    def PUT(self, *uri, **params):
+        json_body = cherrypy.request.body.read()
+        return self.handlePUT(uri, params, json.loads(json_body.decode('utf-8')), cherrypy.request.headers.get('If-Match'))
+
+    def handlePUT(self, uri, params, body, ifMatch=None):
+        if len(uri) == 0:
+            raise cherrypy.HTTPError(status=400, message='Catalog: PUT with empty URI')
+        if 'ID' not in body:
+            raise cherrypy.HTTPError(status=400, message='Catalog: missing ID in PUT body')
+        if uri[0] not in COLLECTIONS:
+            raise cherrypy.HTTPError(status=400, message='Catalog: PUT URI not managed')
+        return self.output(self.write('PUT', uri, body['ID'], params, body, ifMatch))
+
+    def PATCH(self, *uri, **params):
+        json_body = cherrypy.request.body.read()
+        return self.handlePATCH(uri, params, json.loads(json_body.decode('utf-8')), cherrypy.request.headers.get('If-Match'))
+
+    def handlePATCH(self, uri, params, body, ifMatch=None):
+        if len(uri) == 0:
+            raise cherrypy.HTTPError(status=400, message='Catalog: PATCH with empty URI')
+        if uri[0] not in COLLECTIONS:
+            raise cherrypy.HTTPError(status=400, message='Catalog: PATCH URI not managed')
+        if len(uri) < 2 and 'ID' not in body:
+            raise cherrypy.HTTPError(status=400, message='Catalog: missing ID in PATCH')
+        entityID = uri[1] if len(uri) > 1 else body['ID']
+        return self.output(self.write('PATCH', uri, entityID, params, body, ifMatch))
+
+    def DELETE(self, *uri, **params):
+        if len(uri) == 0:
+            raise cherrypy.HTTPError(status=400, message='Catalog: DELETE with empty URI')
+        if uri[0] not in COLLECTIONS:
+            raise cherrypy.HTTPError(status=400, message='Catalog: DELETE URI not managed')
+        if len(uri) < 2:
+            if 'ids' not in params:
+                raise cherrypy.HTTPError(status=400, message='Catalog: no ID provided for deletion')
+            if uri[0] in ["devices", "medications"]:
+                return self.deleteIDs(uri, params)
+            return self.output(self.forward(0, 'DELETE', uri, params))
+        response = self.write('DELETE', uri, uri[1], params)
+        if uri[0] in ["devices", "medications"]:
+            self.forget(uri[0], uri[1])
+        return self.output(response)
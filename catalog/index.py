@@ -0,0 +1,100 @@
+# CATALOG INDEX
+# primary-key index of the catalog collections, used instead of scanning a whole collection
+# to find one entity by ID, and precomputed resolution of the devices (see resolveDevice).
+# For each collection the index keeps {ID: position in the collection list}: updates replace the
+# entity in the same position and additions append it at the end, so the index stays valid;
+# removals shift the positions, so the index of the collection is dropped and built again
+# the next time it is used. Every lookup checks the ID of the entity found, so a stale
+# position is never returned.
+
+import json
+
+# chats are identified by the telegram chat ID (a string), the other entities by an integer
+STRING_IDS = ["chats"]
+
+
+def indexKey(collection, entityID):
+    if collection in STRING_IDS:
+        return str(entityID)
+    return str(int(entityID))
+
+
+class CatalogIndex(object):
+    def __init__(self, catalog):
+        self.catalog = catalog
+        self.positions = {}
+        # deviceID -> serialized {device, patientID, thingspeak_info}, and the devices resolved for each patient
+        self.resolved = {}
+        self.patient_devices = {}
+
+    def build(self, collection):
+        positions = {}
+        for position, entity in enumerate(self.catalog[collection]):
+            try:
+                positions[indexKey(collection, entity['ID'])] = position
+            except (KeyError, TypeError, ValueError):
+                continue
+        self.positions[collection] = positions
+        return positions
+
+# entity with the given ID or None, entityID must be valid for the collection (see indexKey)
+    def get(self, collection, entityID):
+        key = indexKey(collection, entityID)
+        positions = self.positions.get(collection)
+        if positions is None:
+            positions = self.build(collection)
+        entities = self.catalog[collection]
+        for _ in range(2):
+            position = positions.get(key)
+            if position is None:
+                return None
+            if position < len(entities) and indexKey(collection, entities[position].get('ID')) == key:
+                return entities[position]
+            # the collection has been changed without updating the index
+            positions = self.build(collection)
+        return None
+
+    def contains(self, collection, entityID):
+        return self.get(collection, entityID) is not None
+
+# called after an entity has been appended to its collection
+    def added(self, collection):
+        positions = self.positions.get(collection)
+        if positions is not None:
+            entities = self.catalog[collection]
+            positions[indexKey(collection, entities[-1]['ID'])] = len(entities) - 1
+
+# called after an entity has been updated: the resolutions that include it are computed again
+    def changed(self, collection, entityID):
+        key = indexKey(collection, entityID)
+        if collection == "devices":
+            self.resolved.pop(key, None)
+        elif collection == "patients":
+            for deviceKey in self.patient_devices.pop(key, ()):
+                self.resolved.pop(deviceKey, None)
+
+# called after entities have been removed from the given collections
+    def invalidate(self, collections):
+        for collection in collections:
+            self.positions.pop(collection, None)
+        if "devices" in collections or "patients" in collections:
+            self.resolved = {}
+            self.patient_devices = {}
+
+# device with its patientID and the thingspeak_info of the patient, used for every measurement
+# by the thingspeak adaptor; the response is serialized once and kept until the device or its patient change.
+# Returns None if the device is not in the catalog, raises KeyError if its patient is not.
+    def resolveDevice(self, deviceID):
+        key = indexKey("devices", deviceID)
+        if key in self.resolved:
+            return self.resolved[key]
+        device = self.get("devices", deviceID)
+        if device is None:
+            return None
+        patient = self.get("patients", device['patientID'])
+        if patient is None:
+            raise KeyError(device['patientID'])
+        output = json.dumps({"device": device, "patientID": patient['ID'], "thingspeak_info": patient.get('thingspeak_info', {})})
+        self.resolved[key] = output
+        self.patient_devices.setdefault(indexKey("patients", patient['ID']), set()).add(key)
+        return output
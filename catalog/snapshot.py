@@ -0,0 +1,123 @@
+# CATALOG SNAPSHOT
+# compact binary persistence of the catalog, used instead of parsing catalog.json at every start
+# file layout:
+#   b'CNSNAP1\n' | header length (4 bytes, big endian) | header | collection blobs
+# the header is a MessagePack map {collection: [offset, length]} and every collection is stored as
+# a separate MessagePack blob, so the file is memory-mapped at startup and each collection is
+# decoded only the first time it is used.
+
+import mmap
+import os
+import struct
+
+import msgpack
+
+MAGIC = b'CNSNAP1\n'
+COLLECTIONS = ["devices", "services", "patients", "medications", "chats", "leases"]
+
+
+class SnapshotError(Exception):
+    pass
+
+
+# catalog dictionary that decodes its collections from a memory-mapped snapshot on first access
+class LazyCatalog(dict):
+    def __init__(self, path=None):
+        super().__init__()
+        self.path = path
+        self.mapped = None
+        self.index = {}
+        if path is not None:
+            self.open(path)
+
+    def open(self, path):
+        with open(path, 'rb') as f:
+            try:
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                raise SnapshotError(f"Snapshot {path} is empty")
+        if mapped[:len(MAGIC)] != MAGIC:
+            mapped.close()
+            raise SnapshotError(f"Snapshot {path} has an unknown format")
+        start = len(MAGIC) + 4
+        header_length = struct.unpack('>I', mapped[len(MAGIC):start])[0]
+        try:
+            index = msgpack.unpackb(mapped[start:start + header_length])
+        except Exception as e:
+            mapped.close()
+            raise SnapshotError(f"Snapshot {path} has a corrupted header: {e}")
+        if self.mapped is not None:
+            self.mapped.close()
+        self.mapped = mapped
+        self.index = {key: (start + header_length + offset, length) for key, (offset, length) in index.items()}
+
+    def raw(self, key):
+        offset, length = self.index[key]
+        return self.mapped[offset:offset + length]
+
+    def __missing__(self, key):
+        if key not in self.index:
+            raise KeyError(key)
+        value = msgpack.unpackb(self.raw(key))
+        dict.__setitem__(self, key, value)
+        return value
+
+    def __contains__(self, key):
+        return dict.__contains__(self, key) or key in self.index
+
+    def keys(self):
+        return list(dict.fromkeys(list(dict.keys(self)) + list(self.index)))
+
+    def get(self, key, default=None):
+        return self[key] if key in self else default
+
+# decode all collections, e.g. before serializing the whole catalog
+    def load(self):
+        for key in self.keys():
+            self[key]
+        return dict(self)
+
+    def close(self):
+        if self.mapped is not None:
+            self.mapped.close()
+            self.mapped = None
+
+
+# collections of the snapshot, taken while the catalog cannot change: the changed collections are copied as
+# lists of references (the catalog never changes an entity in place, it replaces it), the others are the blobs
+# of the currently mapped file, copied without decoding and encoding them again
+def collectSnapshot(catalog, changed=None):
+    collections = {}
+    for key in catalog.keys():
+        if isinstance(catalog, LazyCatalog) and changed is not None and key not in changed and key in catalog.index:
+            collections[key] = catalog.raw(key)
+        else:
+            value = catalog[key]
+            collections[key] = list(value) if isinstance(value, list) else value
+    return collections
+
+
+# encode the collections of collectSnapshot, which no longer change with the catalog
+def encodeSnapshot(collections):
+    blobs = {key: value if isinstance(value, bytes) else msgpack.packb(value) for key, value in collections.items()}
+    index = {}
+    offset = 0
+    for key, blob in blobs.items():
+        index[key] = [offset, len(blob)]
+        offset += len(blob)
+    header = msgpack.packb(index)
+    return b''.join([MAGIC, struct.pack('>I', len(header)), header] + list(blobs.values()))
+
+
+def packSnapshot(catalog, changed=None):
+    return encodeSnapshot(collectSnapshot(catalog, changed))
+
+
+# replace the snapshot file atomically, a crash while writing leaves the previous snapshot valid
+def writeSnapshot(path, data):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
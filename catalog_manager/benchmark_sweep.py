@@ -0,0 +1,87 @@
+# Benchmark of the consistency checks of the catalog manager (planSweep) on a synthetic catalog
+# usage: python3 benchmark_sweep.py [devices ...]        (default: 10000 100000 devices)
+# the catalog has one patient every 4 devices and 2 medications per patient; 1% of the devices
+# and medications are orphaned, 5% of the devices are stale and 1% of the patients list a device
+# that is not in the catalog. The same sweep is timed with the previous list based checks.
+
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from sweep import planSweep
+
+THRESHOLD = 300
+REPEAT = 3
+
+
+def synthetic(devices_number, now):
+    random.seed(devices_number)
+    patients_number = max(1, devices_number // 4)
+    patients = [{"ID": i, "devices": [], "medications": [], "version": 1} for i in range(1, patients_number + 1)]
+    devices = []
+    medications = []
+    for i in range(1, devices_number + 1):
+        orphan = random.random() < 0.01
+        patientID = patients_number + i if orphan else random.randint(1, patients_number)
+        stale = random.random() < 0.05
+        devices.append({"ID": i, "patientID": patientID, "last_update": now - (2 * THRESHOLD if stale else 10)})
+        if not orphan:
+            patients[patientID - 1]["devices"].append({"deviceID": i})
+    for i in range(1, 2 * patients_number + 1):
+        orphan = random.random() < 0.01
+        patientID = patients_number + i if orphan else random.randint(1, patients_number)
+        medications.append({"ID": i, "patientID": patientID})
+        if not orphan:
+            patients[patientID - 1]["medications"].append({"medicationID": i})
+    for patient in random.sample(patients, max(1, patients_number // 100)):
+        patient["devices"].append({"deviceID": devices_number + 1})
+    return {"patients": patients, "devices": devices, "medications": medications, "services": [], "chats": []}
+
+
+# checks done before planSweep: a list of the patient IDs is built and scanned for every device and medication
+def listSweep(snapshot, now, threshold):
+    patients = snapshot["patients"]
+    removed = []
+    for device in snapshot["devices"]:
+        if int(device['patientID']) not in [int(patient['ID']) for patient in patients]:
+            removed.append(device['ID'])
+        elif now - device['last_update'] > threshold:
+            removed.append(device['ID'])
+    for medication in snapshot["medications"]:
+        if int(medication['patientID']) not in [int(patient['ID']) for patient in patients]:
+            removed.append(medication['ID'])
+    return removed
+
+
+def timed(function, *args):
+    best = None
+    for _ in range(REPEAT):
+        t0 = time.perf_counter()
+        result = function(*args)
+        elapsed = time.perf_counter() - t0
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main(device_counts):
+    print(f"{'devices':>9}{'patients':>10}{'plan ms':>10}{'removals':>10}{'repairs':>9}{'list ms':>12}")
+    for devices_number in device_counts:
+        now = time.time()
+        snapshot = synthetic(devices_number, now)
+        elapsed, plan = timed(planSweep, snapshot, now, THRESHOLD)
+        removals = len(plan["devices"]) + len(plan["services"]) + len(plan["medications"])
+        # the list based checks are quadratic, they are timed once and only on small catalogs
+        if devices_number <= 20000:
+            t0 = time.perf_counter()
+            listSweep(snapshot, now, THRESHOLD)
+            list_ms = f"{(time.perf_counter() - t0) * 1000:.0f}"
+        else:
+            list_ms = "skipped"
+        print(f"{devices_number:>9}{len(snapshot['patients']):>10}{elapsed * 1000:>10.1f}{removals:>10}"
+              f"{len(plan['patients']):>9}{list_ms:>12}")
+
+
+if __name__ == '__main__':
+    main([int(n) for n in sys.argv[1:]] or [10000, 100000])
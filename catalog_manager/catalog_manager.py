@@ -1,20 +1,51 @@
 # CATALOG MANAGER
 # deletes inactive devices, services and checks if any device or medication has been left while the
-# their patient has been removed
+# their patient has been removed, and removes from the patients the references to devices and medications
+# that are not in the catalog anymore (the checks are in sweep.py)
+# With liveness enabled, the manager also subscribes to the sensor telemetry: a device that publishes
+# measurements is alive even without HTTP heartbeats, and it is removed as soon as it has been silent
+# (no measurement and no heartbeat) for threshold seconds
+# With leases enabled, several managers can run together: each one checks only the partitions of the
+# entity IDs it holds a lease on (see partitions.py)
 # People are not checked, as they are only removed by the telegram bot command
 # and not by the catalog manager.
 import requests
+import os
+import sys
+# the common modules are copied next to the service in the docker image, and are in ../common otherwise
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'common'))
+from catalog_client import CatalogClient
+from registration import register, unregister
+from sweep import planSweep, restrictPlan, entityKey
+from timing_wheel import TimingWheel
+from partitions import PartitionLeases
+from MQTT_base import *
+from log import setupLogging
 import json
 import time
 import threading
+import uuid
+import cherrypy
+from concurrent.futures import ThreadPoolExecutor
+
+# collections whose entities are removed by the sweeps
+REMOVED_COLLECTIONS = ['devices', 'services', 'medications', 'leases']
+
+
+def newLatency():
+    return {"requests": 0, "total": 0.0, "max": 0.0}
+
 
 class CatalogManager(object):
+    exposed = True
+
     def __init__(self, settings):
         if settings is None:
             raise ValueError("Settings cannot be None")
         if 'catalogURL' not in settings or 'threshold' not in settings or 'controlInterval' not in settings or 'serviceInfo' not in settings:
             raise ValueError("Settings must contain 'catalogURL', 'threshold', 'controlInterval', 'serviceInfo', and 'pingInterval'")
         self.catalogURL = settings['catalogURL']
+        self.catalog = CatalogClient(self.catalogURL, settings.get('catalogClient', {}))
         self.threshold = settings['threshold']
         self.controlInterval = settings['controlInterval']
         self.serviceInfo = settings['serviceInfo']
@@ -24,267 +55,299 @@ class CatalogManager(object):
             self.pingInterval = 10
         else:
             self.pingInterval = settings['pingInterval']
-        self.serviceID = None
-        self.serviceInfo['ID'] = self.assign_serviceID()
-        self.serviceID = self.serviceInfo['ID']
-        
+        # removals are sent in bulk (DELETE /<collection>?ids=...) in batches of deleteBatchSize IDs,
+        # or one by one by deleteWorkers threads if the catalog does not support bulk removal
+        self.deleteBatchSize = settings.get('deleteBatchSize', 500)
+        self.deleteWorkers = settings.get('deleteWorkers', 8)
+        # several instances split the entity IDs in partitions, coordinated with leases stored in the catalog
+        self.leases = None
+        leases = settings.get('leases', {})
+        if leases.get('enabled', False):
+            self.leases = PartitionLeases(self.catalog, str(uuid.uuid1()), self.serviceInfo['serviceName'],
+                                          leases.get('partitions', 16), leases.get('duration', 30))
+            # the instances are counted by their registration, which must be renewed within a lease duration
+            self.pingInterval = min(self.pingInterval, self.leases.duration / 3)
+        # dry run: the sweeps compute and report what would be removed, without changing the catalog
+        self.dryRun = settings.get('dryRun', False)
+        # the metrics of the sweeps are served on GET /metrics, and published on metricsTopic if it is set
+        self.api_port = settings.get('apiPort', 80)
+        self.metricsTopic = settings.get('metricsTopic', '')
+        self.metrics = {"sweeps": 0, "dry_run": self.dryRun, "last_sweep": None,
+                        "totals": {"removed": 0, "failures": 0, "repairs": 0, "expired": 0}}
+        self.metricsLock = threading.Lock()
+        # event-driven liveness: the last time each device has been seen on MQTT is kept in a timing wheel,
+        # the catalog is asked only for the devices whose deadline has passed
+        self.liveness = settings.get('liveness', {})
+        self.wheel = None
+        self.client = None
+        if self.liveness.get('enabled', False):
+            self.wheel = TimingWheel(self.threshold, self.liveness.get('tick', 1), self.liveness.get('slots', 512))
+            self.wheelLock = threading.Lock()
+        if self.wheel is not None or self.metricsTopic:
+            if 'mqtt_data' not in settings or 'broker' not in settings['mqtt_data'] or 'port' not in settings['mqtt_data']:
+                raise ValueError("Settings must contain 'broker' and 'port' in 'mqtt_data' when liveness or metricsTopic are enabled")
+            self.broker = settings['mqtt_data']['broker']
+            self.port = settings['mqtt_data']['port']
+            self.topic = settings['mqtt_data'].get('mqtt_topic', 'project/sensors/{patientID}/{deviceID}/#')
+            self.clientID = clientIdentifier(settings['mqtt_data'])
+            self.client = MQTT_base(self.clientID, broker=self.broker, port=self.port, settings=settings['mqtt_data'])
+
         self.start()
 
     def start(self):
         print('Starting Catalog Manager')
-        self.registerService()
-        self.update_thread = threading.Thread(target=self.update_loop,daemon=True)
-        self.update_thread.start()
+        start_api(self, self.api_port)
+        self.registration = register(self.catalog, "services", self.serviceInfo, self.pingInterval)
+        if self.leases is not None:
+            self.leases.update()
+            leases_thread = threading.Thread(target=self.leases.loop, daemon=True, name='leases')
+            leases_thread.start()
+        if self.wheel is not None:
+            self.startLiveness()
         while True:
             self.removeInactive()
             time.sleep(self.controlInterval)
 
     def stop(self):
         print('Stopping Catalog Manager')
-        self.update_thread.join()
+        unregister(self.registration)
+        if self.client is not None:
+            self.client.stop()
+        cherrypy.engine.exit()
 
-# This function runs in a separate thread to update the service information in the catalog   
-    def update_loop(self):
-        while True:
-            self.updateService()
-            time.sleep(self.pingInterval)
+# GET /metrics returns the metrics of the last sweep and the totals since the start
+    def GET(self, *uri, **params):
+        if len(uri) == 0 or uri[0] != 'metrics':
+            raise cherrypy.HTTPError(status=400, message='CATALOG MANAGER: GET URI not managed')
+        with self.metricsLock:
+            metrics = dict(self.metrics)
+        if self.client is not None:
+            metrics["mqtt"] = self.client.metrics()
+        return json.dumps(metrics)
 
-# register service catalog manager to the catalog
-    def registerService(self):
-        print(f"Registering service {self.serviceInfo['ID']} in catalog")
-        registered = False
-        while not registered:
-            try:
-                request=requests.post(f'{self.catalogURL}/services',data=json.dumps(self.serviceInfo))
-            except requests.exceptions.RequestException:
-                print(f"Failed request for registering service {self.serviceID} in catalog, retrying...")
-                time.sleep(5)  # wait before retrying
-            if request.status_code != 200:
-                print(f"Failed to register service {self.serviceID} in catalog, retrying...")
-                registered = False
-                time.sleep(5)
-                self.serviceID = self.assign_serviceID()  # try to assign new id if old one is already used
-                self.serviceInfo['ID'] = self.serviceID
-            else:
-                registered = True
-        print(f"Service {self.serviceID} registered in catalog")
+# the devices already in the catalog are considered seen at startup, so that the devices that only publish
+# telemetry are not removed before the manager has received their first measurement
+    def startLiveness(self):
+        now = time.time()
+        with self.wheelLock:
+            for device in self.getSnapshot().get('devices', []):
+                key = entityKey(device.get('ID'))
+                if key is not None:
+                    self.wheel.touch(key, now)
+        self.client.route(self.topic, self.onMeasurement)
+        liveness_thread = threading.Thread(target=self.livenessLoop, daemon=True, name='liveness')
+        liveness_thread.start()
+        print(f"Liveness tracking started on topic {self.topic}, {len(self.wheel)} devices")
 
-# assign an ID to the service   
-    def assign_serviceID(self):
-        # Loop until a valid service ID is obtained
-        while True: 
-            try:
-                response = requests.get(f'{self.catalogURL}/services')
-            except requests.exceptions.RequestException:
-                print("Failed request for services from catalog, retrying...")
-                time.sleep(5)
-                continue
-            if response.status_code != 200:
-                print(f"Failed to get services from catalog, status code {response.status_code}, retrying...")
-                time.sleep(5)
-                continue
-            services = response.json()['services']
-            # If serviceID is already assigned, check if it exists in the catalog
-            if self.serviceID != None:  
-                if not any(service['ID'] == self.serviceInfo['ID'] for service in services):
-                    return self.serviceID
-                else:
-                    print(f"Service ID {self.serviceID} already used, assigning a new one")
-                    # if the serviceID is already used, assign the next available service ID, or 1 if no services are present
-                    if services != []:
-                        return max(service['ID'] for service in services) + 1
-                    else:
-                        return 1
-            else:
-                # assign the next available service ID, or 1 if no services are present
-                if services != []:
-                    return max(service['ID'] for service in services) + 1
-                else:
-                    return 1     
+# any measurement published by a sensor on project/sensors/<patientID>/<deviceID>/<field> proves that the device is alive
+    def onMeasurement(self, measurement):
+        key = entityKey(measurement.params.get('deviceID'))
+        if key is None:
+            return
+        with self.wheelLock:
+            self.wheel.touch(key, time.time())
+
+    def livenessLoop(self):
+        while True:
+            time.sleep(self.wheel.tick)
+            with self.wheelLock:
+                expired = self.wheel.advance(time.time())
+            if expired:
+                try:
+                    self.expireDevices(expired)
+                except Exception as e:
+                    # the devices are checked again by the next sweep
+                    print(f"CATALOG MANAGER: error removing expired devices: {e}")
 
-# update service catalog manager service in the catalog
-    def updateService(self):
+# devices not seen on MQTT for threshold seconds: they are removed if they have not sent a heartbeat either
+    def expireDevices(self, keys):
+        if self.leases is not None:
+            keys = [key for key in keys if self.leases.owns(key)]
+            if not keys:
+                return
         try:
-            request=requests.put(f'{self.catalogURL}/services',data=json.dumps(self.serviceInfo))
+            response = self.catalog.get('/devices', params={'ids': ','.join(str(key) for key in keys)}, ttl=0)
         except requests.exceptions.RequestException:
-            print(f"CATALOG MANAGER: failed request for updating service {self.serviceInfo['ID']} in catalog")
+            print(f"CATALOG MANAGER: failed request for {len(keys)} expired devices")
             return
-        if request.status_code != 200:
-            print(f"CATALOG MANAGER: failed to update service {self.serviceInfo['ID']} in catalog, registering again")
-            self.registerService()
+        if response.status_code != 200:
+            print(f"CATALOG MANAGER: failed to get expired devices, status code {response.status_code}")
+            return
+        now = time.time()
+        stale = [device['ID'] for device in response.json()['devices'] if now - device.get('last_update', 0) > self.threshold]
+        if not stale:
+            return
+        if self.dryRun:
+            print(f'DRY RUN: {len(stale)} devices would be removed since they have been silent for {self.threshold} s: {stale[:20]}')
+            return
+        removed = self.removeEntities('devices', stale, newLatency())
+        with self.metricsLock:
+            self.metrics["totals"]["expired"] += removed
+            self.metrics["totals"]["failures"] += len(stale) - removed
+        print(f'{removed} of {len(stale)} devices removed since they have been silent for {self.threshold} s')
 
-# get the list of devices from the catalog
-    def getDevices(self):
+# get the whole catalog with a single request: the catalog serves GET /all under its lock, so all the
+# checks of a sweep are done on one consistent view, and no entity is removed because of a change
+# that happened between two requests of the same sweep
+    def getSnapshot(self):
         while True:
             try:
-                response = requests.get(f'{self.catalogURL}/devices')
-            except KeyboardInterrupt:
-                raise
+                response = self.catalog.get('/all', ttl=0)
             except requests.exceptions.RequestException:
-                print("CATALOG MANAGER: failed request for devices from catalog, retrying...")
-                time.sleep(5)
+                print("CATALOG MANAGER: failed request for the catalog, retrying...")
+                self.catalog.backoff()
                 continue
             if response.status_code != 200:
-                print(f"CATALOG MANAGER: failed to get devices from catalog, status code {response.status_code}")
+                print(f"CATALOG MANAGER: failed to get the catalog, status code {response.status_code}, retrying...")
+                self.catalog.backoff()
                 continue
-            print('List of available devices obtained')
-            return response.json()['devices']
+            print('Catalog snapshot obtained')
+            return response.json()
 
-# get the list of services from the catalog
-    def getServices(self):
-        while True:
-            try:
-                response = requests.get(f'{self.catalogURL}/services')
-            except KeyboardInterrupt:
-                raise
-            except requests.exceptions.RequestException:
-                print("CATALOG MANAGER: failed request for services from catalog, retrying...")
-                time.sleep(5)
-                continue
-            if response.status_code != 200:
-                print(f"CATALOG MANAGER: failed to get services from catalog, status code {response.status_code}")
-                continue
-            print('List of available services obtained')
-            return response.json()['services']
+# latency of the removal requests, shared by the threads removing entities
+    def recordLatency(self, latency, elapsed):
+        with self.metricsLock:
+            latency["requests"] += 1
+            latency["total"] += elapsed
+            latency["max"] = max(latency["max"], elapsed)
 
-# get the list of medications from the catalog
-    def getMedications(self):
-        while True:
-            try:
-                response = requests.get(f'{self.catalogURL}/medications')
-            except requests.exceptions.RequestException:
-                print("CATALOG MANAGER: failed request for medications from catalog, retrying...")
-                time.sleep(5)
-                continue
-            if response.status_code != 200:
-                print(f"CATALOG MANAGER: failed to get medications from catalog, status code {response.status_code}, retrying...")
-                continue
-            print('List of available medications obtained')
-            return response.json()['medications']
-    
-# get the list of patients from the catalog
-    def getPatients(self):
-        while True:
-            try:
-                request=requests.get(f'{self.catalogURL}/patients')
-            except requests.exceptions.RequestException:
-                print("CATALOG MANAGER: failed request for patients from catalog, retrying...")
-                time.sleep(5)
-                continue
-            if request.status_code != 200:
-                print(f"CATALOG MANAGER: failed to get patients from catalog, status code {request.status_code}, retrying...")
-                time.sleep(5)
-                continue
-            print('List of available patients obtained')
-            return request.json()['patients']
+# remove an entity from the catalog, returns True if it has been removed
+    def removeEntity(self, collection, entityID, latency):
+        name = collection[:-1]
+        t0 = time.time()
+        try:
+            request = self.catalog.delete(f'/{collection}/{entityID}')
+        except requests.exceptions.RequestException:
+            print(f"CATALOG MANAGER: failed request for removing {name} {entityID} from catalog")
+            return False
+        finally:
+            self.recordLatency(latency, time.time() - t0)
+        if request.status_code == 200:
+            return True
+        print(request.text)
+        print(f"CATALOG MANAGER: failed to remove {name} {entityID} from catalog")
+        return False
 
-# remove inactive devices, services and medications from the catalog
-    def removeInactive(self):
-        check= True
-        devices=self.getDevices()
-        if not devices:
-            print('No devices to check')
-        else:
-            patients = self.getPatients()
-            # if there are no patients, remove all devices
-            if not patients:
-                print('No patients, remove all devices')
-                for device in devices:
-                    try:
-                        request=requests.delete(f'{self.catalogURL}/devices/{device["ID"]}')
-                    except requests.exceptions.RequestException:
-                        print(f"CATALOG MANAGER: failed request for removing device {device['ID']} from catalog")
-                    if request.status_code == 200:
-                        print(f'Device {device["ID"]} has been removed')
-                    else:
-                        # print(request.text)
-                        print(f"CATALOG MANAGER: failed to remove device {device['ID']} from catalog")
-            # if there are patients, check if the devices are still associated with them and are updated
-            else:
-                for device in devices:
-                    # check if the device's patient is still in the catalog
-                    if int(device['patientID']) not in [int(patient['ID']) for patient in patients]:
-                        try:
-                            request=requests.delete(f'{self.catalogURL}/devices/{device["ID"]}')
-                        except requests.exceptions.RequestException:
-                            print(f"CATALOG MANAGER: failed request for removing device {device['ID']} from catalog")
-                        if request.status_code == 200:
-                            print(f'Device {device["ID"]} has been removed since its patient has been removed')
-                        else:
-                            print(request.text)
-                            print(f"CATALOG MANAGER: failed to remove device {device['ID']} from catalog")
-                        check = False
-                    # check if the device has not been updated for a long time
-                    if time.time()-device['last_update'] > self.threshold:
-                        try:
-                            request=requests.delete(f'{self.catalogURL}/devices/{device["ID"]}')
-                        except requests.exceptions.RequestException:
-                            print(f"CATALOG MANAGER: failed request for removing device {device['ID']} from catalog")
-                        if request.status_code == 200:
-                            print(f'Device {device["ID"]} has been removed')
-                        else:
-                            print(request.text)
-                            print(f"CATALOG MANAGER: failed to remove device {device['ID']} from catalog")
-                        check = False
-                if check:
-                    print('No devices to remove')
+# remove a batch of entities with one request, returns the number of removed entities,
+# or None if the catalog has not accepted the bulk removal
+    def removeBatch(self, collection, entityIDs, latency):
+        t0 = time.time()
+        try:
+            request = self.catalog.delete(f'/{collection}', params={'ids': ','.join(str(entityID) for entityID in entityIDs)})
+        except requests.exceptions.RequestException:
+            print(f"CATALOG MANAGER: failed request for removing {len(entityIDs)} {collection} from catalog")
+            return None
+        finally:
+            self.recordLatency(latency, time.time() - t0)
+        if request.status_code != 200:
+            print(f"CATALOG MANAGER: bulk removal of {collection} failed, status code {request.status_code}")
+            return None
+        return len(request.json()['removed'])
+
+# remove all the given entities of a collection, returns the number of removed entities
+    def removeEntities(self, collection, entityIDs, latency):
+        removed = 0
+        for i in range(0, len(entityIDs), self.deleteBatchSize):
+            batch = entityIDs[i:i + self.deleteBatchSize]
+            count = self.removeBatch(collection, batch, latency)
+            if count is None:
+                # removed one by one on a bounded pool, the connections are reused by the catalog client
+                with ThreadPoolExecutor(max_workers=self.deleteWorkers) as executor:
+                    count = sum(executor.map(lambda entityID: self.removeEntity(collection, entityID, latency), batch))
+            removed += count
+        return removed
 
-        check = True
-        services = self.getServices()
-        if not services:
-            print('No services to check')
+# remove the dangling references of a patient, only if it has not been changed since the snapshot
+    def repairPatient(self, repair):
+        headers = {'If-Match': str(repair['version'])} if repair['version'] is not None else None
+        try:
+            request = self.catalog.patch(f'/patients/{repair["ID"]}', repair['changes'], headers=headers)
+        except requests.exceptions.RequestException:
+            print(f"CATALOG MANAGER: failed request for repairing patient {repair['ID']} in catalog")
+            return False
+        if request.status_code == 200:
+            print(f"Patient {repair['ID']}: removed references to {', '.join(repair['changes'])} not in catalog")
+            return True
+        if request.status_code == 412:
+            print(f"CATALOG MANAGER: patient {repair['ID']} changed since the snapshot, it will be checked again in the next sweep")
         else:
-            for service in services:
-                # check if the service has not been updated for a long time
-                if time.time()-service['last_update'] > self.threshold:
-                    try:
-                        request=requests.delete(f'{self.catalogURL}/services/{service["ID"]}')
-                    except requests.exceptions.RequestException:
-                        print(f"CATALOG MANAGER: failed request for removing service {service['ID']} from catalog")
-                    if request.status_code == 200:
-                        print(f'Service {service["ID"]} has been removed')
-                    else:
-                        print(request.text)
-                        print(f"CATALOG MANAGER: failed to remove service {service['ID']} from catalog")
-                    check = False
-            if check:
-                print('No services to remove')
-        
-        check = True
-        medications = self.getMedications()
-        if not medications:
-            print('No medications to check')
+            print(f"CATALOG MANAGER: failed to repair patient {repair['ID']} in catalog, status code {request.status_code}")
+        return False
+
+# remove inactive devices, services and medications from the catalog, and the dangling references of the patients
+    def removeInactive(self):
+        start = time.time()
+        alive = ()
+        if self.wheel is not None:
+            with self.wheelLock:
+                alive = set(self.wheel.deadlines)
+        snapshot = self.getSnapshot()
+        plan = planSweep(snapshot, time.time(), self.threshold, alive)
+        if self.leases is not None:
+            plan = restrictPlan(plan, self.leases.owns)
+        sweep = {
+            "start": start,
+            "dry_run": self.dryRun,
+            "scanned": {collection: len(snapshot.get(collection, [])) for collection in REMOVED_COLLECTIONS + ['patients']},
+            "stale": {collection: sum(1 for _, reason in plan[collection] if reason == 'stale') for collection in REMOVED_COLLECTIONS},
+            "orphans": {collection: sum(1 for _, reason in plan[collection] if reason == 'orphan') for collection in REMOVED_COLLECTIONS},
+            "repairs": len(plan['patients']),
+            "removed": {},
+            "failures": {}
+        }
+        latency = newLatency()
+        if self.dryRun:
+            for repair in plan['patients']:
+                print(f"DRY RUN: patient {repair['ID']} would be repaired, references to {', '.join(repair['changes'])} not in catalog")
+            for collection in REMOVED_COLLECTIONS:
+                if plan[collection]:
+                    print(f"DRY RUN: {len(plan[collection])} {collection} would be removed: {[entityID for entityID, _ in plan[collection][:20]]}")
         else:
-            patients = self.getPatients()
-            # if there are no patients, remove all medications
-            if not patients:
-                print('No patients, remove all medications')
-                for medication in medications:
-                    try:
-                        request=requests.delete(f'{self.catalogURL}/medications/{medication["ID"]}')
-                    except requests.exceptions.RequestException:
-                        print(f"CATALOG MANAGER: failed request for removing medication {medication['ID']} from catalog")
-                    if request.status_code == 200:
-                        print(f'Medication {medication["ID"]} has been removed since its patient has been removed')
-                    else:
-                        # print(request.text)
-                        print(f"CATALOG MANAGER: failed to remove medication {medication['ID']} from catalog")
-            else:
-                # if there are patients, check if the medications are still associated with them 
-                for medication in medications:
-                    if int(medication['patientID']) not in [int(patient['ID']) for patient in patients]:
-                        try:
-                            request=requests.delete(f'{self.catalogURL}/medications/{medication["ID"]}')
-                        except requests.exceptions.RequestException:
-                            print(f"CATALOG MANAGER: failed request for removing medication {medication['ID']} from catalog")
-                        if request.status_code == 200:
-                            print(f'Medication {medication["ID"]} has been removed since its patient has been removed')
-                        else:
-                            print(request.text)
-                            print(f"CATALOG MANAGER: failed to remove medication {medication['ID']} from catalog")
-                        check = False
-                if check:
-                    print('No medications to remove')
+            # patients are repaired first, since removing their devices and medications changes their version
+            sweep["failures"]["patients"] = sum(1 for repair in plan['patients'] if not self.repairPatient(repair))
+            for collection in REMOVED_COLLECTIONS:
+                if not plan[collection]:
+                    continue
+                removed = self.removeEntities(collection, [entityID for entityID, _ in plan[collection]], latency)
+                sweep["removed"][collection] = removed
+                sweep["failures"][collection] = len(plan[collection]) - removed
+        sweep["duration"] = time.time() - start
+        sweep["delete_latency"] = {"requests": latency["requests"], "max": latency["max"],
+                                   "mean": latency["total"] / latency["requests"] if latency["requests"] else 0}
+        removed = sum(sweep["removed"].values())
+        sweep["throughput"] = removed / sweep["duration"] if sweep["duration"] > 0 else 0
+        self.recordSweep(sweep)
+
+# the metrics of the sweep are kept for GET /metrics, printed and published on MQTT
+    def recordSweep(self, sweep):
+        with self.metricsLock:
+            self.metrics["sweeps"] += 1
+            self.metrics["last_sweep"] = sweep
+            self.metrics["totals"]["removed"] += sum(sweep["removed"].values())
+            self.metrics["totals"]["failures"] += sum(sweep["failures"].values())
+            if not sweep["dry_run"]:
+                self.metrics["totals"]["repairs"] += sweep["repairs"] - sweep["failures"].get("patients", 0)
+        found = {collection: sweep["stale"][collection] + sweep["orphans"][collection] for collection in REMOVED_COLLECTIONS}
+        print(f"Sweep done in {sweep['duration']:.2f} s{' (dry run)' if sweep['dry_run'] else ''}: "
+              f"scanned {sweep['scanned']}, to remove {found}, removed {sweep['removed']}, failures {sweep['failures']}, "
+              f"{sweep['throughput']:.0f} removals/s")
+        if self.metricsTopic and self.client is not None:
+            try:
+                self.client.publish(self.metricsTopic, sweep)
+            except Exception as e:
+                print(f"CATALOG MANAGER: failed to publish the sweep metrics: {e}")
+
+# the metrics endpoint is served in the background, the sweeps run in the main thread
+def start_api(manager, api_port):
+    conf = {
+        '/': {
+            'request.dispatch': cherrypy.dispatch.MethodDispatcher(),
+            'tools.sessions.on': True
+        }
+    }
+    cherrypy.config.update({'server.socket_host': '0.0.0.0', 'server.socket_port': int(api_port), 'engine.autoreload.on': False})
+    cherrypy.tree.mount(manager, '/', conf)
+    cherrypy.engine.start()
 
 # Signal handling for shutdown with stopping the container
 import signal
@@ -308,6 +371,7 @@ if __name__ == '__main__':
     except FileNotFoundError as e:
         print(f"CATALOG MANAGER: Json settings file not found")
         exit(1)
+    setupLogging(settings.get('logging', {}))
     manager = None
     try:
         manager = CatalogManager(settings)
@@ -0,0 +1,122 @@
+# PARTITION LEASES
+# coordination of several catalog manager instances: the entity IDs are split in a fixed number of
+# partitions by a hash of the ID, and each instance checks only the partitions it holds a lease on.
+# Leases are entities of the "leases" collection of the catalog, {"ID": partition, "owner", "duration"},
+# and the catalog sets their expiration. Every duration / 3 seconds each instance:
+# - renews its leases, with If-Match on the version it has read, so that a lease changed by someone
+#   else is never overwritten
+# - takes the free and expired partitions, up to its fair share (partitions / live instances, the instances
+#   are the owners of valid leases and the services with the same serviceName updated in the last duration
+#   seconds, so that a new instance is counted before it holds any lease)
+# - releases the partitions over its fair share, so that a new instance gets its part
+# The partitions of an instance that stops are taken over by the others within one lease duration.
+
+import math
+import threading
+import time
+import zlib
+
+import requests
+
+
+def partitionOf(entityID, partitions):
+    return zlib.crc32(str(int(entityID)).encode()) % partitions
+
+
+class PartitionLeases(object):
+    def __init__(self, catalog, owner, serviceName, partitions=16, duration=30):
+        self.catalog = catalog
+        self.owner = owner
+        self.serviceName = serviceName
+        self.partitions = partitions
+        self.duration = duration
+        self.owned = set()
+        self.renewed = 0
+        self.lock = threading.Lock()
+
+    def owns(self, entityID):
+        try:
+            partition = partitionOf(entityID, self.partitions)
+        except (TypeError, ValueError):
+            return False
+        with self.lock:
+            return partition in self.owned
+
+    def getLeases(self):
+        response = self.catalog.get('/leases', ttl=0)
+        if response.status_code != 200:
+            raise requests.exceptions.RequestException(f"status code {response.status_code}")
+        return {int(lease['ID']): lease for lease in response.json()['leases']}
+
+# number of manager instances registered in the catalog, a new instance has no lease yet
+    def registeredInstances(self):
+        try:
+            response = self.catalog.get('/services', ttl=0)
+        except requests.exceptions.RequestException:
+            return 1
+        if response.status_code != 200:
+            return 1
+        now = time.time()
+        return sum(1 for service in response.json()['services']
+                   if service.get('serviceName') == self.serviceName and now - service.get('last_update', 0) <= self.duration)
+
+    def body(self, partition):
+        return {"ID": partition, "owner": self.owner, "duration": self.duration}
+
+# take or renew a lease, the version read with GET /leases is the condition of the update
+    def acquire(self, partition, lease=None):
+        try:
+            if lease is None:
+                response = self.catalog.post('/leases', self.body(partition))
+            else:
+                response = self.catalog.put('/leases', self.body(partition), headers={'If-Match': str(lease.get('version'))})
+        except requests.exceptions.RequestException:
+            return False
+        return response.status_code == 200
+
+    def release(self, partition):
+        try:
+            self.catalog.delete(f'/leases/{partition}')
+        except requests.exceptions.RequestException:
+            # the lease expires anyway
+            pass
+
+    def update(self):
+        try:
+            leases = self.getLeases()
+        except requests.exceptions.RequestException as e:
+            print(f"CATALOG MANAGER: failed to get the leases from catalog: {e}")
+            # the leases cannot be renewed: the partitions are left before the leases expire
+            with self.lock:
+                if time.time() - self.renewed > self.duration * 2 / 3:
+                    self.owned = set()
+            return
+        now = time.time()
+        live = {lease['owner'] for lease in leases.values() if lease.get('expires', 0) > now}
+        live.add(self.owner)
+        share = math.ceil(self.partitions / max(len(live), self.registeredInstances()))
+        mine = sorted(p for p, lease in leases.items() if lease.get('owner') == self.owner and p < self.partitions)
+        owned = set()
+        for partition in mine[:share]:
+            if self.acquire(partition, leases[partition]):
+                owned.add(partition)
+        for partition in mine[share:]:
+            self.release(partition)
+        for partition in range(self.partitions):
+            if len(owned) >= share:
+                break
+            lease = leases.get(partition)
+            if partition in owned or (lease is not None and lease.get('expires', 0) > now):
+                continue
+            if self.acquire(partition, lease):
+                owned.add(partition)
+        with self.lock:
+            if owned != self.owned:
+                print(f"CATALOG MANAGER: {self.owner} holds partitions {sorted(owned)} of {self.partitions}")
+            self.owned = owned
+            self.renewed = now
+
+    def loop(self):
+        while True:
+            self.update()
+            time.sleep(self.duration / 3)
@@ -0,0 +1,74 @@
+# SWEEP PLAN
+# consistency checks of the catalog manager, computed on one snapshot of the catalog (GET /all).
+# The patients, devices and medications are indexed once by ID in sets and dictionaries, so that every
+# check is a constant time lookup and a sweep is linear in the size of the catalog.
+# planSweep does not call the catalog: it returns what has to be changed, and the manager applies it.
+
+# checks:
+# - devices whose patient is not in the catalog (orphans) or not updated for more than threshold seconds,
+#   unless they are in alive (devices whose telemetry has been received, see timing_wheel.py)
+# - services not updated for more than threshold seconds
+# - medications whose patient is not in the catalog
+# - patients listing devices or medications that are not in the catalog (dangling back-references)
+# - leases expired for more than threshold seconds, left by manager instances that have been stopped
+
+
+def entityKey(entityID):
+    try:
+        return int(entityID)
+    except (TypeError, ValueError):
+        return None
+
+
+# returns {"devices": [(ID, reason)], "services": [(ID, reason)], "medications": [(ID, reason)],
+#          "leases": [(ID, reason)], "patients": [{"ID", "version", "changes"}]}, the changes of a patient are the PATCH body
+# that removes its dangling references, applied only if the patient has still the same version
+def planSweep(snapshot, now, threshold, alive=()):
+    patientIDs = {entityKey(patient.get('ID')) for patient in snapshot.get('patients', [])}
+    deviceIDs = {entityKey(device.get('ID')) for device in snapshot.get('devices', [])}
+    medicationIDs = {entityKey(medication.get('ID')) for medication in snapshot.get('medications', [])}
+    plan = {"devices": [], "services": [], "medications": [], "leases": [], "patients": []}
+
+    for device in snapshot.get('devices', []):
+        # a device is removed once, even if it is both orphaned and stale
+        if entityKey(device.get('patientID')) not in patientIDs:
+            plan["devices"].append((device['ID'], 'orphan'))
+        elif now - device.get('last_update', 0) > threshold and entityKey(device.get('ID')) not in alive:
+            plan["devices"].append((device['ID'], 'stale'))
+
+    for service in snapshot.get('services', []):
+        if now - service.get('last_update', 0) > threshold:
+            plan["services"].append((service['ID'], 'stale'))
+
+    for medication in snapshot.get('medications', []):
+        if entityKey(medication.get('patientID')) not in patientIDs:
+            plan["medications"].append((medication['ID'], 'orphan'))
+
+    for lease in snapshot.get('leases', []):
+        if now - lease.get('expires', 0) > threshold:
+            plan["leases"].append((lease['ID'], 'stale'))
+
+    for patient in snapshot.get('patients', []):
+        changes = {}
+        devices = patient.get('devices', [])
+        kept = [d for d in devices if entityKey(d.get('deviceID')) in deviceIDs]
+        if len(kept) != len(devices):
+            changes['devices'] = kept
+        medications = patient.get('medications', [])
+        kept = [m for m in medications if entityKey(m.get('medicationID')) in medicationIDs]
+        if len(kept) != len(medications):
+            changes['medications'] = kept
+        if changes:
+            plan["patients"].append({"ID": patient['ID'], "version": patient.get('version'), "changes": changes})
+
+    return plan
+
+
+# part of the plan on the entities owned by this instance (see partitions.py), the stale leases are
+# not partitioned and can be removed by any instance
+def restrictPlan(plan, owns):
+    restricted = {collection: [(entityID, reason) for entityID, reason in plan[collection] if owns(entityID)]
+                  for collection in ["devices", "services", "medications"]}
+    restricted["leases"] = plan["leases"]
+    restricted["patients"] = [repair for repair in plan["patients"] if owns(repair["ID"])]
+    return restricted
@@ -0,0 +1,60 @@
+# HASHED TIMING WHEEL
+# last-seen tracking of the devices for the event-driven liveness of the catalog manager.
+# Each device has a deadline (last time seen + timeout), and is kept in the slot of the wheel that
+# corresponds to its deadline: seeing a device again is O(1), and advancing the wheel only visits the
+# slots whose time has passed, so the cost of a tick does not depend on the number of healthy devices.
+# A device seen again is not removed from its previous slot: the stale entry is dropped when that slot is visited.
+
+import math
+
+
+class TimingWheel(object):
+    def __init__(self, timeout, tick=1, slots=512):
+        self.timeout = timeout
+        self.tick = tick
+        self.slots = [set() for _ in range(slots)]
+        self.deadlines = {}
+        self.current = None
+
+    def slot(self, deadline):
+        return int(math.floor(deadline / self.tick))
+
+# the key has been seen at time now, it expires after timeout seconds unless it is seen again
+    def touch(self, key, now):
+        deadline = now + self.timeout
+        self.deadlines[key] = deadline
+        self.slots[self.slot(deadline) % len(self.slots)].add(key)
+        if self.current is None:
+            self.current = self.slot(now)
+
+    def __contains__(self, key):
+        return key in self.deadlines
+
+    def __len__(self):
+        return len(self.deadlines)
+
+    def remove(self, key):
+        self.deadlines.pop(key, None)
+
+# move the wheel to time now, returns the keys whose deadline has passed and forgets them
+    def advance(self, now):
+        expired = []
+        if self.current is None:
+            return expired
+        last = self.slot(now)
+        # after a long pause every slot is visited once
+        first = max(self.current, last - len(self.slots) + 1)
+        for position in range(first, last + 1):
+            slot = self.slots[position % len(self.slots)]
+            for key in list(slot):
+                deadline = self.deadlines.get(key)
+                if deadline is None or self.slot(deadline) % len(self.slots) != position % len(self.slots):
+                    # forgotten, or seen again and moved to another slot
+                    slot.discard(key)
+                elif deadline <= now:
+                    slot.discard(key)
+                    del self.deadlines[key]
+                    expired.append(key)
+        # the current slot is visited again at the next advance, its keys may expire later in the same tick
+        self.current = last
+        return expired
@@ -0,0 +1,516 @@
+# MQTT BASE
+# MQTT client shared by all the services and the sensors.
+# The messages received are not handled on the network thread of paho: they are put in a bounded queue
+# and handed to notifier.notify(topic, payload) by a pool of worker threads, so that a slow handler
+# (e.g. an HTTP request to the catalog or to ThingSpeak) does not stop the intake of messages and the keepalives.
+# Messages with the same key (by default the topic, i.e. the same patient and device) always go to the same
+# worker, so they are handled in the order they have been received.
+# settings (all optional, e.g. in "mqtt_data"):
+#   "workers": number of worker threads, 0 to call notify on the network thread (default 4)
+#   "queueSize": maximum number of messages waiting in the queue of each worker (default 1000)
+#   "putTimeout": seconds the network thread waits for a full queue before dropping the message (default 1), the
+#          QoS 1/2 messages of a persistent session are not dropped (see below); it is kept short, the network thread
+#          also answers the keepalives of the broker
+#   "qos": QoS policy, {topic filter: QoS} used by publish and subscribe, e.g.
+#          {"project/sensors/#": 1, "project/alarms/#": 2}: when several filters match, the most specific one is used
+#   "defaultQos": QoS of the topics that match no filter of the policy (default 2)
+#   "spool": messages published while the broker is not reachable are kept in a ring buffer on disk (see spool.py)
+#          and published again in order after the connection, e.g. {"path": "mqtt.spool", "capacity": 10000,
+#          "slotSize": 1024, "dropPolicy": "oldest", "replayRate": 100}; replayRate (messages per second) must be
+#          higher than the publish rate of the client, as new messages wait in the spool behind the old ones.
+#          Without spool the messages published while disconnected are lost (QoS 0) or kept in memory by paho.
+#   "clientID": stable client ID, {hostname} is replaced by the host name (e.g. "time_control-{hostname}" for
+#          replicas); with a stable client ID the session is persistent (clean session off) unless "cleanSession"
+#          is true: the broker keeps the subscriptions and the QoS 1/2 messages of a stopped consumer and delivers
+#          them when it connects again.
+# With a persistent session the QoS 1/2 messages are acknowledged when a worker takes them from its queue (manual
+# acks of paho), not when they are received: the broker sends at most its in-flight window (max_inflight_messages of mosquitto) of messages not
+# acknowledged yet, and keeps the next ones while the workers are busy. They are never dropped: one that finds the
+# queue of its worker full waits with the ones after it, at most the in-flight window, until the worker takes one.
+# A message received and not acknowledged before a disconnection is sent again by the broker of a persistent session.
+#   "reconnectDelay": {"min": 1, "max": 60} seconds, the delay before each new connection attempt is doubled up to
+#          max and randomized (jitter), so that the clients do not reconnect all together after a broker restart
+#   "group": consumer group, to split the messages between several instances of a service, e.g.
+#          {"name": "time_control", "members": 2, "member": 0, "affinity": true}; without affinity the subscriptions
+#          are shared ($share/<name>/<filter>) and the broker sends each message to one of the members, in turn,
+#          so the messages of one device can be handled by different members at the same time. With affinity
+#          every member receives all the messages and handles only the keys (see key) of its partition,
+#          crc32(key) % members == member: the messages of a key are always handled by the same member, in order.
+#          The members need different client IDs, e.g. "clientID": "time_control-{hostname}". The environment
+#          variables GROUP_MEMBERS and GROUP_MEMBER, when set, replace members and member, so the replicas of a
+#          service run with the same settings file, e.g. GROUP_MEMBERS=2 GROUP_MEMBER=1 for the second of two.
+#   "batch": opt-in batching of the published measurements, e.g. {"topics": ["project/sensors/#"], "window": 1,
+#          "size": 50}: the SenML messages published on these topics are buffered per topic and sent as one SenML
+#          pack (see senml.py) when size messages are buffered or the oldest one has waited window seconds.
+#          The packs received are always split, the handlers and notify get the messages as they were published.
+#   "codec": encoding of the messages published, "json" (default), "cbor" (SenML in CBOR) or "msgpack" (see codec.py);
+#          the codec of the messages received is detected, whatever the setting, and notify always gets JSON.
+#   "transport": "mqtt" (default) or "loopback": the clients of the process with the same broker and port exchange
+#          the messages in memory, without a broker (see loopback.py), e.g. to run a whole pipeline in one process.
+# The connection is made in the background and retried, a client can be started with the broker down.
+# Handlers can also be registered on topic filters with route(topicFilter, handler), e.g.
+#     client.route('project/sensors/{patientID}/{deviceID}/{field}', self.onMeasurement)
+# the handler receives a Message with the topic, the raw payload, the decoded JSON (message.message) and the
+# parameters of the filter (message.params). The filters are matched by a trie (see topic_router.py);
+# messages that match no route go to notifier.notify(topic, payload).
+
+import collections
+import json
+import os
+import queue
+import random
+import socket
+import threading
+import time
+import uuid
+import zlib
+
+import paho.mqtt.client as PahoMQTT
+
+from codec import getCodec, detect, decode
+from log import getLogger
+from loopback import LoopbackClient
+from senml import pack, unpack, isPack, isSenMLPack
+from spool import Spool
+from topic_router import TopicRouter, Message, subscriptionFilter
+
+log = getLogger("MQTT")
+
+
+# client ID from the settings, or a new one at every start
+def clientIdentifier(settings):
+    if settings.get("clientID"):
+        return settings["clientID"].replace("{hostname}", socket.gethostname())
+    return str(uuid.uuid1())
+
+
+class MQTT_base:
+    def __init__(self, clientID, broker, port, notifier=None, settings={}, key=None):
+        self.broker = broker
+        self.port = port
+        self.notifier = notifier
+        self.clientID = clientID
+        self.topics = []
+        self.clean_session = settings.get("cleanSession", not settings.get("clientID"))
+        # the messages of a clean session are lost at the disconnection anyway, they are acknowledged when received
+        self.manual_ack = not self.clean_session
+        self.workers = settings.get("workers", 4)
+        self.queue_size = settings.get("queueSize", 1000)
+        self.put_timeout = settings.get("putTimeout", 1)
+        reconnect_delay = settings.get("reconnectDelay", {})
+        self.reconnect_min = reconnect_delay.get("min", 1)
+        self.reconnect_max = reconnect_delay.get("max", 60)
+        self.reconnect_attempts = 0
+        self.stopping = threading.Event()
+        self.disconnected = threading.Event()
+        # number of the connection, the messages are acknowledged only on the connection that received them
+        self.connections = 0
+        # (queue, message) of the QoS 1/2 messages waiting for a full queue, in the order they have been received
+        self.held = collections.deque()
+        self.held_lock = threading.Lock()
+        # key(topic, payload) of the messages that must be handled in order
+        self.key = key if key is not None else (lambda topic, payload: topic)
+        group = settings.get("group") or {}
+        self.group_name = group.get("name")
+        # the replicas of a service share the settings file, each one gets its place in the group from its environment
+        self.group_members = int(os.environ.get("GROUP_MEMBERS", group.get("members", 1)))
+        self.group_member = int(os.environ.get("GROUP_MEMBER", group.get("member", 0)))
+        self.affinity = group.get("affinity", False)
+        if not 0 <= self.group_member < self.group_members:
+            raise ValueError(f"group member must be between 0 and {self.group_members - 1}")
+        self.queues = []
+        self.metrics_lock = threading.Lock()
+        self.counters = {"received": 0, "processed": 0, "dropped": 0, "errors": 0,
+                         "lag_total": 0.0, "lag_max": 0.0, "depth_max": 0, "spooled": 0, "replayed": 0, "skipped": 0,
+                         "batches": 0, "unbatched": 0, "held": 0}
+        self.router = TopicRouter()
+        self.codec = getCodec(settings.get("codec", "json"))
+        # the QoS policy is matched with the same trie of the routes, the QoS of each topic is computed once
+        self.default_qos = settings.get("defaultQos", 2)
+        self.qos_policy = TopicRouter()
+        for topicFilter, qos in settings.get("qos", {}).items():
+            if qos not in (0, 1, 2):
+                raise ValueError(f"QoS of {topicFilter} must be 0, 1 or 2")
+            self.qos_policy.add(topicFilter, (specificity(topicFilter), qos))
+        self.qos_cache = {}
+        self.spool = None
+        if settings.get("spool"):
+            spool_settings = settings["spool"]
+            self.spool = Spool(spool_settings.get("path", "mqtt.spool"), spool_settings.get("capacity", 10000),
+                               spool_settings.get("slotSize", 1024), spool_settings.get("dropPolicy", "oldest"))
+            self.replay_rate = spool_settings.get("replayRate", 100)
+        batch = settings.get("batch") or {}
+        self.batch_filters = TopicRouter()
+        for topicFilter in batch.get("topics", []):
+            self.batch_filters.add(topicFilter, True)
+        self.batch_window = batch.get("window", 1)
+        self.batch_size = batch.get("size", 50)
+        # topic: [time of the oldest message, messages] of the batches not sent yet
+        self.batches = {}
+        self.batched_topics = {}
+        self.batch_lock = threading.Lock()
+        # set when the client connects and when a message is spooled, wakes up the replay thread
+        self.replay_event = threading.Event()
+        self.started = False
+        # the reconnections are made by connection() with jitter, not by paho
+        if settings.get("transport", "mqtt") == "loopback":
+            self.mqttClient = LoopbackClient(clientID, self.clean_session, manual_ack=self.manual_ack)
+        else:
+            self.mqttClient = PahoMQTT.Client(PahoMQTT.CallbackAPIVersion.VERSION2, clientID, self.clean_session,
+                                              reconnect_on_failure=False, manual_ack=self.manual_ack)
+        # register the callback
+        self.mqttClient.on_connect = self.onConnect
+        self.mqttClient.on_message = self.onMessageReceived
+        self.mqttClient.on_disconnect = self.onDisconnect
+        # a client that only publishes (e.g. the sensors) has no workers
+        if self.notifier is not None:
+            self.startWorkers()
+        self.start()
+
+    def startWorkers(self):
+        if self.queues or self.workers <= 0:
+            return
+        for i in range(self.workers):
+            messages = queue.Queue(maxsize=self.queue_size)
+            self.queues.append(messages)
+            worker = threading.Thread(target=self.work, args=(messages,), daemon=True, name=f'mqtt_worker_{i}')
+            worker.start()
+
+    def onConnect (self, paho_mqtt, userdata, flags, reason_code, properties):
+        log.info("Connected to %s with result code: %s", self.broker, reason_code)
+        if reason_code.is_failure:
+            return
+        self.reconnect_attempts = 0
+        if not self.clean_session and flags.session_present:
+            log.info("Session of %s resumed, the messages queued by the broker are delivered", self.clientID)
+        # Re-subscribe to all topics after (re)connect
+        for topic in self.topics:
+            self.mqttClient.subscribe(self.shared(topic), self.qosFor(topic))
+            log.info("Re-subscribed to topic %s", self.shared(topic))
+        self.replay_event.set()
+
+    def onDisconnect(self, paho_mqtt, userdata, flags, reason_code, properties):
+        if reason_code.is_failure:
+            log.warning("Disconnected from %s with result code: %s, reconnecting", self.broker, reason_code)
+        self.disconnected.set()
+
+# exponential backoff with full jitter, between min and the doubled delay
+    def reconnectDelay(self):
+        delay = min(self.reconnect_max, self.reconnect_min * 2 ** min(self.reconnect_attempts, 16))
+        self.reconnect_attempts += 1
+        return random.uniform(self.reconnect_min, max(self.reconnect_min, delay))
+
+# connection thread: connects, runs the network thread of paho until the connection is lost
+# and waits before connecting again
+    def connection(self):
+        while not self.stopping.is_set():
+            self.connections += 1
+            # cleared before connecting, a disconnection right after the connection is not missed
+            self.disconnected.clear()
+            try:
+                self.mqttClient.reconnect()
+            except OSError as e:
+                delay = self.reconnectDelay()
+                log.warning("Connection to %s:%s failed: %s, retrying in %.1f s", self.broker, self.port, e, delay)
+                self.stopping.wait(delay)
+                continue
+            self.mqttClient.loop_start()
+            if self.stopping.is_set():
+                self.mqttClient.disconnect()
+            self.disconnected.wait()
+            self.mqttClient.loop_stop()
+            if not self.stopping.is_set():
+                self.stopping.wait(self.reconnectDelay())
+
+    def onMessageReceived (self, paho_mqtt , userdata, msg):
+        log.debug("Message received on topic %s: %s", msg.topic, msg.payload)
+        if not self.notifier and not self.router:
+            self.acknowledge(msg.mid, msg.qos, self.connections)
+            return
+        with self.metrics_lock:
+            self.counters["received"] += 1
+        key = zlib.crc32(str(self.key(msg.topic, msg.payload)).encode())
+        if self.affinity and self.group_members > 1:
+            if key % self.group_members != self.group_member:
+                with self.metrics_lock:
+                    self.counters["skipped"] += 1
+                self.acknowledge(msg.mid, msg.qos, self.connections)
+                return
+            # the keys of this member have the same remainder, the worker is chosen with the rest of the hash
+            key //= self.group_members
+        if not self.queues:
+            self.dispatch(msg.topic, msg.payload, time.time())
+            self.acknowledge(msg.mid, msg.qos, self.connections)
+            return
+        messages = self.queues[key % len(self.queues)]
+        item = (msg.topic, msg.payload, time.time(), msg.mid, msg.qos, self.connections)
+        if msg.qos > 0 and self.manual_ack:
+            self.hold(messages, item)
+        else:
+            try:
+                messages.put(item, timeout=self.put_timeout)
+            except queue.Full:
+                with self.metrics_lock:
+                    self.counters["dropped"] += 1
+                log.error("Queue full, message on topic %s dropped", msg.topic)
+                return
+        with self.metrics_lock:
+            self.counters["depth_max"] = max(self.counters["depth_max"], messages.qsize())
+
+# a QoS 1/2 message goes in its queue if it is not full and no message is waiting before it, otherwise it waits;
+# the messages waiting are not acknowledged, so the broker stops sending when its in-flight window is full
+    def hold(self, messages, item):
+        with self.held_lock:
+            self.held.append((messages, item))
+            # also moves the message if a worker has taken one without seeing it in held
+            self.moveHeld()
+            if not self.held or self.held[-1][1] is not item:
+                return
+            if len(self.held) == 1:
+                log.warning("Queue full, message on topic %s waits for the workers", item[0])
+        with self.metrics_lock:
+            self.counters["held"] += 1
+
+# move the messages waiting into their queues, in order, until one finds its queue full
+    def release(self):
+        with self.held_lock:
+            self.moveHeld()
+
+    def moveHeld(self):
+        while self.held:
+            messages, item = self.held[0]
+            try:
+                messages.put_nowait(item)
+            except queue.Full:
+                return
+            self.held.popleft()
+
+# the acknowledgement of a message received on a previous connection is not sent: the broker sends it again
+    def acknowledge(self, mid, qos, connection):
+        if self.manual_ack and qos > 0 and connection == self.connections:
+            self.mqttClient.ack(mid, qos)
+
+    def dispatch(self, topic, payload, received):
+        lag = time.time() - received
+        codec = detect(payload)
+        if codec == "json" and not isPack(payload):
+            self.deliver(topic, payload)
+        else:
+            # a SenML pack is handed to the handlers as the messages it was made of, another JSON array as it was
+            # received; binary payloads are decoded here and the handlers see the decoded message
+            packed = False
+            try:
+                message = decode(payload, codec)
+                packed = isSenMLPack(message)
+                messages = unpack(message) if packed else [message]
+            except (ValueError, TypeError, AttributeError) as e:
+                log.error("Invalid payload on topic %s: %s", topic, e)
+                messages = []
+                with self.metrics_lock:
+                    self.counters["errors"] += 1
+            if codec == "json" and messages and not packed:
+                self.deliver(topic, payload)
+            else:
+                for message in messages:
+                    self.deliver(topic, None, message)
+            if len(messages) > 1:
+                with self.metrics_lock:
+                    self.counters["unbatched"] += len(messages)
+        with self.metrics_lock:
+            self.counters["processed"] += 1
+            self.counters["lag_total"] += lag
+            self.counters["lag_max"] = max(self.counters["lag_max"], lag)
+
+    def deliver(self, topic, payload, message=None):
+        try:
+            routes = self.router.match(topic)
+            for handler, params in routes:
+                handler(Message(topic, payload, params, message))
+            if not routes and self.notifier is not None:
+                self.notifier.notify(topic, payload if payload is not None else json.dumps(message))
+        except Exception as e:
+            log.error("Handler failed on topic %s: %s", topic, e)
+            with self.metrics_lock:
+                self.counters["errors"] += 1
+
+    def work(self, messages):
+        while True:
+            message = messages.get()
+            if message is None:
+                return
+            topic, payload, received, mid, qos, connection = message
+            self.acknowledge(mid, qos, connection)
+            if self.held:
+                self.release()
+            self.dispatch(topic, payload, received)
+
+# queue depth, time spent by the messages in the queue (lag) and counters since the start
+    def metrics(self):
+        with self.metrics_lock:
+            counters = dict(self.counters)
+        processed = counters.pop("processed")
+        lag_total = counters.pop("lag_total")
+        counters["processed"] = processed
+        counters["depth"] = sum(messages.qsize() for messages in self.queues)
+        counters["lag_mean"] = lag_total / processed if processed else 0
+        if self.spool is not None:
+            counters["spool_depth"] = len(self.spool)
+            counters["spool_dropped"] = self.spool.dropped
+        return counters
+
+# QoS of a topic (or of a subscription filter) given by the policy
+    def qosFor(self, topic):
+        qos = self.qos_cache.get(topic)
+        if qos is None:
+            matches = self.qos_policy.match(topic)
+            qos = max(matches, key=lambda match: match[0][0])[0][1] if matches else self.default_qos
+            self.qos_cache[topic] = qos
+        return qos
+
+    def publish (self, topic, msg):
+        # publish a message with a certain topic
+        if self.isBatched(topic):
+            if isinstance(msg, dict) and 'bn' in msg and 'e' in msg:
+                with self.batch_lock:
+                    batch = self.batches.setdefault(topic, [time.time(), []])
+                    batch[1].append(msg)
+                    ready = self.batches.pop(topic)[1] if len(batch[1]) >= self.batch_size else None
+                if ready:
+                    self.sendBatch(topic, ready)
+                return
+            # not a SenML message: the messages buffered before it are sent first
+            self.flushBatches(topic)
+        self.send(topic, self.codec.encode(msg))
+
+    def isBatched(self, topic):
+        if not self.batch_filters:
+            return False
+        batched = self.batched_topics.get(topic)
+        if batched is None:
+            batched = self.batched_topics[topic] = bool(self.batch_filters.match(topic))
+        return batched
+
+    def sendBatch(self, topic, messages):
+        self.send(topic, self.codec.encode(pack(messages)))
+        with self.metrics_lock:
+            self.counters["batches"] += 1
+
+# send the batches older than the window (all the batches with force, or only the batch of topic)
+    def flushBatches(self, topic=None, force=False):
+        now = time.time()
+        with self.batch_lock:
+            ready = [(t, self.batches.pop(t)[1]) for t, batch in list(self.batches.items())
+                     if t == topic or force or now - batch[0] >= self.batch_window]
+        for t, messages in ready:
+            self.sendBatch(t, messages)
+
+    def batchLoop(self):
+        while not self.stopping.wait(min(self.batch_window / 4, 0.5)):
+            self.flushBatches()
+
+    def send(self, topic, payload):
+        qos = self.qosFor(topic)
+        # while the spool is not empty the new messages are queued behind the old ones, to keep the order
+        if self.spool is not None and (not self.mqttClient.is_connected() or len(self.spool)):
+            self.spoolMessage(topic, payload, qos)
+            return
+        info = self.mqttClient.publish(topic, payload, qos)
+        if info.rc == PahoMQTT.MQTT_ERR_NO_CONN and self.spool is not None:
+            self.spoolMessage(topic, payload, qos)
+
+    def spoolMessage(self, topic, payload, qos):
+        if self.spool.append(topic, payload, qos):
+            with self.metrics_lock:
+                self.counters["spooled"] += 1
+        self.replay_event.set()
+
+# publish the spooled messages in order, at most replay_rate per second, while the client is connected
+    def replay(self):
+        while self.started:
+            self.replay_event.wait(1)
+            self.replay_event.clear()
+            while self.started and self.mqttClient.is_connected():
+                message = self.spool.peek()
+                if message is None:
+                    break
+                sequence, topic, payload, qos = message
+                info = self.mqttClient.publish(topic, payload, qos)
+                if info.rc != PahoMQTT.MQTT_ERR_SUCCESS:
+                    break
+                self.spool.pop(sequence)
+                with self.metrics_lock:
+                    self.counters["replayed"] += 1
+                time.sleep(1 / self.replay_rate)
+
+
+# topic filter sent to the broker: shared by the members of the group, unless they split the messages by affinity
+    def shared(self, topic):
+        if self.group_name and not self.affinity:
+            return f"$share/{self.group_name}/{topic}"
+        return topic
+
+    def subscribe (self, topic):
+        if topic not in self.topics:
+            self.topics.append(topic)
+            self.mqttClient.subscribe(self.shared(topic), self.qosFor(topic))
+        log.info("subscribed to topic %s with QoS %d", self.shared(topic), self.qosFor(topic))
+
+# register a handler on a topic filter, {name} levels are passed to the handler in message.params
+    def route(self, topicFilter, handler):
+        self.router.add(topicFilter, handler)
+        self.startWorkers()
+        self.subscribe(subscriptionFilter(topicFilter))
+
+    def start(self):
+        if self.started:
+            return
+        # the first connection is also retried by the connection thread if the broker is not reachable
+        self.mqttClient.connect_async(self.broker , self.port)
+        self.stopping.clear()
+        self.started = True
+        self.connection_thread = threading.Thread(target=self.connection, daemon=True, name='mqtt_connection')
+        self.connection_thread.start()
+        if self.spool is not None:
+            replay_thread = threading.Thread(target=self.replay, daemon=True, name='mqtt_replay')
+            replay_thread.start()
+        if self.batch_filters:
+            batch_thread = threading.Thread(target=self.batchLoop, daemon=True, name='mqtt_batch')
+            batch_thread.start()
+
+    def unsubscribe(self,topic=None):
+        if (self.topics): # if there are topics to unsubscribe from
+            if topic is None: # if no topic is specified, unsubscribe from all topics
+                for topic in self.topics:
+                    self.mqttClient.unsubscribe(self.shared(topic))
+            elif(topic in self.topics): #if topic is specified and in list topics, unsubscribe from that topic
+                self.mqttClient.unsubscribe(self.shared(topic))
+                self.topics.remove(topic)
+            else:
+                log.warning("Topic %s not found in subscribed topics", topic)
+        else:
+            log.debug("No topics to unsubscribe from")
+
+    def stop (self):
+        # the buffered measurements are sent before the disconnection
+        self.flushBatches(force=True)
+        # with a persistent session the subscriptions are kept, so that the broker queues the messages until the restart
+        if self.clean_session:
+            self.unsubscribe()
+        self.started = False
+        self.stopping.set()
+        self.mqttClient.disconnect()
+        self.disconnected.set()
+        self.connection_thread.join(timeout=5)
+        self.replay_event.set()
+        # the workers stop after the messages already in their queue
+        for messages in self.queues:
+            try:
+                messages.put_nowait(None)
+            except queue.Full:
+                pass
+
+
+# filters with more literal levels are more specific, then the longer ones (a/b/# is more specific than a/#)
+def specificity(topicFilter):
+    levels = topicFilter.split('/')
+    return (sum(1 for level in levels if level not in ('+', '#')), len(levels))
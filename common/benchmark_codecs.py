@@ -0,0 +1,49 @@
+# Benchmark of the payload codecs of MQTT_base (see codec.py)
+# usage: python3 benchmark_codecs.py [repetitions]        (default: 20000)
+# For every codec (json, cbor, msgpack) and for the two kinds of payload published by the sensors:
+# - a single measurement {'bn', 'e': [{'n', 'v', 't', 'u'}]}, as published by the sensors
+# - a SenML pack of PACK_SIZE measurements of one device, as sent with "batch"
+# the size of the payload (bytes on the wire, without the MQTT header and topic) and the CPU time to encode it
+# with codec.encode and to decode it on the consumer side (detect + decode, as in MQTT_base.dispatch)
+# are reported; the decode time includes the conversion of the SenML labels of CBOR.
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from codec import CODECS, getCodec, detect
+from senml import pack
+
+PACK_SIZE = 50
+
+
+def measurement(i):
+    return {'bn': '12', 'e': [{'n': 'heart_rate', 'v': 60 + i % 40, 't': 1712345678.25 + i, 'u': 'bpm'}]}
+
+
+def cpu(function, argument, repetitions):
+    t0 = time.process_time()
+    for _ in range(repetitions):
+        function(argument)
+    return (time.process_time() - t0) / repetitions
+
+
+def main(repetitions):
+    payloads = {"single": measurement(0), f"pack of {PACK_SIZE}": pack([measurement(i) for i in range(PACK_SIZE)])}
+    print(f"{'payload':>12}{'codec':>9}{'bytes':>8}{'bytes/meas.':>13}{'encode us':>11}{'decode us':>11}")
+    for kind, msg in payloads.items():
+        measurements = len(msg) if isinstance(msg, list) else 1
+        for name in CODECS:
+            codec = getCodec(name)
+            payload = codec.encode(msg)
+            if isinstance(payload, str):
+                payload = payload.encode()
+            encode = cpu(codec.encode, msg, repetitions // measurements)
+            decode = cpu(lambda p: getCodec(detect(p)).decode(p), payload, repetitions // measurements)
+            print(f"{kind:>12}{name:>9}{len(payload):>8}{len(payload) / measurements:>13.1f}"
+                  f"{encode * 1e6:>11.1f}{decode * 1e6:>11.1f}")
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 20000)
@@ -0,0 +1,103 @@
+# Benchmark of the CPU used by the logging of the hot path (every MQTT message handled by the thingspeak adaptor)
+# usage: python3 benchmark_logging.py [messages per second] [seconds]        (default: 1000 msg/s for 5 s)
+# Every message goes through the lines printed before log.py: the [DEBUG] line of MQTT_base and the five lines of
+# the thingspeak adaptor (the message, the field, the catalog request, "uploading..." and the upload result).
+# The services run with python3 -u, so every line is written at once to the pipe read by docker: here the output
+# is written line by line to a pipe read by a child process. For each mode the CPU time of the process is
+# reported as the percentage of one core used while the messages are handled at the given rate; "no logging"
+# is the cost of the benchmark loop itself.
+
+import logging
+import os
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from log import setupLogging, getLogger
+
+MODES = {
+    "no logging": "none",
+    "print (before)": None,
+    "log INFO": {"level": "INFO"},
+    "log DEBUG, rate 10/s": {"level": "DEBUG", "rate": 10, "burst": 20},
+    "log DEBUG, no limit": {"level": "DEBUG", "rate": 0},
+}
+
+
+def message(i):
+    return {'bn': f'{i % 100}', 'e': [{'n': 'heart_rate', 'v': 60 + i % 40, 't': time.time(), 'u': 'bpm'}]}
+
+
+def printed(topic, payload, msg):
+    print(f"[DEBUG] Message received on topic {topic}: {payload}")
+    print(f"THINGSPEAK: received message on topic {topic}: {msg}")
+    print(f"\nheart_rate message")
+    print(f'request: http://catalog/devices/{msg["bn"]}/channel')
+    print('uploading...')
+    print(f"Data uploaded successfully")
+
+
+mqtt_log = getLogger("MQTT")
+log = getLogger("THINGSPEAK")
+
+
+def logged(topic, payload, msg):
+    mqtt_log.debug("Message received on topic %s: %s", topic, payload)
+    log.debug("received message on topic %s: %s", topic, msg)
+    log.debug("%s message, request: %s/devices/%s/channel", 'heart_rate', 'http://catalog', msg["bn"])
+    log.debug("uploading...")
+    log.debug("Data uploaded successfully")
+
+
+def silent(topic, payload, msg):
+    pass
+
+
+def run(handle, rate, duration):
+    interval = 1 / rate
+    messages = int(rate * duration)
+    cpu0 = time.process_time()
+    start = time.perf_counter()
+    for i in range(messages):
+        # the messages arrive at the given rate
+        delay = start + i * interval - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        msg = message(i)
+        topic = f'project/sensors/1/{msg["bn"]}/heart_rate'
+        handle(topic, str(msg).encode(), msg)
+    sys.stdout.flush()
+    return (time.process_time() - cpu0) / (time.perf_counter() - start)
+
+
+def main(rate, duration):
+    stdout = sys.stdout
+    results = []
+    for name, settings in MODES.items():
+        # the child counts the bytes written in the pipe
+        reader = subprocess.Popen(['wc', '-c'], stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        sys.stdout = open(reader.stdin.fileno(), 'w', buffering=1, closefd=False)
+        if settings == "none":
+            handle = silent
+        elif settings is None:
+            handle = printed
+        else:
+            setupLogging(settings)
+            handle = logged
+        cpu = run(handle, rate, duration)
+        logging.getLogger().handlers.clear()
+        sys.stdout.close()
+        sys.stdout = stdout
+        reader.stdin.close()
+        size = int(reader.stdout.read())
+        reader.wait()
+        results.append((name, cpu, size))
+    print(f"{rate} msg/s for {duration} s")
+    print(f"{'mode':>22}{'CPU %':>8}{'log KB':>10}")
+    for name, cpu, size in results:
+        print(f"{name:>22}{cpu * 100:>8.1f}{size / 1024:>10.0f}")
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1000, float(sys.argv[2]) if len(sys.argv) > 2 else 5)
@@ -0,0 +1,150 @@
+# Benchmark of the whole MQTT pipeline of the project in one process
+# usage: python3 benchmark_pipeline.py [measurements per sensor] [broker] [port]     (default: 20000 loopback 1883)
+# With the broker "loopback" the clients use the in-process transport of MQTT_base (see loopback.py), otherwise
+# they connect to the broker given (e.g. localhost 1883 with docker run -p 1883:1883 eclipse-mosquitto) for a
+# comparison. The clients are connected like the services, with the topics and the QoS policy of their settings:
+# - SENSORS sensors publish heart_rate measurements on project/sensors/<patientID>/<deviceID>/heart_rate
+# - a thingspeak adaptor and a time control route project/sensors/{patientID}/{deviceID}/{field}; the time control
+#   publishes an alarm on project/alarms/time_control for the values over THRESHOLD (one every ALARM_EVERY)
+# - a telegram bot subscribed to project/alarms/# decodes the alarms in notify
+# The handlers do not call the catalog, ThingSpeak or Telegram: the benchmark measures the messaging path
+# (routing, queues, workers, codecs), not the HTTP requests of the services.
+# For each configuration the measurements per second handled by both consumers, the alarms received by the bot
+# and the latency sensor -> bot of the alarms are reported. With "workers": 0 the messages are handled on the
+# thread of the publisher: on loopback a publish returns when the whole pipeline has handled it.
+
+import contextlib
+import io
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from MQTT_base import MQTT_base
+
+SENSORS = 4
+THRESHOLD = 150
+ALARM_EVERY = 100
+IDLE_TIMEOUT = 5
+CONFIGURATIONS = {
+    "workers 0, json": {"workers": 0, "codec": "json"},
+    "workers 4, json": {"workers": 4, "codec": "json"},
+    "workers 4, msgpack": {"workers": 4, "codec": "msgpack"},
+}
+
+
+def settings(transport, configuration):
+    return dict(configuration, transport=transport, queueSize=100000,
+                qos={"project/sensors/#": 1, "project/alarms/#": 2})
+
+
+def connected(client, timeout=5):
+    deadline = time.time() + timeout
+    while not client.mqttClient.is_connected():
+        if time.time() > deadline:
+            raise RuntimeError(f"broker {client.broker}:{client.port} not reachable")
+        time.sleep(0.01)
+
+
+class Pipeline(object):
+    def __init__(self, broker, port, transport, configuration, measurements):
+        self.run = uuid.uuid4().hex[:8]
+        self.expected = measurements * SENSORS
+        self.lock = threading.Lock()
+        self.done = threading.Event()
+        self.counts = {"thingspeak": 0, "time_control": 0, "alarms": 0}
+        self.latencies = []
+        self.last_received = time.perf_counter()
+        client_settings = settings(transport, configuration)
+        self.bot = MQTT_base(f'telegram_bot_{self.run}', broker, port, self, client_settings)
+        self.thingspeak = MQTT_base(f'thingspeak_adaptor_{self.run}', broker, port, settings=client_settings)
+        self.time_control = MQTT_base(f'time_control_{self.run}', broker, port, settings=client_settings)
+        self.sensors = [MQTT_base(f'sensor_{self.run}_{i}', broker, port, settings=client_settings)
+                        for i in range(SENSORS)]
+        for client in [self.bot, self.thingspeak, self.time_control] + self.sensors:
+            connected(client)
+        self.bot.subscribe(f'project/alarms/{self.run}/#')
+        sensors_filter = f'project/sensors/{self.run}/{{deviceID}}/{{field}}'
+        self.thingspeak.route(sensors_filter, self.onThingspeak)
+        self.time_control.route(sensors_filter, self.onTimeControl)
+
+    def count(self, name):
+        with self.lock:
+            self.counts[name] += 1
+            self.last_received = time.perf_counter()
+            if (self.counts["thingspeak"] >= self.expected and self.counts["time_control"] >= self.expected
+                    and self.counts["alarms"] >= self.expected // ALARM_EVERY):
+                self.done.set()
+
+    def onThingspeak(self, measurement):
+        measurement.message["e"][0]["v"]
+        self.count("thingspeak")
+
+    def onTimeControl(self, measurement):
+        entry = measurement.message["e"][0]
+        if entry["v"] > THRESHOLD:
+            self.time_control.publish(f'project/alarms/{self.run}/time_control',
+                                      {'alarmType': "time_control", 'patientID': self.run,
+                                       'sensorID': measurement.params["deviceID"], 'field': measurement.params["field"],
+                                       'value': entry["v"], 'timestamp': entry["t"]})
+        self.count("time_control")
+
+    def notify(self, topic, payload):
+        message = json.loads(payload)
+        if message['alarmType'] == "time_control":
+            with self.lock:
+                self.latencies.append(time.time() - message['timestamp'])
+            self.count("alarms")
+
+    def publishAll(self, sensor, deviceID, measurements):
+        topic = f'project/sensors/{self.run}/{deviceID}/heart_rate'
+        for i in range(measurements):
+            value = THRESHOLD + 10 if i % ALARM_EVERY == ALARM_EVERY - 1 else 60 + i % 40
+            sensor.publish(topic, {'bn': f'{deviceID}', 'e': [{'n': 'heart_rate', 'v': value, 't': time.time(),
+                                                                 'u': 'bpm'}]})
+
+    def measure(self, measurements):
+        t0 = time.perf_counter()
+        publishers = [threading.Thread(target=self.publishAll, args=(sensor, i, measurements))
+                      for i, sensor in enumerate(self.sensors)]
+        for publisher in publishers:
+            publisher.start()
+        last = None
+        while not self.done.wait(IDLE_TIMEOUT):
+            with self.lock:
+                if self.counts == last:
+                    break
+                last = dict(self.counts)
+        for publisher in publishers:
+            publisher.join()
+        elapsed = max(self.last_received - t0, 1e-9)
+        for client in self.sensors + [self.thingspeak, self.time_control, self.bot]:
+            client.stop()
+        return elapsed
+
+
+def main(measurements, broker, port):
+    transport = "loopback" if broker == "loopback" else "mqtt"
+    print(f"{SENSORS} sensors x {measurements} measurements, transport {transport}")
+    print(f"{'configuration':>20}{'meas./s':>10}{'lost':>8}{'alarms':>12}{'alarm p50 ms':>14}{'alarm p99 ms':>14}")
+    for name, configuration in CONFIGURATIONS.items():
+        # MQTT_base logs every connection and subscription, the output is discarded during the measures
+        with contextlib.redirect_stdout(io.StringIO()):
+            pipeline = Pipeline(broker, port, transport, configuration, measurements)
+            elapsed = pipeline.measure(measurements)
+        counts = pipeline.counts
+        handled = min(counts["thingspeak"], counts["time_control"])
+        latencies = sorted(pipeline.latencies)
+        p50 = latencies[len(latencies) // 2] * 1000 if latencies else float('nan')
+        p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000 if latencies else float('nan')
+        print(f"{name:>20}{handled / elapsed:>10.0f}{pipeline.expected - handled:>8}"
+              f"{str(counts['alarms']) + '/' + str(pipeline.expected // ALARM_EVERY):>12}{p50:>14.2f}{p99:>14.2f}")
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 20000,
+         sys.argv[2] if len(sys.argv) > 2 else 'loopback',
+         int(sys.argv[3]) if len(sys.argv) > 3 else 1883)
@@ -0,0 +1,129 @@
+# Benchmark of the MQTT QoS policies of MQTT_base against a running broker
+# usage: python3 benchmark_qos.py [broker] [port] [messages]        (default: localhost 1883 2000)
+# e.g. with the broker of the project: docker run -p 1883:1883 eclipse-mosquitto
+# For every policy of the telemetry topics (QoS 0, 1 and 2):
+# - round trip: one client publishes a measurement and waits for it on its own subscription, one at a time;
+#   every hop adds a handshake of QoS 0: 1 packet, QoS 1: 2 packets (PUBLISH, PUBACK), QoS 2: 4 packets
+#   (PUBLISH, PUBREC, PUBREL, PUBCOMP), so a sample crosses 2, 4 or 8 packets from sensor to consumer
+# - throughput: SENSORS sensor clients publish the measurements as fast as they can on
+#   project/sensors/<patientID>/<deviceID>/<field> and one consumer routes them, until all are received
+#   or the consumer has been idle for IDLE_TIMEOUT seconds; the lost messages are reported
+
+import contextlib
+import io
+import os
+import sys
+import threading
+import time
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from MQTT_base import MQTT_base
+
+SENSORS = 4
+ROUND_TRIPS = 200
+IDLE_TIMEOUT = 5
+POLICIES = {"QoS 0": 0, "QoS 1": 1, "QoS 2": 2}
+PACKETS = {0: 2, 1: 4, 2: 8}
+
+
+def settings(qos):
+    return {"qos": {"project/sensors/#": qos, "project/alarms/#": 2}, "workers": 4, "queueSize": 100000}
+
+
+def measurement(deviceID, value):
+    return {'bn': f'{deviceID}', 'e': [{'n': 'heart_rate', 'v': value, 't': time.time(), 'u': 'bpm'}]}
+
+
+def connected(client, timeout=5):
+    deadline = time.time() + timeout
+    while not client.mqttClient.is_connected():
+        if time.time() > deadline:
+            raise RuntimeError(f"broker {client.broker}:{client.port} not reachable")
+        time.sleep(0.01)
+
+
+def roundTrips(broker, port, qos):
+    received = threading.Event()
+    client = MQTT_base(f'benchmark_{uuid.uuid4().hex}', broker, port, settings=settings(qos))
+    connected(client)
+    topic = f'project/sensors/0/{uuid.uuid4().hex[:8]}/heart_rate'
+    client.route(topic, lambda message: received.set())
+    # the subscription is active once the first message comes back
+    for _ in range(100):
+        client.publish(topic, measurement(0, 0))
+        if received.wait(0.1):
+            break
+    times = []
+    for i in range(ROUND_TRIPS):
+        received.clear()
+        t0 = time.perf_counter()
+        client.publish(topic, measurement(0, i))
+        if received.wait(IDLE_TIMEOUT):
+            times.append(time.perf_counter() - t0)
+    client.stop()
+    times.sort()
+    return times
+
+
+def throughput(broker, port, qos, messages):
+    count = [0]
+    # time of the last message received, the idle time at the end is not counted
+    last_received = [time.perf_counter()]
+    lock = threading.Lock()
+    done = threading.Event()
+    total = messages * SENSORS
+    run = uuid.uuid4().hex[:8]
+
+    def onMeasurement(message):
+        with lock:
+            count[0] += 1
+            last_received[0] = time.perf_counter()
+            if count[0] >= total:
+                done.set()
+
+    consumer = MQTT_base(f'benchmark_{uuid.uuid4().hex}', broker, port, settings=settings(qos))
+    connected(consumer)
+    consumer.route(f'project/sensors/{run}/{{deviceID}}/{{field}}', onMeasurement)
+    time.sleep(0.5)
+    sensors = [MQTT_base(f'benchmark_{uuid.uuid4().hex}', broker, port, settings=settings(qos)) for _ in range(SENSORS)]
+    for sensor in sensors:
+        connected(sensor)
+
+    def publishAll(sensor, deviceID):
+        for i in range(messages):
+            sensor.publish(f'project/sensors/{run}/{deviceID}/heart_rate', measurement(deviceID, i))
+
+    t0 = time.perf_counter()
+    publishers = [threading.Thread(target=publishAll, args=(sensor, i)) for i, sensor in enumerate(sensors)]
+    for publisher in publishers:
+        publisher.start()
+    last = -1
+    while not done.wait(IDLE_TIMEOUT):
+        with lock:
+            if count[0] == last:
+                break
+            last = count[0]
+    elapsed = max(last_received[0] - t0, 1e-9)
+    for client in sensors + [consumer]:
+        client.stop()
+    return count[0], elapsed
+
+
+def main(broker, port, messages):
+    print(f"{'policy':>8}{'packets':>9}{'rtt p50 ms':>12}{'rtt p99 ms':>12}{'msg/s':>10}{'lost':>8}")
+    for name, qos in POLICIES.items():
+        # MQTT_base prints every message received, the output is discarded during the measures
+        with contextlib.redirect_stdout(io.StringIO()):
+            times = roundTrips(broker, port, qos)
+            received, elapsed = throughput(broker, port, qos, messages)
+        p50 = times[len(times) // 2] * 1000 if times else float('nan')
+        p99 = times[min(len(times) - 1, int(len(times) * 0.99))] * 1000 if times else float('nan')
+        lost = messages * SENSORS - received
+        print(f"{name:>8}{PACKETS[qos]:>9}{p50:>12.2f}{p99:>12.2f}{received / elapsed:>10.0f}{lost:>8}")
+
+
+if __name__ == '__main__':
+    main(sys.argv[1] if len(sys.argv) > 1 else 'localhost',
+         int(sys.argv[2]) if len(sys.argv) > 2 else 1883,
+         int(sys.argv[3]) if len(sys.argv) > 3 else 2000)
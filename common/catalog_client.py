@@ -0,0 +1,183 @@
+# CATALOG CLIENT
+# shared client used by the services and the sensors to call the catalog REST API
+# - a single requests.Session, so that keep-alive connections to the catalog are pooled and reused
+# - GET responses can be cached for a few seconds (ttl); the cached responses of a collection are
+#   invalidated by the writes done through the client, or explicitly with invalidate()
+# - concurrent identical GETs are coalesced: one request is sent and all the callers get its response
+# - connection errors, 429 and 5xx responses are retried with exponential backoff and jitter,
+#   waiting at least the Retry-After sent by the catalog admission control; POST and PATCH are sent again
+#   only when the connection could not be opened, since after a timeout the catalog may have applied them
+
+import json
+import random
+import threading
+import time
+
+import requests
+import urllib3
+from requests.adapters import HTTPAdapter
+
+RETRY_STATUS = [429, 500, 502, 503, 504]
+# writes are retried only when the catalog has rejected them without applying them
+RETRY_STATUS_WRITE = [429, 503]
+# methods that can be sent again after any error, the catalog applies them once
+IDEMPOTENT_METHODS = ['GET', 'PUT', 'DELETE']
+# the exponent of the backoff is bounded, the delay is capped by backoffMax long before
+MAX_BACKOFF_EXPONENT = 16
+# a change of an entity also changes the cached responses of these collections
+# (e.g. devices and medications are listed in their patient, and GET /devices/<ID>/channel includes the patient)
+DEPENDENT_COLLECTIONS = {
+    "devices": ["devices", "patients"],
+    "patients": ["patients", "devices", "medications"],
+    "medications": ["medications", "patients"]
+}
+
+
+# True if the request did not reach the catalog because the connection could not be opened
+def notSent(error):
+    if isinstance(error, requests.exceptions.ConnectTimeout):
+        return True
+    if isinstance(error, requests.exceptions.ConnectionError) and error.args:
+        return isinstance(getattr(error.args[0], 'reason', None), urllib3.exceptions.NewConnectionError)
+    return False
+
+
+# GET in progress, shared by all the callers asking for the same URL
+class PendingRequest(object):
+    def __init__(self):
+        self.done = threading.Event()
+        self.response = None
+        self.error = None
+
+
+class CatalogClient(object):
+    def __init__(self, catalogURL, settings={}):
+        self.catalogURL = catalogURL.rstrip('/')
+        self.timeout = settings.get("timeout", 10)
+        self.retries = settings.get("retries", 3)
+        self.backoff_base = settings.get("backoffBase", 0.5)
+        self.backoff_max = settings.get("backoffMax", 30)
+        self.default_ttl = settings.get("cacheTTL", 0)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=settings.get("poolSize", 10))
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.cache = {}
+        self.pending = {}
+        # incremented at every invalidation, a GET started before it does not fill the cache
+        self.generation = 0
+        self.failures = 0
+        self.lock = threading.Lock()
+
+    def url(self, path):
+        return f"{self.catalogURL}/{str(path).lstrip('/')}"
+
+# exponential backoff with jitter: half of the delay is fixed, the other half is random
+    def delay(self, attempt):
+        delay = min(self.backoff_max, self.backoff_base * 2 ** min(attempt, MAX_BACKOFF_EXPONENT))
+        return delay / 2 + random.uniform(0, delay / 2)
+
+# wait before retrying an operation that failed, used by the retry loops of the services
+# the delay grows with the number of consecutive failures and is reset by a successful request
+    def backoff(self):
+        with self.lock:
+            self.failures = min(self.failures + 1, MAX_BACKOFF_EXPONENT)
+            failures = self.failures
+        time.sleep(self.delay(failures))
+
+# send a request, retrying connection errors and overload responses; the last error is raised
+# as requests.exceptions.RequestException, the last response is returned whatever its status
+    def request(self, method, path, **kwargs):
+        retry_status = RETRY_STATUS if method == 'GET' else RETRY_STATUS_WRITE
+        for attempt in range(self.retries + 1):
+            try:
+                response = self.session.request(method, self.url(path), timeout=self.timeout, **kwargs)
+            except requests.exceptions.RequestException as e:
+                if attempt == self.retries or (method not in IDEMPOTENT_METHODS and not notSent(e)):
+                    raise
+                time.sleep(self.delay(attempt))
+                continue
+            if response.status_code in retry_status and attempt < self.retries:
+                wait = self.delay(attempt)
+                try:
+                    wait = max(wait, float(response.headers.get('Retry-After', 0)))
+                except ValueError:
+                    pass
+                time.sleep(wait)
+                continue
+            if response.status_code < 400:
+                with self.lock:
+                    self.failures = 0
+            return response
+
+    def get(self, path, params=None, ttl=None):
+        ttl = self.default_ttl if ttl is None else ttl
+        key = (self.url(path), tuple(sorted(params.items())) if params else ())
+        with self.lock:
+            if ttl > 0 and key in self.cache:
+                expiry, response = self.cache[key]
+                if expiry > time.monotonic():
+                    return response
+                del self.cache[key]
+            pending = self.pending.get(key)
+            leader = pending is None
+            if leader:
+                pending = PendingRequest()
+                self.pending[key] = pending
+                generation = self.generation
+        if not leader:
+            pending.done.wait()
+            if pending.error is not None:
+                raise pending.error
+            return pending.response
+        try:
+            response = self.request('GET', path, params=params)
+            response.content  # read the body before sharing the response between threads
+            pending.response = response
+            if ttl > 0 and response.status_code == 200:
+                with self.lock:
+                    if generation == self.generation:
+                        self.cache[key] = (time.monotonic() + ttl, response)
+            return response
+        except Exception as e:
+            pending.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.pending[key]
+            pending.done.set()
+
+    def post(self, path, body=None, headers=None):
+        return self.write('POST', path, body, headers)
+
+    def put(self, path, body=None, headers=None):
+        return self.write('PUT', path, body, headers)
+
+    def patch(self, path, body=None, headers=None):
+        return self.write('PATCH', path, body, headers)
+
+    def delete(self, path, headers=None, params=None):
+        return self.write('DELETE', path, None, headers, params)
+
+    def write(self, method, path, body, headers, params=None):
+        try:
+            return self.request(method, path, headers=headers, params=params,
+                                data=json.dumps(body) if body is not None else None)
+        finally:
+            self.invalidate(str(path).strip('/').split('/')[0])
+
+# drop the cached responses of a collection (and of the collections that depend on it), or all of them;
+# also to be called when the catalog is known to be changed by someone else
+    def invalidate(self, collection=None):
+        with self.lock:
+            self.generation += 1
+            if collection is None:
+                self.cache = {}
+                return
+            prefixes = [self.url(c) for c in DEPENDENT_COLLECTIONS.get(collection, [collection])]
+            for key in list(self.cache):
+                if any(key[0] == prefix or key[0].startswith((prefix + '/', prefix + '?')) for prefix in prefixes):
+                    del self.cache[key]
+
+    def close(self):
+        self.session.close()
@@ -0,0 +1,133 @@
+# CODEC
+# encoding of the MQTT payloads, used by MQTT_base: the codec of the messages published is chosen in the settings
+# ("codec" in "mqtt_data"), the payloads received are decoded with the codec detected from their first bytes,
+# so consumers read the messages of publishers using any codec.
+# - "json": the JSON text used before, the default
+# - "cbor": CBOR (RFC 8949) with the self-described CBOR tag 55799 (bytes D9 D9 F7) at the start; the SenML
+#           messages {'bn', 'e': [...]} are sent as SenML packs with the integer labels of the CBOR representation
+#           of SenML (RFC 8428, section 6), e.g. [{-2: "12", 0: "heart_rate", 2: 72, 6: 1712345678.5, 1: "bpm"}]
+# - "msgpack": MessagePack, the same structure of the JSON messages
+# MQTT 3.1.1 has no content type property, and a suffix in the topic would change the levels matched by the routes,
+# so the hint is the start of the payload: the CBOR tag, or the first character of a JSON text after the
+# whitespace ('{', '[', '"', '-', a digit, true, false, null), anything else is MessagePack (a MessagePack map or
+# array starts with a byte between 0x80 and 0x9f, or 0xdc-0xdf). A payload taken for MessagePack that is not
+# valid MessagePack is decoded as JSON (e.g. JSON starting with a byte order mark).
+# cbor2 and msgpack are needed only to publish or receive these codecs.
+
+import json
+
+try:
+    import cbor2
+except ImportError:
+    cbor2 = None
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+from senml import pack
+
+# self-described CBOR, tag 55799
+CBOR_TAG = b'\xd9\xd9\xf7'
+# SenML labels of the CBOR representation (RFC 8428, table 4)
+SENML_LABELS = {'bver': -1, 'bn': -2, 'bt': -3, 'bu': -4, 'bv': -5, 'bs': -16,
+                'n': 0, 'u': 1, 'v': 2, 'vs': 3, 'vb': 4, 's': 5, 't': 6, 'ut': 7, 'vd': 8}
+SENML_NAMES = {label: name for name, label in SENML_LABELS.items()}
+
+
+def isSenML(msg):
+    return isinstance(msg, dict) and 'bn' in msg and 'e' in msg
+
+
+class JSONCodec(object):
+    name = "json"
+
+    def encode(self, msg):
+        return json.dumps(msg)
+
+    def decode(self, payload):
+        return json.loads(payload)
+
+
+class CBORCodec(object):
+    name = "cbor"
+
+    def __init__(self):
+        if cbor2 is None:
+            raise ValueError("codec cbor needs the cbor2 package")
+
+# a SenML message (or a pack of records) is written with the integer labels
+    def encode(self, msg):
+        if isSenML(msg):
+            msg = pack([msg])
+        if isinstance(msg, list) and msg and all(isinstance(record, dict) and record.keys() <= SENML_LABELS.keys()
+                                                 for record in msg):
+            msg = [{SENML_LABELS.get(name, name): value for name, value in record.items()} for record in msg]
+        return CBOR_TAG + cbor2.dumps(msg)
+
+    def decode(self, payload):
+        msg = cbor2.loads(payload[len(CBOR_TAG):] if payload[:len(CBOR_TAG)] == CBOR_TAG else payload)
+        if isinstance(msg, list):
+            return [{SENML_NAMES.get(label, label): value for label, value in record.items()}
+                    if isinstance(record, dict) else record for record in msg]
+        return msg
+
+
+class MessagePackCodec(object):
+    name = "msgpack"
+
+    def __init__(self):
+        if msgpack is None:
+            raise ValueError("codec msgpack needs the msgpack package")
+
+    def encode(self, msg):
+        return msgpack.packb(msg)
+
+    def decode(self, payload):
+        return msgpack.unpackb(payload)
+
+
+CODECS = {"json": JSONCodec, "cbor": CBORCodec, "msgpack": MessagePackCodec}
+# one instance of each codec, created when it is first used
+instances = {}
+
+
+def getCodec(name):
+    codec = instances.get(name)
+    if codec is None:
+        if name not in CODECS:
+            raise ValueError(f"unknown codec {name}, must be one of {', '.join(CODECS)}")
+        codec = instances[name] = CODECS[name]()
+    return codec
+
+
+# first characters of a JSON text
+JSON_START = set('{["-0123456789tfn')
+
+
+# name of the codec of a payload received, from its first bytes
+def detect(payload):
+    if payload[:len(CBOR_TAG)] == CBOR_TAG:
+        return "cbor"
+    first = payload.lstrip()[:1]
+    if isinstance(first, bytes):
+        first = first.decode('latin-1')
+    if not first or first in JSON_START:
+        return "json"
+    return "msgpack"
+
+
+# decode a payload received, with the codec detected unless given
+def decode(payload, name=None):
+    name = name or detect(payload)
+    if name != "msgpack":
+        return getCodec(name).decode(payload)
+    # without the msgpack package getCodec raises ValueError, the payload can still be JSON
+    errors = (ValueError, msgpack.UnpackException) if msgpack is not None else ValueError
+    try:
+        return getCodec(name).decode(payload)
+    except errors as e:
+        try:
+            return json.loads(payload)
+        except ValueError:
+            raise e
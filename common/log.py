@@ -0,0 +1,80 @@
+# LOG
+# logging of the hot paths (every MQTT message, every measurement) shared by the services and the sensors.
+# It is the standard logging module with:
+# - the level from the settings, so the per message lines are written only when "level" is "DEBUG"
+# - lazy formatting: log.debug("received %s", payload) formats the line only if it is written
+# - a limit of lines per call site (file and line of the log call): at most "rate" lines per second with bursts
+#   of "burst" lines; the lines over the limit are counted and the number is added to the next line written
+# The lines are written on stdout as "NAME: message", like the other messages of the services.
+# settings (all optional, "logging" in the settings of the service):
+#   "level": DEBUG, INFO, WARNING or ERROR (default INFO)
+#   "rate": lines per second of each call site, 0 for no limit (default 10)
+#   "burst": lines written at once before the limit applies (default 20)
+
+import logging
+import sys
+import threading
+import time
+
+
+class RateLimit(object):
+    def __init__(self, rate=10, burst=20):
+        self.rate = rate
+        self.burst = burst
+        # call site: [tokens, time of the last update, suppressed lines]
+        self.sites = {}
+        self.lock = threading.Lock()
+
+# number of lines suppressed since the last line written from the call site, None if this line is suppressed
+    def allow(self, site):
+        now = time.monotonic()
+        with self.lock:
+            state = self.sites.get(site)
+            if state is None:
+                state = self.sites[site] = [self.burst, now, 0]
+            state[0] = min(self.burst, state[0] + (now - state[1]) * self.rate)
+            state[1] = now
+            if state[0] < 1:
+                state[2] += 1
+                return None
+            state[0] -= 1
+            suppressed, state[2] = state[2], 0
+        return suppressed
+
+
+limit = RateLimit()
+
+
+# logger returned by getLogger, the other loggers (cherrypy, urllib3, paho...) are not limited; the limit is
+# checked before the log record is created, a suppressed line costs only the lookup of its call site
+class RateLimitedLogger(logging.LoggerAdapter):
+    def log(self, level, msg, *args, stacklevel=1, **kwargs):
+        if not self.isEnabledFor(level):
+            return
+        if limit.rate:
+            # call site found as logging does, also for log() and wrappers with stacklevel, skipping this frame
+            filename, lineno, _, _ = self.logger.findCaller(False, stacklevel + 1)
+            suppressed = limit.allow((filename, lineno))
+            if suppressed is None:
+                return
+            if suppressed:
+                msg = f"{msg % args if args else msg} ({suppressed} similar lines suppressed)"
+                args = ()
+        msg, kwargs = self.process(msg, kwargs)
+        self.logger.log(level, msg, *args, stacklevel=stacklevel + 1, **kwargs)
+
+
+def setupLogging(settings={}):
+    limit.rate = settings.get("rate", 10)
+    limit.burst = settings.get("burst", 20)
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(logging.Formatter("%(name)s: %(message)s"))
+    root = logging.getLogger()
+    for previous in list(root.handlers):
+        root.removeHandler(previous)
+    root.addHandler(handler)
+    root.setLevel(settings.get("level", "INFO").upper())
+
+
+def getLogger(name):
+    return RateLimitedLogger(logging.getLogger(name))
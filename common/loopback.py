@@ -0,0 +1,309 @@
+# LOOPBACK
+# in-process MQTT transport, used by MQTT_base instead of paho when "transport" is "loopback" in the settings:
+# the clients of the same process with the same broker and port share a LoopbackBroker, so that a whole pipeline
+# (sensors -> thingspeak adaptor / time control -> telegram bot) runs in one process without mosquitto,
+# e.g. for benchmarks and tests of the notify paths (see benchmark_pipeline.py).
+# LoopbackClient has the methods and callbacks of paho.mqtt.client.Client used by MQTT_base, and the broker
+# keeps the semantics of mosquitto used by the services:
+# - topic filters with + and # (matched by the trie of topic_router.py), one delivery per client and topic
+#   with the highest QoS of its matching subscriptions, and the QoS of the delivery min(publish, subscription)
+# - shared subscriptions $share/<group>/<filter>: each message goes to one member of the group, in turn
+# - persistent sessions (clean session off): the subscriptions are kept after the disconnection and the QoS 1/2
+#   messages are queued (at most maxQueued, then the new ones are dropped) and delivered at the next connection
+# - publish while disconnected returns MQTT_ERR_NO_CONN, so the spool of MQTT_base works the same way
+# - at most maxInflight QoS 1/2 messages are delivered and not acknowledged yet (max_inflight_messages of
+#   mosquitto), the next ones wait in the session; a message is acknowledged when on_message returns, or by ack
+#   with manual_ack (as MQTT_base does); the messages not acknowledged when the client disconnects are delivered
+#   again at the next connection of a persistent session
+# Retained messages and will messages are not used by the services and are not implemented.
+# A message is delivered on the thread of the publisher: on_message of the subscribers is called by publish,
+# and MQTT_base queues it to its workers (or handles it at once with "workers": 0, then a publish returns when the
+# whole pipeline has handled the message, which makes the runs deterministic).
+
+import collections
+import itertools
+import threading
+
+import paho.mqtt.client as PahoMQTT
+from paho.mqtt.packettypes import PacketTypes
+from paho.mqtt.reasoncodes import ReasonCode
+
+from topic_router import TopicRouter
+
+# (host, port): broker
+brokers = {}
+brokers_lock = threading.Lock()
+
+
+def getBroker(host, port):
+    with brokers_lock:
+        broker = brokers.get((host, port))
+        if broker is None:
+            broker = brokers[(host, port)] = LoopbackBroker()
+        return broker
+
+
+# message received by on_message, with the attributes of paho.mqtt.client.MQTTMessage
+class LoopbackMessage(object):
+    def __init__(self, topic, payload, qos, mid):
+        self.topic = topic
+        self.payload = payload
+        self.qos = qos
+        self.retain = False
+        self.mid = mid
+
+
+# result of publish, like paho.mqtt.client.MQTTMessageInfo: the message has already been delivered
+class PublishInfo(object):
+    def __init__(self, rc, mid):
+        self.rc = rc
+        self.mid = mid
+
+    def is_published(self):
+        return self.rc == PahoMQTT.MQTT_ERR_SUCCESS
+
+    def wait_for_publish(self, timeout=None):
+        pass
+
+
+class Session(object):
+    def __init__(self, clientID, clean):
+        self.client_id = clientID
+        self.clean = clean
+        # topic filter: QoS
+        self.subscriptions = {}
+        self.client = None
+        # messages waiting for the connection of the client, or behind the ones being delivered at the connection
+        self.pending = collections.deque()
+        # mid: QoS 1/2 message delivered and not acknowledged yet
+        self.inflight = collections.OrderedDict()
+        # set while a thread delivers the pending messages
+        self.flushing = False
+
+
+# members of a shared subscription, the messages go to the connected members in turn
+class SharedSubscription(object):
+    def __init__(self, group):
+        self.group = group
+        self.members = []
+        self.next = 0
+
+    def choose(self):
+        connected = [session for session in self.members if session.client is not None]
+        candidates = connected or [session for session in self.members if not session.clean]
+        if not candidates:
+            return None
+        self.next += 1
+        return candidates[self.next % len(candidates)]
+
+
+class LoopbackBroker(object):
+    def __init__(self, maxQueued=1000, maxInflight=20):
+        self.max_queued = maxQueued
+        self.max_inflight = maxInflight
+        self.sessions = {}
+        self.router = TopicRouter()
+        self.dropped = 0
+        self.lock = threading.Lock()
+        self.mids = itertools.count(1)
+
+# the trie is built again when the subscriptions change, which is rare compared to the messages
+    def rebuild(self):
+        router = TopicRouter()
+        groups = {}
+        for session in self.sessions.values():
+            for topicFilter, qos in session.subscriptions.items():
+                if topicFilter.startswith('$share/'):
+                    _, group, topicFilter = topicFilter.split('/', 2)
+                    if (group, topicFilter) not in groups:
+                        groups[(group, topicFilter)] = SharedSubscription(group)
+                        router.add(topicFilter, (groups[(group, topicFilter)], qos))
+                    groups[(group, topicFilter)].members.append(session)
+                else:
+                    router.add(topicFilter, (session, qos))
+        self.router = router
+
+# True if the session of a persistent client has been resumed
+    def connect(self, client):
+        with self.lock:
+            session = self.sessions.get(client.client_id)
+            present = session is not None and not session.clean and not client.clean_session
+            if not present:
+                session = self.sessions[client.client_id] = Session(client.client_id, client.clean_session)
+                self.rebuild()
+            session.client = client
+        return session, present
+
+    def disconnect(self, session):
+        with self.lock:
+            session.client = None
+            if not session.clean:
+                session.pending.extendleft(reversed(session.inflight.values()))
+            session.inflight.clear()
+            if session.clean and self.sessions.get(session.client_id) is session:
+                del self.sessions[session.client_id]
+                self.rebuild()
+
+    def subscribe(self, session, topicFilter, qos):
+        with self.lock:
+            session.subscriptions[topicFilter] = qos
+            self.rebuild()
+
+    def unsubscribe(self, session, topicFilter):
+        with self.lock:
+            if session.subscriptions.pop(topicFilter, None) is not None:
+                self.rebuild()
+
+    def publish(self, topic, payload, qos):
+        deliveries = []
+        with self.lock:
+            # highest QoS of the subscriptions of each session matching the topic
+            sessions = {}
+            for (subscriber, subscription_qos), params in self.router.match(topic):
+                if isinstance(subscriber, SharedSubscription):
+                    subscriber = subscriber.choose()
+                    if subscriber is None:
+                        continue
+                sessions[subscriber] = max(sessions.get(subscriber, 0), subscription_qos)
+            for session, subscription_qos in sessions.items():
+                message = LoopbackMessage(topic, payload, min(qos, subscription_qos), next(self.mids))
+                if session.client is not None and not session.pending and self.admit(session, message):
+                    deliveries.append((session.client, message))
+                elif session.client is not None or (not session.clean and message.qos > 0):
+                    if len(session.pending) < self.max_queued:
+                        session.pending.append(message)
+                    else:
+                        self.dropped += 1
+        # the subscribers are called without the lock, they can publish in their turn
+        for client, message in deliveries:
+            client.deliver(message)
+
+# a QoS 1/2 message is delivered only if the window of the messages not acknowledged is not full
+    def admit(self, session, message):
+        if message.qos == 0:
+            return True
+        if len(session.inflight) >= self.max_inflight:
+            return False
+        session.inflight[message.mid] = message
+        return True
+
+    def ack(self, session, mid):
+        with self.lock:
+            session.inflight.pop(mid, None)
+        self.flush(session)
+
+# the queued messages are delivered in order, the messages published meanwhile wait behind them;
+# one thread at a time delivers them, an ack in on_message does not deliver the next message recursively
+    def flush(self, session):
+        with self.lock:
+            if session.flushing:
+                return
+            session.flushing = True
+        while True:
+            with self.lock:
+                if not session.pending or session.client is None or not self.admit(session, session.pending[0]):
+                    session.flushing = False
+                    return
+                message = session.pending.popleft()
+                client = session.client
+            client.deliver(message)
+
+
+# client with the interface of paho.mqtt.client.Client used by MQTT_base
+class LoopbackClient(object):
+    def __init__(self, clientID, clean_session=True, manual_ack=False):
+        self.client_id = clientID
+        self.clean_session = clean_session
+        self.manual_ack = manual_ack
+        self.on_connect = None
+        self.on_message = None
+        self.on_disconnect = None
+        self.broker = None
+        self.session = None
+        self.session_present = False
+
+    def connect_async(self, host, port=1883, keepalive=60):
+        self.broker = getBroker(host, port)
+
+    def connect(self, host, port=1883, keepalive=60):
+        self.connect_async(host, port, keepalive)
+        return self.reconnect()
+
+    def reconnect(self):
+        if self.broker is None:
+            raise ValueError("connect_async must be called before reconnect")
+        self.session, self.session_present = self.broker.connect(self)
+        return PahoMQTT.MQTT_ERR_SUCCESS
+
+    def is_connected(self):
+        return self.session is not None
+
+    def disconnect(self):
+        session = self.session
+        if session is None:
+            return PahoMQTT.MQTT_ERR_NO_CONN
+        self.session = None
+        self.broker.disconnect(session)
+        if self.on_disconnect is not None:
+            self.on_disconnect(self, None, PahoMQTT.DisconnectFlags(False),
+                               ReasonCode(PacketTypes.DISCONNECT, "Normal disconnection"), None)
+        return PahoMQTT.MQTT_ERR_SUCCESS
+
+# the messages are delivered by the publishers, there is no network thread: like paho after the CONNACK,
+# on_connect is called and the messages queued in the session are delivered when the loop starts
+    def loop_start(self):
+        session = self.session
+        if session is None:
+            return
+        if self.on_connect is not None:
+            self.on_connect(self, None, PahoMQTT.ConnectFlags(self.session_present),
+                            ReasonCode(PacketTypes.CONNACK, "Success"), None)
+        self.broker.flush(session)
+
+    def loop_stop(self, force=False):
+        pass
+
+    def subscribe(self, topic, qos=0):
+        session = self.session
+        if session is None:
+            return PahoMQTT.MQTT_ERR_NO_CONN, None
+        self.broker.subscribe(session, topic, qos)
+        return PahoMQTT.MQTT_ERR_SUCCESS, None
+
+    def unsubscribe(self, topic):
+        session = self.session
+        if session is None:
+            return PahoMQTT.MQTT_ERR_NO_CONN, None
+        self.broker.unsubscribe(session, topic)
+        return PahoMQTT.MQTT_ERR_SUCCESS, None
+
+    def publish(self, topic, payload=None, qos=0, retain=False):
+        if self.session is None:
+            return PublishInfo(PahoMQTT.MQTT_ERR_NO_CONN, None)
+        # payloads as paho sends them
+        if payload is None:
+            payload = b''
+        elif isinstance(payload, str):
+            payload = payload.encode()
+        elif isinstance(payload, (int, float)):
+            payload = str(payload).encode()
+        self.broker.publish(topic, payload, qos)
+        return PublishInfo(PahoMQTT.MQTT_ERR_SUCCESS, None)
+
+    def manual_ack_set(self, on):
+        self.manual_ack = on
+
+# the acknowledgement of a message that is not in flight is ignored
+    def ack(self, mid, qos):
+        session = self.session
+        if session is not None and qos > 0:
+            self.broker.ack(session, mid)
+        return PahoMQTT.MQTT_ERR_SUCCESS
+
+# without manual_ack the message is acknowledged when on_message returns, unless the client has disconnected
+    def deliver(self, message):
+        session = self.session
+        if self.on_message is not None:
+            self.on_message(self, None, message)
+        if not self.manual_ack and self.session is session:
+            self.ack(message.mid, message.qos)
@@ -0,0 +1,169 @@
+# REGISTRATION RUNTIME
+# registration of the services and of the sensors in the catalog, shared by all of them:
+# - ID acquisition (the ID in the settings is kept if free, otherwise the next free one is used)
+# - registration, retried until the catalog accepts it
+# - heartbeats (PUT of the entity every pingInterval seconds) and re-registration when the catalog
+#   answers 404, e.g. after the catalog manager has removed the entity
+# All the heartbeats of a process are sent by a single scheduler thread, and the first heartbeat of each
+# entity is delayed by a random phase, so that services started together do not ping the catalog in lockstep.
+# A service is registered with one line:
+#     self.registration = register(self.catalog, "services", self.serviceInfo, self.pingInterval)
+
+import heapq
+import random
+import threading
+import time
+
+import requests
+
+SINGULAR = {"services": "service", "devices": "device"}
+
+
+class Registration(object):
+    def __init__(self, catalog, collection, info, pingInterval, onRegistered=None):
+        self.catalog = catalog
+        self.collection = collection
+        self.info = info
+        self.pingInterval = pingInterval
+        self.onRegistered = onRegistered
+        self.name = SINGULAR.get(collection, collection)
+        self.registered = False
+        self.cancelled = False
+
+    @property
+    def ID(self):
+        return self.info.get('ID')
+
+# ID requested in the settings, None if it is not set ("ID": "" in the settings of the services and sensors)
+    def requestedID(self):
+        try:
+            return int(self.ID)
+        except (TypeError, ValueError):
+            return None
+
+# next free ID, the current one is kept if not used by another entity
+    def assignID(self):
+        while True:
+            try:
+                response = self.catalog.get(f'/{self.collection}', ttl=0)
+            except requests.exceptions.RequestException:
+                print(f"REGISTRATION: failed request for {self.collection} from catalog, retrying...")
+                self.catalog.backoff()
+                continue
+            if response.status_code != 200:
+                print(f"REGISTRATION: failed to get {self.collection} from catalog, status code {response.status_code}, retrying...")
+                self.catalog.backoff()
+                continue
+            entities = response.json()[self.collection]
+            used = [int(entity['ID']) for entity in entities]
+            requested = self.requestedID()
+            if requested is not None and requested not in used:
+                return requested
+            if requested is not None:
+                print(f"REGISTRATION: {self.name} ID {self.ID} already used, assigning a new one")
+            return max(used) + 1 if used else 1
+
+    def register(self):
+        self.info['ID'] = self.assignID()
+        while not self.cancelled:
+            try:
+                response = self.catalog.post(f'/{self.collection}', self.info)
+            except requests.exceptions.RequestException:
+                print(f"REGISTRATION: failed request for registering {self.name} {self.ID} in catalog, retrying...")
+                self.catalog.backoff()
+                continue
+            if response.status_code == 200:
+                print(f"REGISTRATION: {self.name} {self.ID} registered in catalog")
+                self.registered = True
+                if self.onRegistered is not None:
+                    self.onRegistered(self.ID)
+                return self.ID
+            if response.status_code == 404:
+                # a device can be registered only when its patient is in the catalog
+                print(f"REGISTRATION: {self.name} {self.ID} not registered: {response.text}")
+            elif response.status_code not in (429, 503):
+                print(f"REGISTRATION: failed to register {self.name} {self.ID} in catalog, retrying with a new ID...")
+                self.info['ID'] = self.assignID()
+            self.catalog.backoff()
+
+# heartbeat, returns False if the entity is not in the catalog anymore
+    def heartbeat(self):
+        try:
+            response = self.catalog.put(f'/{self.collection}', self.info)
+        except requests.exceptions.RequestException:
+            print(f"REGISTRATION: failed request for updating {self.name} {self.ID} in catalog")
+            return True
+        if response.status_code == 404:
+            print(f"REGISTRATION: {self.name} {self.ID} not in catalog anymore, registering again")
+            self.registered = False
+            return False
+        if response.status_code != 200:
+            print(f"REGISTRATION: failed to update {self.name} {self.ID} in catalog, status code {response.status_code}")
+        return True
+
+
+# single thread sending the heartbeats of all the registrations of the process
+class HeartbeatScheduler(object):
+    def __init__(self):
+        self.queue = []
+        self.sequence = 0
+        self.condition = threading.Condition()
+        self.thread = None
+
+    def schedule(self, registration, delay):
+        with self.condition:
+            self.sequence += 1
+            heapq.heappush(self.queue, (time.monotonic() + delay, self.sequence, registration))
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.loop, daemon=True, name='heartbeats')
+                self.thread.start()
+            self.condition.notify()
+
+    def add(self, registration):
+        # random phase in the first interval, then one heartbeat every pingInterval
+        self.schedule(registration, random.uniform(0, registration.pingInterval))
+
+    def loop(self):
+        while True:
+            with self.condition:
+                while not self.queue or self.queue[0][0] > time.monotonic():
+                    self.condition.wait(self.queue[0][0] - time.monotonic() if self.queue else None)
+                _, _, registration = heapq.heappop(self.queue)
+            if registration.cancelled:
+                continue
+            try:
+                if not registration.heartbeat():
+                    # the registration is retried until the catalog accepts it (e.g. a device waits for its patient):
+                    # it runs on its own thread, so that the heartbeats of the other entities are not delayed
+                    threading.Thread(target=self.registerAgain, args=(registration,), daemon=True,
+                                     name='registration').start()
+                    continue
+            except Exception as e:
+                print(f"REGISTRATION: error in heartbeat of {registration.name} {registration.ID}: {e}")
+            self.schedule(registration, registration.pingInterval)
+
+# the heartbeats of the entity start again once it is registered
+    def registerAgain(self, registration):
+        try:
+            registration.register()
+        except Exception as e:
+            print(f"REGISTRATION: error in registration of {registration.name} {registration.ID}: {e}")
+        if not registration.cancelled:
+            self.schedule(registration, registration.pingInterval)
+
+
+scheduler = HeartbeatScheduler()
+
+
+# register an entity ("services" or "devices") and keep it alive with heartbeats,
+# info['ID'] is updated with the ID assigned by the catalog, and onRegistered(ID) is called
+# at every (re-)registration, since the ID can change
+def register(catalog, collection, info, pingInterval, onRegistered=None):
+    registration = Registration(catalog, collection, info, pingInterval, onRegistered)
+    registration.register()
+    scheduler.add(registration)
+    return registration
+
+
+def unregister(registration):
+    registration.cancelled = True
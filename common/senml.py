@@ -0,0 +1,49 @@
+# SENML
+# conversion between the messages published by the sensors, {'bn': deviceID, 'e': [{'n', 'v', 't', 'u'}]},
+# and SenML packs (RFC 8428): a JSON array of records {'n', 'v', 't', 'u'}, where the base name 'bn'
+# applies to the records that follow it.
+# pack writes the base name in the first record of every message, also when it does not change, so that the
+# records of a message with several entries (e.g. related fields measured at the same time) stay together:
+# unpack starts a new message at each record with a base name. MQTT_base sends the batched messages of a topic
+# as one pack and splits the packs it receives, so that the consumers see the messages as they were published.
+# A pack made by another producer with a single base name is delivered as one message with all its entries.
+
+
+def pack(messages):
+    records = []
+    for message in messages:
+        for i, entry in enumerate(message['e']):
+            record = dict(entry)
+            if i == 0:
+                record['bn'] = message['bn']
+            records.append(record)
+    return records
+
+
+def unpack(records):
+    messages = []
+    base_name = ''
+    for record in records:
+        entry = dict(record)
+        if 'bn' in entry or not messages:
+            base_name = entry.pop('bn', base_name)
+            messages.append({'bn': base_name, 'e': []})
+        messages[-1]['e'].append(entry)
+    return messages
+
+
+# a pack is a JSON array, a single message is a JSON object; the array is a pack only if isSenMLPack
+def isPack(payload):
+    return payload.lstrip()[:1] in (b'[', '[')
+
+
+# fields of the SenML records (RFC 8428, section 4)
+SENML_FIELDS = {'bver', 'bn', 'bt', 'bu', 'bv', 'bs', 'n', 'u', 'v', 'vs', 'vb', 'vd', 's', 't', 'ut'}
+
+
+# a decoded array is a SenML pack if all its items are records with a name and only SenML fields,
+# any other array (e.g. a list of IDs) is not a pack and is delivered as it is
+def isSenMLPack(records):
+    return (isinstance(records, list) and len(records) > 0
+            and all(isinstance(record, dict) and ('n' in record or 'bn' in record)
+                    and record.keys() <= SENML_FIELDS for record in records))
@@ -0,0 +1,109 @@
+# SPOOL
+# bounded ring buffer on disk for the messages published while the broker is not reachable, used by MQTT_base.
+# The file has a fixed size: a header with the position of the oldest message and the number of messages,
+# and capacity slots of slotSize bytes, one message per slot. When the spool is full the oldest message is
+# overwritten (dropPolicy "oldest") or the new message is discarded (dropPolicy "newest"), so an outage never
+# grows the memory or the disk used. The header is rewritten at each change, the messages left in the file
+# by a stopped service are replayed when it starts again.
+
+import os
+import struct
+import threading
+
+from log import getLogger
+
+MAGIC = b'SPL1'
+# magic, capacity, slot size, sequence number of the oldest message, number of messages
+HEADER = struct.Struct('<4sIIQQ')
+HEADER_SIZE = 32
+# QoS, topic length, payload length
+RECORD = struct.Struct('<BHI')
+
+log = getLogger("SPOOL")
+
+
+class Spool(object):
+    def __init__(self, path, capacity=10000, slotSize=1024, dropPolicy="oldest"):
+        if dropPolicy not in ("oldest", "newest"):
+            raise ValueError("dropPolicy must be 'oldest' or 'newest'")
+        if slotSize <= RECORD.size:
+            raise ValueError(f"slotSize must be larger than {RECORD.size} bytes")
+        self.path = path
+        self.capacity = capacity
+        self.slot_size = slotSize
+        self.drop_policy = dropPolicy
+        self.dropped = 0
+        self.lock = threading.Lock()
+        self.fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        self.head, self.count = self.load()
+
+    def load(self):
+        header = os.pread(self.fd, HEADER.size, 0)
+        if len(header) == HEADER.size:
+            magic, capacity, slot_size, head, count = HEADER.unpack(header)
+            if magic == MAGIC and capacity == self.capacity and slot_size == self.slot_size and count <= capacity:
+                if count:
+                    log.info("%d messages left in %s will be replayed", count, self.path)
+                return head, count
+            log.warning("%s has a different format or size, the messages in it are discarded", self.path)
+        os.ftruncate(self.fd, HEADER_SIZE + self.capacity * self.slot_size)
+        self.head, self.count = 0, 0
+        self.saveHeader()
+        return 0, 0
+
+    def saveHeader(self):
+        os.pwrite(self.fd, HEADER.pack(MAGIC, self.capacity, self.slot_size, self.head, self.count), 0)
+
+    def offset(self, index):
+        return HEADER_SIZE + (index % self.capacity) * self.slot_size
+
+    def __len__(self):
+        with self.lock:
+            return self.count
+
+# add a message at the end, False if it has been discarded
+    def append(self, topic, payload, qos):
+        if isinstance(payload, str):
+            payload = payload.encode()
+        topic = topic.encode()
+        record = RECORD.pack(qos, len(topic), len(payload)) + topic + payload
+        if len(record) > self.slot_size:
+            with self.lock:
+                self.dropped += 1
+            log.error("message of %d bytes on topic %s larger than the slots, discarded", len(record), topic.decode())
+            return False
+        with self.lock:
+            if self.count == self.capacity:
+                self.dropped += 1
+                if self.drop_policy == "newest":
+                    return False
+                self.head += 1
+                self.count -= 1
+            os.pwrite(self.fd, record, self.offset(self.head + self.count))
+            self.count += 1
+            self.saveHeader()
+        return True
+
+# oldest message as (sequence, topic, payload, qos), None if the spool is empty
+    def peek(self):
+        with self.lock:
+            if not self.count:
+                return None
+            sequence = self.head
+            slot = os.pread(self.fd, self.slot_size, self.offset(sequence))
+        qos, topic_length, payload_length = RECORD.unpack_from(slot)
+        topic = slot[RECORD.size:RECORD.size + topic_length].decode()
+        payload = slot[RECORD.size + topic_length:RECORD.size + topic_length + payload_length]
+        return sequence, topic, payload, qos
+
+# remove the message returned by peek after it has been published,
+# unless it has already been overwritten by a newer one while the spool was full
+    def pop(self, sequence):
+        with self.lock:
+            if self.count and self.head == sequence:
+                self.head += 1
+                self.count -= 1
+                self.saveHeader()
+
+    def close(self):
+        os.close(self.fd)
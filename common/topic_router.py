@@ -0,0 +1,112 @@
+# TOPIC ROUTER
+# dispatch of the MQTT messages to handlers registered on topic filters, used by MQTT_base.
+# A filter is an MQTT topic filter where a level can be a named parameter, e.g.
+#     project/sensors/{patientID}/{deviceID}/{field}
+# {name} matches one level like +, and its value is passed to the handler in message.params;
+# + and # keep their MQTT meaning. The filters are compiled in a trie with one node per level,
+# so matching a topic costs O(topic depth) and does not depend on the number of filters.
+
+import json
+
+
+# received message with the parameters extracted from its topic, the JSON payload is decoded once when used
+# (the messages split from a SenML pack or received with a binary codec are already decoded, their payload
+# is encoded in JSON only if it is used)
+class Message(object):
+    def __init__(self, topic, payload, params, message=None):
+        self.topic = topic
+        self._payload = payload
+        self.params = params
+        self._message = message
+
+    @property
+    def payload(self):
+        if self._payload is None:
+            self._payload = json.dumps(self._message)
+        return self._payload
+
+    @property
+    def message(self):
+        if self._message is None:
+            self._message = json.loads(self._payload)
+        return self._message
+
+
+class TrieNode(object):
+    def __init__(self):
+        self.children = {}
+        # child matching any single level, for + and {name}
+        self.wildcard = None
+        # (handler, names of the wildcard levels) of the filters ending at this level
+        self.handlers = []
+        # the same, for the filters ending with # at this level
+        self.multilevel = []
+
+
+def isParameter(level):
+    return level.startswith('{') and level.endswith('}')
+
+
+# MQTT filter for the broker: {name} levels become +
+def subscriptionFilter(topicFilter):
+    return '/'.join('+' if isParameter(level) else level for level in topicFilter.split('/'))
+
+
+class TopicRouter(object):
+    def __init__(self):
+        self.root = TrieNode()
+        self.filters = []
+
+    def add(self, topicFilter, handler):
+        node = self.root
+        levels = topicFilter.split('/')
+        # the names are kept with the handler, so that filters with different names on the same level share the nodes
+        names = []
+        for i, level in enumerate(levels):
+            if level == '#':
+                if i != len(levels) - 1:
+                    raise ValueError(f"Topic filter {topicFilter}: # must be the last level")
+                node.multilevel.append((handler, names))
+                self.filters.append(topicFilter)
+                return
+            if level == '+' or isParameter(level):
+                names.append(level[1:-1] if level != '+' else None)
+                if node.wildcard is None:
+                    node.wildcard = TrieNode()
+                node = node.wildcard
+            else:
+                node = node.children.setdefault(level, TrieNode())
+        node.handlers.append((handler, names))
+        self.filters.append(topicFilter)
+
+    def __len__(self):
+        return len(self.filters)
+
+# handlers matching the topic, each with the parameters extracted from the topic
+    def match(self, topic):
+        matches = []
+        # the branches are followed in parallel, as a literal level and a wildcard can both match,
+        # with the values of the wildcard levels met on each branch
+        states = [(self.root, ())]
+        for level in topic.split('/'):
+            next_states = []
+            for node, values in states:
+                for handler, names in node.multilevel:
+                    matches.append((handler, parameters(names, values)))
+                child = node.children.get(level)
+                if child is not None:
+                    next_states.append((child, values))
+                if node.wildcard is not None:
+                    next_states.append((node.wildcard, values + (level,)))
+            states = next_states
+            if not states:
+                break
+        for node, values in states:
+            # a/# matches also a
+            for handler, names in node.handlers + node.multilevel:
+                matches.append((handler, parameters(names, values)))
+        return matches
+
+
+def parameters(names, values):
+    return {name: value for name, value in zip(names, values) if name is not None}
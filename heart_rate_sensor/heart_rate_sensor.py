@@ -2,8 +2,11 @@
 # "catalogURL": "http://catalog",
 import random
 import time
-from MQTT_base import *
+import json
 from sensor import Sensor
+from log import setupLogging, getLogger
+
+log = getLogger("HEART RATE SENSOR")
 
 class HeartRateSensor(Sensor):
     def __init__(self,settings):
@@ -52,8 +55,8 @@ class HeartRateSensor(Sensor):
         message['e'][0]['v']=self.read_heart_rate()
         message['e'][0]['t']=time.time()
 
-        self.client.publish(f'{self.topic}/heart_rate/{self.deviceID}',message)
-        print(f"published Message: \n {message}")
+        self.client.publish(f'{self.topic}/heart_rate',message)
+        log.debug("published message: %s", message)
 
 # Signal handling for shutdown with stopping the container
 import signal
@@ -76,6 +79,7 @@ if __name__ == '__main__':
     except FileNotFoundError as e:
         print(f"HEART RATE SENSOR: Json settings file not found")
         exit(1)
+    setupLogging(settings.get('logging', {}))
     heart_rate_sensor = None
     try:
         heart_rate_sensor = HeartRateSensor(settings)
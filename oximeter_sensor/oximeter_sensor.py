@@ -3,8 +3,11 @@
 # TO DO: change duration of low oxigen to 10-20 minutes (more realistic)
 import random
 import time
-from MQTT_base import *
+import json
 from sensor import Sensor
+from log import setupLogging, getLogger
+
+log = getLogger("OXIMETER")
 
 class Oximeter(Sensor):
     def __init__(self, pi):
@@ -42,8 +45,8 @@ class Oximeter(Sensor):
         message['e'][0]['v']=self.read_oxygen_saturation()
         message['e'][0]['t']=time.time()
 
-        self.client.publish(f'{self.topic}/{self.deviceID}/oxygen_saturation',message)
-        print(f"published Message: \n {message}")
+        self.client.publish(f'{self.topic}/oxygen_saturation',message)
+        log.debug("published message: %s", message)
 
 # Signal handling for shutdown with stopping the container
 import signal
@@ -66,6 +69,7 @@ if __name__ == '__main__':
     except FileNotFoundError as e:
         print(f"OXIMETER: Json settings file not found")
         exit(1)
+    setupLogging(settings.get('logging', {}))
     oximeter = None
     try:
         oximeter = Oximeter(settings)
@@ -25,7 +25,7 @@ class TelegramBot:
         self.port=port
         self.topic_subscribe=topic_subscribe
         self.topic_publish=topic_publish
-        self.client=PahoMQTT.Client(self.clientID, True)
+        self.client=PahoMQTT.Client(PahoMQTT.CallbackAPIVersion.VERSION1, self.clientID, True)
         self.client.on_connect = self.onConnect
         self.client.on_message = self.onMqttMsgReceived
         self.start()
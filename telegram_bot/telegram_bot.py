@@ -6,10 +6,18 @@ import time
 import paho.mqtt.client as PahoMQTT
 import json
 import requests
-import uuid
-from MQTT_base import MQTT_base
+import os
+import sys
+# the common modules are copied next to the service in the docker image, and are in ../common otherwise
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'common'))
+from catalog_client import CatalogClient
+from registration import register, unregister
+from MQTT_base import MQTT_base, clientIdentifier
+from log import setupLogging, getLogger
 import threading
 
+log = getLogger("TELEGRAM BOT")
+
 def read_json_file(file_name):
     try:
         with open(file_name , 'r') as file:
@@ -37,6 +45,7 @@ class TelegramBot:
         if 'mqtt_data' not in settings or 'catalogURL' not in settings or 'serviceInfo' not in settings or 'telegramToken' not in settings or 'timeShiftUrl' not in settings:
             raise ValueError("Settings must contain 'mqtt_data', 'catalogURL', 'serviceInfo', 'telegramToken', and 'timeShiftUrl' keys")
         self.catalogURL = settings['catalogURL']
+        self.catalog = CatalogClient(self.catalogURL, settings.get('catalogClient', {}))
         self.serviceInfo = settings['serviceInfo']
         self.telegram_token = settings['telegramToken']
         self.timeShiftUrl = settings['timeShiftUrl']
@@ -47,12 +56,9 @@ class TelegramBot:
         self.broker = settings["mqtt_data"]["broker"]
         self.port = settings["mqtt_data"]["port"]
         self.topic = settings["mqtt_data"]["mqtt_topic"]
-        self.clientID = str(uuid.uuid1())
-        self.client=MQTT_base(self.clientID,self.broker,self.port,self) 
+        self.clientID = clientIdentifier(settings['mqtt_data'])
+        self.client=MQTT_base(self.clientID,self.broker,self.port,self,settings['mqtt_data'])
         self.thingspeak_fields = settings["thingspeak_fields"]
-        self.serviceID = None
-        self.serviceInfo['ID'] = self.assign_serviceID()
-        self.serviceID = self.serviceInfo['ID']
         try:
             self.bot=telepot.Bot(self.telegram_token)
             MessageLoop(self.bot, {'chat': self.on_chat_message,'callback_query': self.on_callback_query}).run_as_thread()
@@ -62,13 +68,11 @@ class TelegramBot:
         self.start()
 
     def start (self):
-        self.registerService()
+        self.registration = register(self.catalog, "services", self.serviceInfo, self.pingInterval)
         self.client.start()
         self.client.subscribe(self.topic)
-        # two thread are needed, one for updating the service in catalog, the other to send notifications for medications
-        self.update_thread = threading.Thread(target=self.update_loop,daemon=True)
+        # thread to send notifications for medications
         self.notification_thread = threading.Thread(target=self.notification_loop,daemon=True)
-        self.update_thread.start()
         self.notification_thread.start()
         # when the Telegram bot becomes available, it sends a message to all registered chats
         chats = self.getchatIDs()
@@ -91,10 +95,7 @@ class TelegramBot:
                 self.bot.sendMessage(chatID, "The Telegram bot is stopping, you will not receive any more notifications.")
             except telepot.exception.TelegramError as e:
                 print(f"TELEGRAM BOT: Error sending message to chat ID {chatID}: {e}")
-        try:
-            self.update_thread.join()
-        except Exception as e:
-            print(f"TELEGRAM BOT: Error joining update thread: {e}")
+        unregister(self.registration)
         try:
             self.notification_thread.join()
         except Exception as e:
@@ -103,7 +104,7 @@ class TelegramBot:
 # gets chat IDs form catalog 
     def getchatIDs(self):
         try:
-            response = requests.get(f'{self.catalogURL}/chats')
+            response = self.catalog.get('/chats')
         except requests.exceptions.RequestException as e:
             print(f"TELEGRAM BOT: Error requesting chats from catalog: {e}")
             return []
@@ -119,22 +120,6 @@ class TelegramBot:
             return []
         return [chat['ID'] for chat in chats]
 
-# loop to update service in catalog
-    def update_loop(self):
-        while True:
-            time.sleep(self.pingInterval)
-            self.updateService()
-
-    def updateService(self):
-        try:
-            request=requests.put(f'{self.catalogURL}/services',data=json.dumps(self.serviceInfo))
-        except requests.exceptions.RequestException:
-            print(f"TELEGRAM BOT: failed request for updating service {self.serviceInfo['ID']} in catalog")
-            return
-        if request.status_code != 200:
-            print(f"TELEGRAM BOT: failed to update service {self.serviceInfo['ID']} in catalog, registering again")
-            self.registerService()  # If update fails, try to register the service again
-
 # loop to send notifications for medications
 # every hour, it checks the catalog for medications at that hour and sends notifications to registered chats
     def notification_loop(self):
@@ -148,7 +133,7 @@ class TelegramBot:
     def sendNotifications(self):
         print("TELEGRAM BOT: Checking for medication notifications...")
         try:
-            response = requests.get(f'{self.catalogURL}/medications')
+            response = self.catalog.get('/medications')
         except requests.exceptions.RequestException as e:
             print(f"TELEGRAM BOT: Error requesting medications: {e}")
             return
@@ -172,55 +157,22 @@ class TelegramBot:
                     except telepot.exception.TelegramError as e:
                         print(f"TELEGRAM BOT: Error sending notification to chat ID {chatID}: {e}")
 
-# assign an ID to the service   
-    def assign_serviceID(self):
-        # Loop until a valid service ID is obtained
-        while True: 
-            try:
-                response = requests.get(f'{self.catalogURL}/services')
-            except requests.exceptions.RequestException:
-                print("Failed request for services from catalog, retrying...")
-                time.sleep(5)
-                continue
-            if response.status_code != 200:
-                print(f"Failed to get services from catalog, status code {response.status_code}, retrying...")
-                time.sleep(5)
-                continue
-            services = response.json()['services']
-            # If serviceID is already assigned, check if it exists in the catalog
-            if self.serviceID != None:  
-                if not any(service['ID'] == self.serviceInfo['ID'] for service in services):
-                    return self.serviceID
-                else:
-                    print(f"Service ID {self.serviceID} already used, assigning a new one")
-                    # if the serviceID is already used, assign the next available service ID, or 1 if no services are present
-                    if services != []:
-                        return max(service['ID'] for service in services) + 1
-                    else:
-                        return 1
-            else:
-                # assign the next available service ID, or 1 if no services are present
-                if services != []:
-                    return max(service['ID'] for service in services) + 1
-                else:
-                    return 1   
-
 # assign a patient ID, when a new patient is created
     def assign_patientID(self):
         while True: # Loop until a valid patient ID is obtained
             try:
-                response = requests.get(f'{self.catalogURL}/patients')
+                response = self.catalog.get('/patients')
             except requests.exceptions.RequestException:
                 print("TELEGRAM BOT: failed request for patients from catalog, retrying...")
-                time.sleep(5)
+                self.catalog.backoff()
                 continue
             if response.status_code != 200:
                 print(f"TELEGRAM BOT: failed to get patients from catalog, status code {response.status_code}")
-                time.sleep(5)  # wait before retrying
+                self.catalog.backoff()  # wait before retrying
                 continue
             if 'patients' not in response.json():
                 print("TELEGRAM BOT: no field patients found in response")
-                time.sleep(5)  # wait before retrying
+                self.catalog.backoff()  # wait before retrying
                 continue
             patients = response.json()['patients']
             if patients != []:
@@ -232,10 +184,10 @@ class TelegramBot:
     def assign_medicationID(self):
         while True: # Loop until a valid medication ID is obtained
             try:
-                response = requests.get(f'{self.catalogURL}/medications')
+                response = self.catalog.get('/medications')
             except requests.exceptions.RequestException:
                 print("TELEGRAM BOT: failed request for medications from catalog, retrying...")
-                time.sleep(5)
+                self.catalog.backoff()
                 continue
             if response.status_code != 200:
                 print(f"TELEGRAM BOT: failed to get medications from catalog, status code {response.status_code}")
@@ -246,36 +198,15 @@ class TelegramBot:
             else:
                 return 1
 
-# function to register service to the catalog
-    def registerService(self):
-        print(f"Registering service {self.serviceInfo['ID']} in catalog")
-        registered = False
-        while not registered:
-            try:
-                request=requests.post(f'{self.catalogURL}/services',data=json.dumps(self.serviceInfo))
-            except requests.exceptions.RequestException:
-                print(f"Failed request for registering service {self.serviceID} in catalog, retrying...")
-                time.sleep(5)  # wait before retrying
-            if request.status_code != 200:
-                print(f"Failed to register service {self.serviceID} in catalog, retrying...")
-                registered = False
-                time.sleep(5) 
-                self.serviceID = self.assign_serviceID()  # try to assign new id if old one is already used
-                self.serviceInfo['ID'] = self.serviceID
-            else:
-                registered = True
-        print(f"Service {self.serviceID} registered in catalog")
-
-
 # Telegram bot is subscribed to topics where time shift and time control publish alarm messages
     def notify(self, topic, payload):
         if not payload:
-            print("TELEGRAM BOT: received empty payload, skipping notification")
+            log.warning("received empty payload, skipping notification")
             return
         message = json.loads(payload)
-        print(f"TELEGRAM BOT: received message on topic {topic}: {message}")
+        log.debug("received message on topic %s: %s", topic, message)
         if 'alarmType' not in message or message['alarmType'] not in ["time_shift", "time_control"]:
-            print("TELEGRAM BOT: alarm not recognized, skipping notification")
+            log.warning("alarm not recognized, skipping notification")
             return
         if message['alarmType'] == "time_shift":
             '''
@@ -287,14 +218,14 @@ class TelegramBot:
                         }
             '''
             if 'patientID' not in message or 'field' not in message or 'hour' not in message:
-                print("TELEGRAM BOT: missing fields in time_shift message, skipping notification")
+                log.warning("missing fields in time_shift message, skipping notification")
                 return
             chats = self.getchatIDs()
             for chatID in chats:
                 try: 
                     self.bot.sendMessage(chatID, text=f"Alarm for patient {message['patientID']}:\n{message['hour']}:00 is an anomaly time for field {message['field']}.")
                 except telepot.exception.TelegramError as e:
-                    print(f"TELEGRAM BOT: Error sending notification to chat ID {chatID}: {e}")
+                    log.error("Error sending notification to chat ID %s: %s", chatID, e)
                 
         if message['alarmType'] == "time_control":
             '''
@@ -312,7 +243,7 @@ class TelegramBot:
                     actual_time = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(message['timestamp']))
                     self.bot.sendMessage(chatID, text=f"Alarm for patient {message['patientID']}:\nSensor {message['sensorID']} for {message['field']} value {round(message['value'])} at {actual_time}")
                 except telepot.exception.TelegramError as e:
-                    print(f"TELEGRAM BOT: Error sending notification to chat ID {chatID}: {e}")
+                    log.error("Error sending notification to chat ID %s: %s", chatID, e)
     
     def check_integer(self, value):
         try:
@@ -342,7 +273,7 @@ class TelegramBot:
         # needed to save the ID to send messages, it is set when the bot is started (with /start)
         if message=='/start':  
             try:
-                response = requests.post(f'{self.catalogURL}/chats', data=json.dumps({"ID": chat_ID}))
+                response = self.catalog.post('/chats', {"ID": chat_ID})
             except requests.exceptions.RequestException as e:
                 print(f"TELEGRAM BOT: Error registering chat ID {chat_ID} in catalog: {e}")
                 self.bot.sendMessage(chat_ID, text="Error registering your chat ID, please try again later.")
@@ -364,9 +295,9 @@ class TelegramBot:
             return
         # when any other message is received, check if the chatID is present in catalog, and update if it is
         else:
-            URLToSend = f"{self.catalogURL}/chats/{chat_ID}"
+            URLToSend = f"/chats/{chat_ID}"
             try:
-                response = requests.get(URLToSend)
+                response = self.catalog.get(URLToSend)
             except requests.exceptions.RequestException as e:
                 print(f"TELEGRAM BOT: Error retrieving chat ID {chat_ID} from catalog: {e}")
             if response.status_code == 404:
@@ -378,9 +309,9 @@ class TelegramBot:
                 self.bot.sendMessage(chat_ID, text="Failed to retrieve your chat ID, please try again later.")
                 return
             else:
-                URLToSend = f"{self.catalogURL}/chats/{chat_ID}"
+                URLToSend = f"/chats/{chat_ID}"
                 try:
-                    response = requests.put(URLToSend, data=json.dumps({"ID": chat_ID}))
+                    response = self.catalog.put(URLToSend, {"ID": chat_ID})
                 except requests.exceptions.RequestException as e:
                     print(f"TELEGRAM BOT: Error updating chat ID {chat_ID} in catalog: {e}")
                 if response.status_code != 200:
@@ -388,9 +319,9 @@ class TelegramBot:
         # if /exit, /quit or /stop is sent, delete the chatID from the catalog
         if message=='/exit' or message=='/stop' or message=='/quit':
             self.bot.sendMessage(chat_ID,text="Exiting chat, thanks for using the Telegram Bot! You will not receive any more alarms.")
-            URLToSend = f"{self.catalogURL}/chats/{chat_ID}"
+            URLToSend = f"/chats/{chat_ID}"
             try:
-                response = requests.delete(URLToSend)
+                response = self.catalog.delete(URLToSend)
             except requests.exceptions.RequestException as e:
                 print(f"TELEGRAM BOT: Error removing chat ID {chat_ID} from catalog: {e}")
                 self.bot.sendMessage(chat_ID, text="Error removing your chat ID, please try again later.")
@@ -423,7 +354,7 @@ class TelegramBot:
                 self.bot.sendMessage(chat_ID, text="Invalid format. Use: `/create_patient <name> <surname> <age>`", reply_markup=keyboard_home)
                 return
             patientID = self.assign_patientID()
-            URLToSend = f"{self.catalogURL}/patients"
+            URLToSend = "/patients"
             patient_info = {
                     "name": name,
                     "surname": surname,
@@ -431,7 +362,7 @@ class TelegramBot:
                     "ID": patientID
             }
             try:
-                response = requests.post(URLToSend, data=json.dumps(patient_info))
+                response = self.catalog.post(URLToSend, patient_info)
             except requests.exceptions.RequestException as e:
                 self.bot.sendMessage(chat_ID, text=f"Error making request to create patient: {e}", reply_markup=keyboard_home)
                 return
@@ -449,9 +380,9 @@ class TelegramBot:
             except ValueError:
                 self.bot.sendMessage(chat_ID, text="Invalid format. Use: `/remove_patient <patient_id>`", reply_markup=keyboard_home)
                 return
-            URLToSend = f"{self.catalogURL}/patients/{patient_id}"
+            URLToSend = f"/patients/{patient_id}"
             try:
-                response = requests.delete(URLToSend)
+                response = self.catalog.delete(URLToSend)
             except requests.exceptions.RequestException as e:
                 self.bot.sendMessage(chat_ID, text=f"Error making request to remove patient: {e}", reply_markup=keyboard_home)
                 return
@@ -468,9 +399,9 @@ class TelegramBot:
                 self.bot.sendMessage(chat_ID, text="Invalid format. Use: `/view_patient <patient_id>`", reply_markup=keyboard_home)
                 return
             if patient_id_str.lower() == 'all':
-                URLToSend = f"{self.catalogURL}/patients"
+                URLToSend = "/patients"
                 try:
-                    response = requests.get(URLToSend)
+                    response = self.catalog.get(URLToSend)
                 except requests.exceptions.RequestException as e:
                     self.bot.sendMessage(chat_ID, text=f"Error making request to view all patients: {e}", reply_markup=keyboard_home)
                     return
@@ -485,9 +416,9 @@ class TelegramBot:
                     self.bot.sendMessage(chat_ID, text=f"Patients:\n{patient_list}", reply_markup=keyboard_home)
             else:
                 patient_id = int(patient_id_str)
-                URLToSend = f"{self.catalogURL}/patients/{patient_id}"
+                URLToSend = f"/patients/{patient_id}"
                 try:
-                    response = requests.get(URLToSend)
+                    response = self.catalog.get(URLToSend)
                 except requests.exceptions.RequestException as e:
                     self.bot.sendMessage(chat_ID, text=f"Error making request to view patient: {e}", reply_markup=keyboard_home)
                     return
@@ -530,9 +461,9 @@ class TelegramBot:
                 return
             
             # Check if patient exists
-            URLToSend = f"{self.catalogURL}/patients?patientID={patient_id}"
+            URLToSend = f"/patients?patientID={patient_id}"
             try:
-                response = requests.get(URLToSend)
+                response = self.catalog.get(URLToSend)
             except requests.exceptions.RequestException as e:
                 self.bot.sendMessage(chat_ID, text=f"Error making request to check patient: {e}", reply_markup=keyboard_home)
                 return
@@ -547,9 +478,9 @@ class TelegramBot:
                 "hour": hour,
                 "ID": ID
             }
-            URLToSend = f"{self.catalogURL}/medications"
+            URLToSend = "/medications"
             try:
-                response = requests.post(URLToSend, json=medication_info)
+                response = self.catalog.post(URLToSend, medication_info)
             except requests.exceptions.RequestException as e:
                 self.bot.sendMessage(chat_ID, text=f"Error making request to create medication: {e}", reply_markup=keyboard_home)
                 return
@@ -567,7 +498,7 @@ class TelegramBot:
                 self.bot.sendMessage(chat_ID, text="Invalid format. Use: `/remove_medication <medication_id>`. Medication_id must be a number.", reply_markup=keyboard_home)
                 return
             try:
-                response = requests.delete(f"{self.catalogURL}/medications/{medication_id}")
+                response = self.catalog.delete(f"/medications/{medication_id}")
             except requests.exceptions.RequestException as e:
                 self.bot.sendMessage(chat_ID, text=f"Error making request to remove medication: {e}", reply_markup=keyboard_home)
                 return
@@ -584,7 +515,7 @@ class TelegramBot:
                 self.bot.sendMessage(chat_ID, text="Invalid format. Use: `/view_medication <patient_id>`", reply_markup=keyboard_home)
                 return
             try:
-                response = requests.get(f"{self.catalogURL}/medications")
+                response = self.catalog.get("/medications")
             except requests.exceptions.RequestException as e:
                 self.bot.sendMessage(chat_ID, text=f"Error making request to view medications: {e}", reply_markup=keyboard_home)
                 return
@@ -615,9 +546,9 @@ class TelegramBot:
                 self.bot.sendMessage(chat_ID, text="Invalid format. Use: `/view_times <patient_id>`", reply_markup=keyboard_home)
                 return
             if patient_id.lower() == 'all':
-                URLToSend = f"{self.catalogURL}/patients"   
+                URLToSend = "/patients"   
                 try:
-                    response = requests.get(URLToSend)  
+                    response = self.catalog.get(URLToSend)
                 except requests.exceptions.RequestException as e:
                     self.bot.sendMessage(chat_ID, text=f"Error retrieving patients: {e}", reply_markup=keyboard_home)
                     return
@@ -675,18 +606,18 @@ class TelegramBot:
 # management of the pressed buttons
     def on_callback_query(self,msg):
         query_id, chat_ID, query_data = telepot.glance(msg, flavor='callback_query')
-        URLToSend = f"{self.catalogURL}/chats/{chat_ID}"
+        URLToSend = f"/chats/{chat_ID}"
         try:
-            response = requests.get(URLToSend)
+            response = self.catalog.get(URLToSend)
         except requests.exceptions.RequestException as e:
             print(f"TELEGRAM BOT: Error retrieving chat ID {chat_ID} from catalog: {e}")
         if response.status_code == 404:
             print(f"TELEGRAM BOT: Chat ID {chat_ID} not found in catalog.")
             self.bot.sendMessage(chat_ID, text="Chat ID not found in catalog. Please start the bot with /start to register your chat ID.")
             return
-        URLToSend = f"{self.catalogURL}/chats/{chat_ID}"
+        URLToSend = f"/chats/{chat_ID}"
         try:
-            response = requests.put(URLToSend, data=json.dumps({"ID": chat_ID}))
+            response = self.catalog.put(URLToSend, {"ID": chat_ID})
         except requests.exceptions.RequestException as e:
             print(f"TELEGRAM BOT: Error updating chat ID {chat_ID} in catalog: {e}")
         if response.status_code != 200:
@@ -706,9 +637,9 @@ class TelegramBot:
                 ])
         if query_data == 'exit':
             self.bot.sendMessage(chat_ID, text="Exiting chat, thanks for using the Telegram Bot! You will not receive any more alarms.")
-            URLToSend = f"{self.catalogURL}/chats/{chat_ID}"
+            URLToSend = f"/chats/{chat_ID}"
             try:
-                response = requests.delete(URLToSend)
+                response = self.catalog.delete(URLToSend)
             except requests.exceptions.RequestException as e:
                 print(f"TELEGRAM BOT: Error removing chat ID {chat_ID} from catalog: {e}")
                 self.bot.sendMessage(chat_ID, text="Error removing your chat ID, please try again later.")
@@ -767,6 +698,7 @@ if __name__=="__main__":
     if settings == {}:
         print("Settings file not found or empty, please fill the settings.json file with the required settings.")
         exit(1)
+    setupLogging(settings.get('logging', {}))
     bot = None
     try:
         bot = TelegramBot(settings)
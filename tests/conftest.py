@@ -0,0 +1,75 @@
+# the modules of common/, of the catalog and of the catalog manager are imported as in their containers,
+# where they are copied side by side
+import json
+import os
+import sys
+
+import cherrypy
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for directory in ("common", "catalog", "catalog_manager"):
+    sys.path.insert(0, os.path.join(ROOT, directory))
+
+
+class Response(object):
+    def __init__(self, status_code, text):
+        self.status_code = status_code
+        self.text = text
+
+    def json(self):
+        return json.loads(self.text)
+
+
+# CatalogClient served in process by a Catalog, for the tests of the services that call the catalog;
+# the requests sent are recorded as (method, path)
+class LocalCatalog(object):
+    def __init__(self, directory, entities):
+        from catalog import Catalog
+        path = os.path.join(str(directory), "catalog.json")
+        with open(path, "w") as f:
+            json.dump(entities, f)
+        self.catalog = Catalog({"CatalogFileName": path, "SnapshotFileName": os.path.join(str(directory), "catalog.snapshot"),
+                                "ThingspeakAdaptorURL": "http://thingspeak_adaptor", "apiPort": 8080,
+                                "snapshotInterval": 3600})
+        self.requests = []
+
+    def request(self, method, path, body=None, headers=None, params=None):
+        self.requests.append((method, path))
+        uri = tuple(part for part in path.split('/') if part)
+        params = params or {}
+        ifMatch = (headers or {}).get('If-Match')
+        # the catalog changes the bodies it stores, as the ones decoded from a request
+        body = json.loads(json.dumps(body))
+        try:
+            if method == 'GET':
+                output = self.catalog.GET(*uri, **params)
+            elif method == 'POST':
+                output = self.catalog.handlePOST(uri, params, body)
+            elif method == 'PUT':
+                output = self.catalog.handlePUT(uri, params, body, ifMatch)
+            elif method == 'PATCH':
+                output = self.catalog.handlePATCH(uri, params, body, ifMatch)
+            else:
+                with self.catalog.lock:
+                    output = self.catalog.removeEntity(uri, params)
+        except cherrypy.HTTPError as e:
+            return Response(e.status, e._message)
+        return Response(200, output)
+
+    def get(self, path, params=None, ttl=None):
+        return self.request('GET', path, params=params)
+
+    def post(self, path, body=None, headers=None):
+        return self.request('POST', path, body, headers)
+
+    def put(self, path, body=None, headers=None):
+        return self.request('PUT', path, body, headers)
+
+    def patch(self, path, body=None, headers=None):
+        return self.request('PATCH', path, body, headers)
+
+    def delete(self, path, headers=None, params=None):
+        return self.request('DELETE', path, headers=headers, params=params)
+
+    def backoff(self):
+        pass
@@ -0,0 +1,125 @@
+import json
+import os
+import socket
+import threading
+import time
+
+import cherrypy
+import pytest
+import requests
+
+from admission import AdmissionController, Rejected, priority, spareLimit
+from conftest import ROOT
+
+
+def freePort():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+class Slow(object):
+    exposed = True
+
+    def GET(self, *uri):
+        time.sleep(1)
+        return "ok"
+
+
+def test_shipped_settings_limit_is_below_the_thread_pool():
+    with open(os.path.join(ROOT, "catalog", "settings.json")) as f:
+        settings = json.load(f)
+    admission = AdmissionController(settings["admission"], settings["threadPool"])
+    assert admission.max_inflight < settings["threadPool"]
+    assert admission.max_inflight_heartbeats <= admission.max_inflight
+
+
+def test_limit_above_the_thread_pool_is_clamped():
+    assert AdmissionController({"maxInFlight": 64}, 30).max_inflight == spareLimit(30) == 27
+    assert AdmissionController({"maxInFlight": 64}).max_inflight == 64
+
+
+@pytest.fixture
+def server():
+    import catalog
+    threads = 5
+    port = freePort()
+    admission = AdmissionController({"maxInFlight": 64, "userRate": 1000, "userBurst": 1000}, threads)
+    config = catalog.serverConfig(port, {"threadPool": threads})
+    config['server.socket_host'] = '127.0.0.1'
+    config['log.screen'] = False
+    cherrypy.config.update(config)
+    cherrypy.tree.mount(Slow(), '/', {'/': {'request.dispatch': cherrypy.dispatch.MethodDispatcher(),
+                                            'tools.admission.on': True,
+                                            'tools.admission.controller': admission}})
+    cherrypy.engine.start()
+    cherrypy.engine.wait(cherrypy.engine.states.STARTED)
+    yield port, admission
+    cherrypy.engine.exit()
+    cherrypy.tree.apps.clear()
+
+
+# the misconfigured limit (64 with 5 threads) is clamped, so the spare thread answers 503 while the others are busy
+def test_global_limit_rejects_in_cherrypy_mode(server):
+    port, admission = server
+    statuses = []
+    lock = threading.Lock()
+
+    def call():
+        response = requests.get(f'http://127.0.0.1:{port}/patients', timeout=10)
+        with lock:
+            statuses.append((response.status_code, response.headers.get('Retry-After')))
+
+    callers = [threading.Thread(target=call) for _ in range(12)]
+    for caller in callers:
+        caller.start()
+    for caller in callers:
+        caller.join()
+    assert sum(1 for status, _ in statuses if status == 200) >= admission.max_inflight
+    rejected = [retry_after for status, retry_after in statuses if status == 503]
+    assert rejected and all(retry_after is not None for retry_after in rejected)
+    assert admission.rejected[503] == len(rejected)
+
+
+@pytest.mark.parametrize("method, uri, kind", [
+    ("POST", ("devices",), 'heartbeat'),
+    ("PUT", ("services",), 'heartbeat'),
+    ("PUT", ("leases",), 'heartbeat'),
+    ("GET", ("devices", "12"), 'heartbeat'),
+    ("GET", ("devices", "12", "channel"), 'user'),
+    ("GET", ("devices",), 'user'),
+    ("GET", ("services",), 'user'),
+    ("DELETE", ("devices", "12"), 'user'),
+    ("GET", ("patients", "3"), 'user'),
+    ("POST", ("patients",), 'user'),
+])
+def test_only_registrations_and_heartbeats_are_shed_first(method, uri, kind):
+    assert priority(method, uri) == kind
+
+
+# the shard sees only the router, the clients behind it have their own buckets
+def test_clients_behind_one_router_have_their_own_buckets():
+    admission = AdmissionController({"heartbeatRate": 0.001, "heartbeatBurst": 3, "routers": ["127.0.0.1"]})
+
+    def register(peer, forwarded):
+        kind = admission.admit(admission.clientOf(peer, forwarded), 'PUT', ('devices',))
+        admission.release(kind)
+
+    for _ in range(3):
+        register('127.0.0.1', '10.0.0.1')
+    with pytest.raises(Rejected) as rejected:
+        register('127.0.0.1', '10.0.0.1')
+    assert rejected.value.code == 429
+    for _ in range(3):
+        register('127.0.0.1', '10.0.0.2')
+    # a client that is not a router cannot choose its bucket
+    for _ in range(3):
+        register('10.0.0.3', '10.0.0.4')
+    with pytest.raises(Rejected):
+        register('10.0.0.3', '10.0.0.5')
+
+
+def test_forwarded_header_is_ignored_without_routers():
+    admission = AdmissionController({})
+    assert admission.clientOf('10.0.0.3', '10.0.0.4') == '10.0.0.3'
+    assert AdmissionController({"routers": ["127.0.0.1"]}).clientOf('127.0.0.1', '1.2.3.4, 10.0.0.1') == '10.0.0.1'
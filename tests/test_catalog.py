@@ -0,0 +1,111 @@
+import json
+
+import cherrypy
+import pytest
+
+from catalog import Catalog
+
+CATALOG = {
+    "devices": [{"ID": 1, "patientID": 1, "deviceType": "heart_rate_sensor", "version": 1},
+                {"ID": 2, "patientID": 1, "deviceType": "thermometer_sensor", "version": 1}],
+    "services": [{"ID": 1, "serviceName": "TimeControl", "version": 1}],
+    "patients": [{"ID": 1, "name": "Rossi", "thingspeak_info": {"channel": 10},
+                  "devices": [{"deviceID": 1}, {"deviceID": 2}], "medications": [{"medicationID": 1}], "version": 1}],
+    "medications": [{"ID": 1, "patientID": 1, "name": "aspirin", "version": 1}],
+    "chats": [],
+    "leases": [],
+}
+
+
+@pytest.fixture
+def catalog(tmp_path):
+    path = tmp_path / "catalog.json"
+    path.write_text(json.dumps(CATALOG))
+    return Catalog({"CatalogFileName": str(path), "SnapshotFileName": str(tmp_path / "catalog.snapshot"),
+                    "ThingspeakAdaptorURL": "http://thingspeak_adaptor", "apiPort": 8080, "snapshotInterval": 3600})
+
+
+def entity(catalog, collection, entityID):
+    return json.loads(catalog.getEntity((collection, str(entityID)), {}))[collection[:-1]]
+
+
+# an update with the version read is applied, a second one with the same version has lost the race
+def test_update_with_a_stale_version_is_rejected(catalog):
+    service = {"ID": 1, "serviceName": "TimeControl", "host": "a"}
+    catalog.handlePUT(("services",), {}, dict(service), ifMatch='"1"')
+    with pytest.raises(cherrypy.HTTPError) as e:
+        catalog.handlePUT(("services",), {}, dict(service, host="b"), ifMatch='"1"')
+    assert e.value.status == 412
+    assert entity(catalog, "services", 1)["host"] == "a" and entity(catalog, "services", 1)["version"] == 2
+
+
+@pytest.mark.parametrize("ifMatch", [None, "*", '"1"', 'W/"1"'])
+def test_update_without_a_stale_version_is_applied(catalog, ifMatch):
+    catalog.handlePUT(("services",), {}, {"ID": 1, "serviceName": "TimeControl", "host": "a"}, ifMatch=ifMatch)
+    assert entity(catalog, "services", 1)["host"] == "a"
+
+
+# PATCH changes only the fields of the body, and neither the ID nor the version
+def test_patch_keeps_the_other_fields(catalog):
+    catalog.handlePATCH(("patients", "1"), {}, {"name": "Verdi", "ID": 5, "version": 9})
+    patient = entity(catalog, "patients", 1)
+    assert patient["name"] == "Verdi" and patient["thingspeak_info"] == {"channel": 10}
+    assert patient["devices"] == [{"deviceID": 1}, {"deviceID": 2}] and patient["version"] == 2
+    catalog.handlePATCH(("patients",), {}, {"ID": 1, "name": "Neri"}, ifMatch='"2"')
+    assert entity(catalog, "patients", 1)["name"] == "Neri"
+
+
+@pytest.mark.parametrize("uri, body, ifMatch, status", [
+    (("patients", "1"), {"name": "Verdi"}, '"3"', 412),
+    (("patients", "7"), {"name": "Verdi"}, None, 404),
+    (("devices", "1"), {"patientID": 2}, None, 400),
+    (("leases", "1"), {"owner": "a"}, None, 400),
+    (("patients",), {"name": "Verdi"}, None, 400),
+])
+def test_patch_rejected(catalog, uri, body, ifMatch, status):
+    with pytest.raises(cherrypy.HTTPError) as e:
+        catalog.handlePATCH(uri, {}, body, ifMatch)
+    assert e.value.status == status
+    assert entity(catalog, "patients", 1)["name"] == "Rossi"
+
+
+# the devices removed in bulk are removed from the list of their patient, the IDs not found are reported
+def test_bulk_delete_removes_the_back_references(catalog):
+    output = json.loads(catalog.removeEntity(("devices",), {"ids": "2, 9,1"}))
+    assert sorted(output["removed"]) == [1, 2] and output["missing"] == [9]
+    patient = entity(catalog, "patients", 1)
+    assert patient["devices"] == [] and patient["medications"] == [{"medicationID": 1}] and patient["version"] == 2
+    assert json.loads(catalog.getEntity(("devices",), {"ids": "1,2"})) == {"devices": [], "missing": [1, 2]}
+    assert "devices" in catalog.changed and "patients" in catalog.changed
+
+
+def test_bulk_get_in_the_order_of_the_ids(catalog):
+    output = json.loads(catalog.getEntity(("devices",), {"ids": "2,7,1"}))
+    assert [device["ID"] for device in output["devices"]] == [2, 1] and output["missing"] == [7]
+
+
+@pytest.mark.parametrize("collection, ids", [("patients", "1"), ("devices", "1,x")])
+def test_bulk_delete_rejected(catalog, collection, ids):
+    with pytest.raises(cherrypy.HTTPError) as e:
+        catalog.removeEntity((collection,), {"ids": ids})
+    assert e.value.status == 400
+    assert entity(catalog, "devices", 1)["ID"] == 1
+
+
+def channel(catalog, deviceID):
+    return json.loads(catalog.getEntity(("devices", str(deviceID), "channel"), {}))
+
+
+# the resolution of a device is kept until the device or its patient change
+def test_resolution_follows_the_patient_and_the_device(catalog):
+    assert channel(catalog, 1) == {"device": entity(catalog, "devices", 1), "patientID": 1,
+                                   "thingspeak_info": {"channel": 10}}
+    catalog.handlePATCH(("patients", "1"), {}, {"thingspeak_info": {"channel": 11}})
+    assert channel(catalog, 1)["thingspeak_info"] == {"channel": 11}
+    assert channel(catalog, 2)["thingspeak_info"] == {"channel": 11}
+    catalog.handlePATCH(("devices", "1"), {}, {"location": "room 3"})
+    assert channel(catalog, 1)["device"]["location"] == "room 3"
+    catalog.removeEntity(("patients", "1"), {})
+    with pytest.raises(cherrypy.HTTPError) as e:
+        channel(catalog, 1)
+    assert e.value.status == 404
@@ -0,0 +1,72 @@
+import socket
+import threading
+
+import pytest
+import requests
+
+import catalog_client
+from catalog_client import CatalogClient
+
+
+# server that accepts the connections and never answers, every request ends with a read timeout
+@pytest.fixture
+def silent_server():
+    listener = socket.socket()
+    listener.bind(('127.0.0.1', 0))
+    listener.listen(16)
+    connections = []
+
+    def accept():
+        while True:
+            try:
+                connection, _ = listener.accept()
+            except OSError:
+                return
+            connections.append(connection)
+
+    threading.Thread(target=accept, daemon=True).start()
+    yield f'http://127.0.0.1:{listener.getsockname()[1]}', connections
+    listener.close()
+    for connection in connections:
+        connection.close()
+
+
+def client(url):
+    return CatalogClient(url, {"timeout": 0.2, "retries": 2, "backoffBase": 0.01})
+
+
+def test_backoff_does_not_overflow_after_a_long_outage(monkeypatch):
+    catalog = CatalogClient('http://catalog', {"backoffMax": 30})
+    assert catalog.delay(5000) <= 30
+    waits = []
+    monkeypatch.setattr(catalog_client.time, 'sleep', waits.append)
+    for _ in range(2000):
+        catalog.backoff()
+    assert max(waits) <= 30
+
+
+def test_post_is_not_sent_again_after_a_read_timeout(silent_server):
+    url, connections = silent_server
+    with pytest.raises(requests.exceptions.ReadTimeout):
+        client(url).post('/devices', {"ID": 1})
+    assert len(connections) == 1
+
+
+def test_put_is_retried_after_a_read_timeout(silent_server):
+    url, connections = silent_server
+    with pytest.raises(requests.exceptions.ReadTimeout):
+        client(url).put('/devices', {"ID": 1})
+    assert len(connections) == 3
+
+
+def test_post_is_retried_when_the_connection_fails():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        url = f'http://127.0.0.1:{s.getsockname()[1]}'
+    catalog = client(url)
+    attempts = []
+    request = catalog.session.request
+    catalog.session.request = lambda *args, **kwargs: attempts.append(1) or request(*args, **kwargs)
+    with pytest.raises(requests.exceptions.ConnectionError):
+        catalog.post('/devices', {"ID": 1})
+    assert len(attempts) == 3
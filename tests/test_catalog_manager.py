@@ -0,0 +1,101 @@
+import json
+import signal
+import time
+
+import pytest
+
+from conftest import LocalCatalog, Response
+
+# the catalog manager sets its handlers of SIGINT and SIGTERM when it is imported, the ones of pytest are kept
+handlers = {signum: signal.getsignal(signum) for signum in (signal.SIGINT, signal.SIGTERM)}
+from catalog_manager import CatalogManager
+for signum, handler in handlers.items():
+    signal.signal(signum, handler)
+
+
+def catalogEntities(now):
+    return {
+        "devices": [{"ID": 1, "patientID": 1, "deviceType": "heart_rate_sensor", "last_update": now, "version": 1},
+                    {"ID": 2, "patientID": 1, "deviceType": "thermometer_sensor", "last_update": now - 600, "version": 1},
+                    {"ID": 3, "patientID": 9, "deviceType": "oximeter_sensor", "last_update": now, "version": 1}],
+        "services": [{"ID": 1, "serviceName": "TimeControl", "last_update": now - 600, "version": 1}],
+        "patients": [{"ID": 1, "name": "Rossi", "devices": [{"deviceID": 1}, {"deviceID": 2}, {"deviceID": 4}],
+                      "medications": [], "version": 1},
+                     {"ID": 2, "name": "Bianchi", "devices": [{"deviceID": 5}], "medications": [], "version": 1}],
+        "medications": [{"ID": 1, "patientID": 9, "name": "aspirin", "version": 1}],
+        "chats": [],
+        "leases": [],
+    }
+
+
+@pytest.fixture
+def manager(tmp_path, monkeypatch):
+    monkeypatch.setattr(CatalogManager, "start", lambda self: None)
+    manager = CatalogManager({"catalogURL": "http://catalog", "threshold": 300, "controlInterval": 300,
+                              "serviceInfo": {"ID": 2, "serviceName": "CatalogManager"}, "apiPort": 8080})
+    manager.catalog = LocalCatalog(tmp_path, catalogEntities(time.time()))
+    return manager
+
+
+def collection(manager, name):
+    return manager.catalog.get(f'/{name}').json()[name]
+
+
+# the checks of a sweep are done on one snapshot, and a patient changed after it is not overwritten
+def test_sweep_on_one_snapshot(manager):
+    getSnapshot = manager.getSnapshot
+
+    def changedAfterTheSnapshot():
+        snapshot = getSnapshot()
+        manager.catalog.patch('/patients/2', {"devices": []})
+        return snapshot
+
+    manager.getSnapshot = changedAfterTheSnapshot
+    manager.removeInactive()
+    assert [request for request in manager.catalog.requests if request[0] == 'GET'] == [('GET', '/all')]
+    assert [device['ID'] for device in collection(manager, 'devices')] == [1]
+    assert collection(manager, 'services') == [] and collection(manager, 'medications') == []
+    patients = collection(manager, 'patients')
+    # the references to the devices removed by the sweep are removed by the catalog
+    assert patients[0]['devices'] == [{"deviceID": 1}]
+    assert patients[1]['devices'] == [] and patients[1]['version'] == 2
+    sweep = manager.metrics["last_sweep"]
+    assert sweep["stale"]["devices"] == 1 and sweep["orphans"]["devices"] == 1 and sweep["failures"]["patients"] == 1
+
+
+# the entities are removed in batches of deleteBatchSize IDs, or one by one by a catalog without bulk removal
+@pytest.mark.parametrize("bulk", [True, False])
+def test_removal_in_batches(manager, bulk):
+    request = manager.catalog.request
+
+    def catalogRequest(method, path, body=None, headers=None, params=None):
+        if method == 'DELETE' and params and not bulk:
+            manager.catalog.requests.append((method, path))
+            return Response(400, "Catalog: DELETE URI not managed")
+        return request(method, path, body, headers, params)
+
+    manager.catalog.request = catalogRequest
+    manager.deleteBatchSize = 2
+    latency = {"requests": 0, "total": 0.0, "max": 0.0}
+    assert manager.removeEntities('devices', [1, 2, 3], latency) == 3
+    assert collection(manager, 'devices') == [] and collection(manager, 'patients')[0]['devices'] == [{"deviceID": 4}]
+    deletes = sorted(path for method, path in manager.catalog.requests if method == 'DELETE')
+    assert deletes == (['/devices', '/devices'] if bulk else ['/devices', '/devices', '/devices/1', '/devices/2', '/devices/3'])
+    assert latency["requests"] == len(deletes)
+
+
+# a dry run reports what would be removed without changing the catalog, the metrics are served on GET /metrics
+def test_dry_run_and_metrics(manager):
+    manager.dryRun = True
+    manager.removeInactive()
+    assert [method for method, _ in manager.catalog.requests] == ['GET']
+    assert len(collection(manager, 'devices')) == 3
+    metrics = json.loads(manager.GET('metrics'))
+    assert metrics["sweeps"] == 1 and metrics["totals"] == {"removed": 0, "failures": 0, "repairs": 0, "expired": 0}
+    sweep = metrics["last_sweep"]
+    assert sweep["dry_run"] and sweep["removed"] == {} and sweep["repairs"] == 2
+    assert sweep["scanned"] == {"devices": 3, "services": 1, "medications": 1, "leases": 0, "patients": 2}
+    manager.dryRun = False
+    manager.removeInactive()
+    metrics = json.loads(manager.GET('metrics'))
+    assert metrics["sweeps"] == 2 and metrics["totals"]["removed"] == 4 and metrics["totals"]["repairs"] == 2
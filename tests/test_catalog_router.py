@@ -0,0 +1,93 @@
+import json
+
+import cherrypy
+import pytest
+from cherrypy.lib.httputil import Host
+
+from catalog_router import CatalogRouter, shardIndex
+
+
+class Response(object):
+    def __init__(self, status_code, body):
+        self.status_code = status_code
+        self.text = json.dumps(body)
+        self.body = body
+
+    def json(self):
+        return self.body
+
+
+# session of a shard holding some devices, records the requests it receives
+class FakeShard(object):
+    def __init__(self, devices):
+        self.devices = {str(device['ID']): device for device in devices}
+        self.requests = []
+        self.headers = []
+
+    def request(self, method, url, params=None, headers=None, data=None, timeout=None):
+        uri = url.split('/')[3:]
+        self.requests.append((method, '/'.join(uri)))
+        self.headers.append(headers)
+        device = self.devices.get(uri[1]) if len(uri) > 1 else None
+        if device is None and method != 'PUT':
+            return Response(404, "Catalog: Device not found")
+        if method == 'GET':
+            return Response(200, {"device": device})
+        if method == 'DELETE':
+            del self.devices[uri[1]]
+        return Response(200, "ok")
+
+
+def router(shards_number=3, **settings):
+    router = CatalogRouter(dict({"shards": [f"http://shard{i}" for i in range(shards_number)]}, **settings))
+    # device i belongs to patient i, and is stored on the shard of its patient
+    shards = [FakeShard([]) for _ in range(shards_number)]
+    for i in range(1, 20):
+        shards[shardIndex(i, shards_number)].devices[str(i)] = {"ID": i, "patientID": i}
+    router.sessions = shards
+    return router, shards
+
+
+def writes(shards):
+    return [[request for request in shard.requests if request[0] != 'GET'] for shard in shards]
+
+
+@pytest.mark.parametrize("method", ["DELETE", "PATCH"])
+def test_writes_go_only_to_the_shard_of_the_patient(method):
+    catalog_router, shards = router()
+    for deviceID in range(1, 20):
+        if method == "DELETE":
+            catalog_router.DELETE("devices", str(deviceID))
+        else:
+            catalog_router.handlePATCH(("devices", str(deviceID)), {}, {"status": "ok"})
+        owner = shardIndex(deviceID, len(shards))
+        for shard, requests in enumerate(writes(shards)):
+            expected = [(method, f"devices/{deviceID}")] if shard == owner else []
+            assert [request for request in requests if request[1] == f"devices/{deviceID}"] == expected
+
+
+def test_put_with_patientID_is_not_scattered():
+    catalog_router, shards = router()
+    catalog_router.handlePUT(("devices",), {}, {"ID": 4, "patientID": 4})
+    owner = shardIndex(4, len(shards))
+    assert [len(shard.requests) for shard in shards] == [1 if i == owner else 0 for i in range(len(shards))]
+
+
+def test_locations_are_bounded():
+    catalog_router, shards = router(locationCacheSize=5)
+    for deviceID in range(1, 20):
+        catalog_router.GET("devices", str(deviceID))
+    assert len(catalog_router.locations) == 5
+    assert list(catalog_router.locations) == [("devices", str(deviceID)) for deviceID in range(15, 20)]
+
+
+# the shards rate limit the clients of the router, they receive the address of the client also on scattered reads
+def test_requests_carry_the_client_address(monkeypatch):
+    catalog_router, shards = router()
+    monkeypatch.setattr(cherrypy.serving.request, 'remote', Host('10.0.0.7', 50000))
+    catalog_router.GET("devices", "5")
+    catalog_router.handlePATCH(("devices", "5"), {}, {"status": "ok"}, ifMatch="2")
+    headers = [header for shard in shards for header in shard.headers]
+    assert len(headers) == len(shards) + 1
+    assert all(header['X-Forwarded-For'] == '10.0.0.7' for header in headers)
+    assert {'X-Forwarded-For': '10.0.0.7', 'If-Match': '2'} in headers
@@ -0,0 +1,69 @@
+import threading
+import time
+import uuid
+
+import pytest
+
+from codec import detect, decode, getCodec
+from MQTT_base import MQTT_base
+
+
+@pytest.mark.parametrize("payload, expected", [
+    (b' \n\t{"bn": "7", "e": []}', {"bn": "7", "e": []}),
+    (b'  [1, 2]', [1, 2]),
+    (b'42', 42),
+    (b'-1.5', -1.5),
+    (b'"text"', "text"),
+    (b'true', True),
+    (b'null', None),
+    (' {"a": 1}', {"a": 1}),
+])
+def test_json_with_whitespace_and_scalars_is_detected(payload, expected):
+    assert detect(payload) == "json"
+    assert decode(payload) == expected
+
+
+# a byte order mark is taken for MessagePack, which fails: the payload is decoded as JSON
+def test_json_that_is_not_valid_msgpack_falls_back_to_json():
+    payload = '﻿{"a": 1}'.encode('utf-8')
+    assert detect(payload) == "msgpack"
+    assert decode(payload) == {"a": 1}
+
+
+def test_msgpack_and_cbor_are_detected():
+    message = {'bn': '7', 'e': [{'n': 'heart_rate', 'v': 72, 't': 1.0, 'u': 'bpm'}]}
+    assert detect(getCodec("msgpack").encode(message)) == "msgpack"
+    assert decode(getCodec("msgpack").encode(message)) == message
+    assert detect(getCodec("cbor").encode(message)) == "cbor"
+
+
+def test_invalid_payload_raises_value_error():
+    with pytest.raises(ValueError):
+        decode(b'\xc1garbage')
+
+
+# raw payloads published by another client reach the handlers decoded
+def test_dispatch_decodes_json_with_whitespace_and_scalars():
+    broker = uuid.uuid4().hex
+    received = []
+    done = threading.Event()
+
+    def onMessage(message):
+        received.append(message.message)
+        if len(received) == 4:
+            done.set()
+
+    consumer = MQTT_base("consumer", broker, 1883, settings={"transport": "loopback", "workers": 0})
+    consumer.route('project/test/#', onMessage)
+    publisher = MQTT_base("publisher", broker, 1883, settings={"transport": "loopback"})
+    deadline = time.time() + 5
+    while not (consumer.mqttClient.is_connected() and publisher.mqttClient.is_connected()):
+        assert time.time() < deadline
+        time.sleep(0.01)
+    for payload in (b'  {"a": 1}', b'\n[{"bn": "7", "n": "x", "v": 1}]', b'42', '﻿{"b": 2}'.encode('utf-8')):
+        publisher.mqttClient.publish('project/test/raw', payload, 1)
+    assert done.wait(5)
+    assert received == [{"a": 1}, {"bn": "7", "e": [{"n": "x", "v": 1}]}, 42, {"b": 2}]
+    assert consumer.metrics()["errors"] == 0
+    publisher.stop()
+    consumer.stop()
@@ -0,0 +1,61 @@
+import logging
+
+import pytest
+
+import log
+
+
+class Records(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+@pytest.fixture
+def records(monkeypatch):
+    monkeypatch.setattr(log, 'limit', log.RateLimit(rate=0.001, burst=2))
+    handler = Records()
+    root = logging.getLogger()
+    root.addHandler(handler)
+    level = root.level
+    root.setLevel(logging.DEBUG)
+    yield handler.records
+    root.setLevel(level)
+    root.removeHandler(handler)
+
+
+def warn(logger, i):
+    logger.warning("line %d", i, stacklevel=2)
+
+
+def test_the_logger_class_of_the_libraries_is_not_changed(records):
+    log.getLogger("SERVICE")
+    assert logging.getLoggerClass() is logging.Logger
+    library = logging.getLogger("cherrypy.test")
+    for i in range(10):
+        library.debug("line %d", i)
+    assert len(records) == 10
+
+
+def test_lines_are_limited_per_call_site(records):
+    logger = log.getLogger("SERVICE")
+    for i in range(10):
+        logger.debug("first %d", i)
+        logger.log(logging.INFO, "second %d", i)
+    assert [record.getMessage() for record in records] == ["first 0", "second 0", "first 1", "second 1"]
+    assert {record.lineno for record in records} == {record.lineno for record in records[:2]}
+    assert all(record.pathname == __file__ for record in records)
+
+
+# a wrapper passing stacklevel is limited at the line that calls it, each caller has its own limit
+def test_call_site_of_a_wrapper_is_its_caller(records):
+    logger = log.getLogger("SERVICE")
+    for i in range(5):
+        warn(logger, i)
+    for i in range(5):
+        warn(logger, i)
+    assert [record.getMessage() for record in records] == ["line 0", "line 1", "line 0", "line 1"]
+    assert len({record.lineno for record in records}) == 2
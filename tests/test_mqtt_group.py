@@ -0,0 +1,46 @@
+import uuid
+
+import pytest
+
+from MQTT_base import MQTT_base, clientIdentifier
+
+GROUP = {"name": "time_control", "members": 1, "member": 0, "affinity": True}
+
+
+def member(broker, clientID, received):
+    client = MQTT_base(clientID, broker, 1883,
+                       settings={"transport": "loopback", "workers": 0, "cleanSession": True, "group": GROUP})
+    client.route('project/sensors/{patientID}/{deviceID}/{field}',
+                  lambda message: received.append(message.params["deviceID"]))
+    return client
+
+
+# the replicas share the settings file, their place in the group comes from the environment
+def test_members_from_the_environment_split_the_devices(monkeypatch):
+    broker = uuid.uuid4().hex
+    received = [[], []]
+    members = []
+    monkeypatch.setenv("GROUP_MEMBERS", "2")
+    for i in range(2):
+        monkeypatch.setenv("GROUP_MEMBER", str(i))
+        members.append(member(broker, f"time_control-{i}", received[i]))
+    assert [(client.group_members, client.group_member) for client in members] == [(2, 0), (2, 1)]
+    sensor = MQTT_base("sensor", broker, 1883, settings={"transport": "loopback"})
+    for device in range(20):
+        sensor.publish(f'project/sensors/1/{device}/heart_rate', {'v': device})
+    assert sorted(received[0] + received[1], key=int) == [str(device) for device in range(20)]
+    assert received[0] and received[1] and not set(received[0]) & set(received[1])
+    for client in members + [sensor]:
+        client.stop()
+
+
+def test_member_out_of_the_group_is_rejected(monkeypatch):
+    monkeypatch.setenv("GROUP_MEMBERS", "2")
+    monkeypatch.setenv("GROUP_MEMBER", "2")
+    with pytest.raises(ValueError):
+        member(uuid.uuid4().hex, "time_control-2", [])
+
+
+def test_client_id_of_each_host(monkeypatch):
+    monkeypatch.setattr("socket.gethostname", lambda: "replica-2")
+    assert clientIdentifier({"clientID": "time_control-{hostname}"}) == "time_control-replica-2"
@@ -0,0 +1,97 @@
+import threading
+import time
+import uuid
+
+from loopback import getBroker
+from MQTT_base import MQTT_base
+
+
+def connected(client, timeout=5):
+    deadline = time.time() + timeout
+    while not client.mqttClient.is_connected():
+        assert time.time() < deadline, "client not connected"
+        time.sleep(0.01)
+
+
+def consumer(broker, handler, **settings):
+    settings = dict({"transport": "loopback", "clientID": "consumer", "workers": 1, "queueSize": 2,
+                     "putTimeout": 0.02, "reconnectDelay": {"min": 0.01, "max": 0.05}}, **settings)
+    client = MQTT_base("consumer", broker, 1883, settings=settings)
+    connected(client)
+    client.route('project/sensors/{patientID}/{deviceID}/{field}', handler)
+    return client
+
+
+def sensor(broker):
+    client = MQTT_base("sensor", broker, 1883, settings={"transport": "loopback", "qos": {"project/sensors/#": 1}})
+    connected(client)
+    return client
+
+
+# with full queues the QoS 1 messages wait without blocking the network thread (which answers the keepalives),
+# are not dropped and are handled in order; the broker stops at its in-flight window, the client stays connected
+def test_full_queue_holds_the_messages_without_losing_them():
+    broker = uuid.uuid4().hex
+    received = []
+    done = threading.Event()
+
+    def onMeasurement(message):
+        time.sleep(0.02)
+        received.append(message.message['i'])
+        if len(received) == 60:
+            done.set()
+
+    client = consumer(broker, onMeasurement)
+    publisher = sensor(broker)
+    session = getBroker(broker, 1883).sessions["consumer"]
+    slowest = 0
+    inflight = 0
+    for i in range(60):
+        t0 = time.perf_counter()
+        publisher.publish('project/sensors/1/2/heart_rate', {'i': i})
+        slowest = max(slowest, time.perf_counter() - t0)
+        inflight = max(inflight, len(session.inflight))
+    assert done.wait(10)
+    assert received == list(range(60))
+    metrics = client.metrics()
+    assert metrics["held"] > 0 and metrics["dropped"] == 0
+    assert inflight <= getBroker(broker, 1883).max_inflight
+    assert slowest < 0.5
+    assert client.mqttClient.is_connected()
+    publisher.stop()
+    client.stop()
+
+
+# a message is acknowledged when a worker takes it: the ones still waiting at a disconnection are sent again
+def test_messages_not_taken_are_sent_again_after_a_reconnection():
+    broker = uuid.uuid4().hex
+    received = []
+    release = threading.Event()
+
+    def onMeasurement(message):
+        release.wait(5)
+        received.append(message.message['i'])
+
+    client = consumer(broker, onMeasurement)
+    publisher = sensor(broker)
+    for i in range(10):
+        publisher.publish('project/sensors/1/2/heart_rate', {'i': i})
+    session = getBroker(broker, 1883).sessions["consumer"]
+    # one message taken by the worker, the others in its queue or waiting
+    deadline = time.time() + 5
+    while len(session.inflight) > 9 and time.time() < deadline:
+        time.sleep(0.01)
+    assert len(session.inflight) == 9
+    client.mqttClient.disconnect()
+    assert list(session.pending) and not session.inflight
+    release.set()
+    deadline = time.time() + 5
+    while set(received) != set(range(10)) and time.time() < deadline:
+        time.sleep(0.01)
+    assert set(received) == set(range(10))
+    deadline = time.time() + 5
+    while (session.inflight or session.pending) and time.time() < deadline:
+        time.sleep(0.01)
+    assert not session.inflight and not session.pending
+    publisher.stop()
+    client.stop()
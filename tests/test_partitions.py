@@ -0,0 +1,68 @@
+import time
+
+import requests
+
+from conftest import LocalCatalog
+from partitions import PartitionLeases, partitionOf
+
+DURATION = 0.5
+
+
+def instance(catalog, owner):
+    catalog.post('/services', {"ID": len(catalog.get('/services').json()['services']) + 1, "serviceName": "CatalogManager"})
+    return PartitionLeases(catalog, owner, "CatalogManager", partitions=8, duration=DURATION)
+
+
+# a new instance is counted from its registration: the first one releases the partitions over its share,
+# the new one takes them; the partitions of an instance that stops are taken over when its leases expire
+def test_fair_share_and_takeover(tmp_path):
+    catalog = LocalCatalog(tmp_path, {})
+    a = instance(catalog, "a")
+    a.update()
+    assert a.owned == set(range(8))
+    b = instance(catalog, "b")
+    b.update()
+    assert b.owned == set()
+    a.update()
+    b.update()
+    assert a.owned == {0, 1, 2, 3} and b.owned == {4, 5, 6, 7}
+    assert all(a.owns(entityID) != b.owns(entityID) for entityID in range(100))
+    assert {lease['ID']: lease['owner'] for lease in catalog.get('/leases').json()['leases']} == \
+        {partition: "a" if partition < 4 else "b" for partition in range(8)}
+    # b stops
+    time.sleep(DURATION * 1.2)
+    a.update()
+    assert a.owned == set(range(8))
+
+
+# a lease held by another owner is not taken before it expires, even when renewed with its version
+def test_lease_of_another_owner_is_not_taken(tmp_path):
+    catalog = LocalCatalog(tmp_path, {})
+    a = instance(catalog, "a")
+    a.update()
+    b = PartitionLeases(catalog, "b", "CatalogManager", partitions=8, duration=DURATION)
+    leases = b.getLeases()
+    assert not b.acquire(0, leases[0])
+    assert catalog.get('/leases/0').json()['lease']['owner'] == "a"
+
+
+# without the leases the partitions are left before the leases expire, when another instance can take them
+def test_partitions_left_when_the_catalog_is_not_reachable(tmp_path):
+    catalog = LocalCatalog(tmp_path, {})
+    a = instance(catalog, "a")
+    a.update()
+
+    def unreachable(path, params=None, ttl=None):
+        raise requests.exceptions.ConnectionError()
+
+    catalog.get = unreachable
+    a.update()
+    assert a.owned == set(range(8))
+    time.sleep(DURATION * 2 / 3)
+    a.update()
+    assert a.owned == set() and not a.owns(1)
+
+
+def test_partition_of_an_entity():
+    assert {partitionOf(entityID, 8) for entityID in range(1000)} == set(range(8))
+    assert partitionOf("12", 8) == partitionOf(12, 8)
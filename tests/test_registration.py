@@ -0,0 +1,100 @@
+import json
+import os
+import threading
+import time
+
+import pytest
+
+from conftest import ROOT
+from registration import Registration, HeartbeatScheduler
+
+
+class Response(object):
+    def __init__(self, status_code, body=None):
+        self.status_code = status_code
+        self.body = body
+        self.text = json.dumps(body)
+
+    def json(self):
+        return self.body
+
+
+# catalog with the entities of each collection; the POSTs of the devices fail while devicesAccepted is False
+class FakeCatalog(object):
+    def __init__(self, entities):
+        self.entities = entities
+        self.devices_accepted = True
+        self.puts = {}
+        self.lock = threading.Lock()
+
+    def get(self, path, ttl=None):
+        return Response(200, {path.strip('/'): self.entities.get(path.strip('/'), [])})
+
+    def post(self, path, body):
+        if path.strip('/') == 'devices' and not self.devices_accepted:
+            return Response(404, "patient not found")
+        self.entities.setdefault(path.strip('/'), []).append(dict(body))
+        return Response(200, body)
+
+    def put(self, path, body):
+        with self.lock:
+            self.puts[body['ID']] = self.puts.get(body['ID'], 0) + 1
+        if not any(entity['ID'] == body['ID'] for entity in self.entities.get(path.strip('/'), [])):
+            return Response(404, "not found")
+        return Response(200, body)
+
+    def backoff(self):
+        time.sleep(0.01)
+
+
+def shippedInfo():
+    infos = []
+    for directory in sorted(os.listdir(ROOT)):
+        path = os.path.join(ROOT, directory, 'settings.json')
+        if not os.path.exists(path):
+            continue
+        with open(path) as f:
+            settings = json.load(f)
+        for key, collection in (('deviceInfo', 'devices'), ('serviceInfo', 'services')):
+            if key in settings:
+                infos.append(pytest.param(collection, settings[key], id=directory))
+    return infos
+
+
+@pytest.mark.parametrize("collection, info", shippedInfo())
+def test_shipped_settings_get_the_next_free_ID(collection, info):
+    catalog = FakeCatalog({collection: [{'ID': 1}, {'ID': 7}]})
+    registration = Registration(catalog, collection, dict(info), 10)
+    expected = info['ID'] if info['ID'] not in ("", None, 1, 7) else 8
+    assert registration.register() == expected
+
+
+def test_empty_ID_in_an_empty_catalog_is_1():
+    registration = Registration(FakeCatalog({}), 'services', {'ID': ''}, 10)
+    assert registration.assignID() == 1
+
+
+# a device that cannot register again does not stop the heartbeats of the other entities of the process
+def test_registration_retried_off_the_scheduler_thread():
+    catalog = FakeCatalog({'services': [{'ID': 1}], 'devices': [{'ID': 2}]})
+    scheduler = HeartbeatScheduler()
+    service = Registration(catalog, 'services', {'ID': 1}, 0.05)
+    device = Registration(catalog, 'devices', {'ID': 2, 'patientID': 3}, 0.05)
+    scheduler.schedule(service, 0)
+    scheduler.schedule(device, 0)
+    # the device has been removed and its patient too: the POSTs are rejected with 404
+    catalog.devices_accepted = False
+    catalog.entities['devices'] = []
+    time.sleep(0.2)
+    heartbeats = catalog.puts[1]
+    time.sleep(0.5)
+    assert catalog.puts[1] >= heartbeats + 5
+    assert not device.registered
+    # the patient is added again: the device is registered and its heartbeats start again
+    catalog.devices_accepted = True
+    time.sleep(0.3)
+    assert device.registered
+    device_heartbeats = catalog.puts[device.ID]
+    time.sleep(0.3)
+    assert catalog.puts[device.ID] > device_heartbeats
+    service.cancelled = device.cancelled = True
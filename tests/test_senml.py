@@ -0,0 +1,95 @@
+import threading
+import time
+import uuid
+
+import pytest
+
+from codec import getCodec, detect
+from MQTT_base import MQTT_base
+from senml import pack, unpack, isSenMLPack
+
+SINGLE = {'bn': '7', 'e': [{'n': 'heart_rate', 'v': 72, 't': 1.0, 'u': 'bpm'}]}
+# several related fields measured at the same time, in one message
+MULTI = {'bn': '8', 'e': [{'n': 'acc_x', 'v': 0.1, 't': 2.0, 'u': 'm/s2'},
+                          {'n': 'acc_y', 'v': 0.2, 't': 2.0, 'u': 'm/s2'},
+                          {'n': 'acc_z', 'v': 9.8, 't': 2.0, 'u': 'm/s2'}]}
+
+
+def test_unpack_returns_the_messages_packed():
+    messages = [SINGLE, MULTI, SINGLE, MULTI]
+    assert unpack(pack(messages)) == messages
+
+
+def test_pack_of_another_producer_with_one_base_name_is_one_message():
+    records = [{'bn': '9', 'n': 'temperature', 'v': 36.6, 't': 3.0}, {'n': 'humidity', 'v': 40, 't': 3.0}]
+    assert unpack(records) == [{'bn': '9', 'e': [{'n': 'temperature', 'v': 36.6, 't': 3.0},
+                                                 {'n': 'humidity', 'v': 40, 't': 3.0}]}]
+
+
+def test_multi_entry_message_in_cbor_is_one_message():
+    payload = getCodec("cbor").encode(MULTI)
+    assert unpack(getCodec(detect(payload)).decode(payload)) == [MULTI]
+
+
+# a batch with a multi-entry message reaches the handler as the messages published
+def test_batched_multi_entry_message_is_delivered_whole():
+    broker = uuid.uuid4().hex
+    received = []
+    done = threading.Event()
+
+    def onMeasurement(message):
+        received.append(message.message)
+        if len(received) == 3:
+            done.set()
+
+    consumer = MQTT_base("consumer", broker, 1883, settings={"transport": "loopback", "workers": 0})
+    consumer.route('project/sensors/{patientID}/{deviceID}/{field}', onMeasurement)
+    sensor = MQTT_base("sensor", broker, 1883, settings={"transport": "loopback", "codec": "json",
+                                                         "batch": {"topics": ["project/sensors/#"], "size": 3}})
+    deadline = time.time() + 5
+    while not (consumer.mqttClient.is_connected() and sensor.mqttClient.is_connected()):
+        assert time.time() < deadline
+        time.sleep(0.01)
+    for message in (SINGLE, MULTI, SINGLE):
+        sensor.publish('project/sensors/1/8/acc', message)
+    assert done.wait(5)
+    assert received == [SINGLE, MULTI, SINGLE]
+    sensor.stop()
+    consumer.stop()
+
+
+@pytest.mark.parametrize("records, expected", [
+    (pack([SINGLE, MULTI]), True),
+    ([{'bn': '9', 'n': 'temperature', 'v': 36.6}], True),
+    ([1, 2, 3], False),
+    ([], False),
+    ([{'ID': 1, 'patientID': 2}], False),
+    ([{'n': 'heart_rate', 'v': 72}, {'alarm': True}], False),
+    ({'bn': '7', 'e': []}, False),
+])
+def test_only_arrays_of_senml_records_are_packs(records, expected):
+    assert isSenMLPack(records) == expected
+
+
+# a JSON array that is not SenML reaches notify unchanged instead of being dropped as an invalid pack
+@pytest.mark.parametrize("payload", ['[1, 2, 3]', '[{"ID": 1, "patientID": 2}]', '[]'])
+def test_plain_json_array_is_delivered_as_received(payload):
+    broker = uuid.uuid4().hex
+    notified = []
+
+    class Notifier(object):
+        def notify(self, topic, payload):
+            notified.append(payload)
+
+    consumer = MQTT_base("consumer", broker, 1883, Notifier(), settings={"transport": "loopback", "workers": 0})
+    sender = MQTT_base("sender", broker, 1883, settings={"transport": "loopback"})
+    deadline = time.time() + 5
+    while not (consumer.mqttClient.is_connected() and sender.mqttClient.is_connected()):
+        assert time.time() < deadline
+        time.sleep(0.01)
+    consumer.subscribe('project/lists/#')
+    sender.send('project/lists/1', payload)
+    assert notified == [payload.encode()]
+    assert consumer.metrics()["errors"] == 0
+    sender.stop()
+    consumer.stop()
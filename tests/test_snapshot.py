@@ -0,0 +1,67 @@
+import json
+import threading
+
+import catalog as catalog_module
+from catalog import Catalog
+from snapshot import LazyCatalog, collectSnapshot, encodeSnapshot, writeSnapshot
+
+CATALOG = {
+    "devices": [{"ID": 1, "patientID": 1, "deviceType": "heart_rate_sensor", "version": 1}],
+    "services": [],
+    "patients": [{"ID": 1, "name": "Rossi", "devices": [{"deviceID": 1}], "medications": [], "version": 2},
+                 {"ID": 2, "name": "Bianchi", "devices": [], "medications": [], "version": 1}],
+    "medications": [],
+    "chats": [],
+    "leases": [],
+}
+
+
+def newCatalog(tmp_path):
+    path = tmp_path / "catalog.json"
+    path.write_text(json.dumps(CATALOG))
+    return Catalog({"CatalogFileName": str(path), "SnapshotFileName": str(tmp_path / "catalog.snapshot"),
+                    "ThingspeakAdaptorURL": "http://thingspeak_adaptor", "apiPort": 8080, "snapshotInterval": 3600})
+
+
+# the snapshot keeps the catalog as it was when the collections were copied, the later changes replace the entities
+def test_changes_after_the_copy_are_not_in_the_snapshot(tmp_path):
+    catalog = newCatalog(tmp_path)
+    catalog.handlePATCH(("patients", "2"), {}, {"name": "Verdi"})
+    with catalog.lock:
+        collections = collectSnapshot(catalog.catalog, catalog.changed)
+    catalog.handlePATCH(("patients", "2"), {}, {"name": "Neri"})
+    catalog.handlePOST(("devices",), {}, {"ID": 2, "patientID": 2, "deviceType": "thermometer_sensor"})
+    writeSnapshot(str(tmp_path / "copy.snapshot"), encodeSnapshot(collections))
+    saved = LazyCatalog(str(tmp_path / "copy.snapshot"))
+    assert [patient["name"] for patient in saved["patients"]] == ["Rossi", "Verdi"]
+    assert saved["patients"][1]["devices"] == [] and len(saved["devices"]) == 1
+    assert catalog.catalog["patients"][1]["devices"] == [{"deviceID": 2}]
+    saved.close()
+
+
+# the requests are not blocked while the snapshot is encoded and written
+def test_snapshot_written_without_the_lock(tmp_path, monkeypatch):
+    catalog = newCatalog(tmp_path)
+    catalog.handlePATCH(("patients", "2"), {}, {"name": "Verdi"})
+    written = []
+
+    def request(locked):
+        locked.append(catalog.lock.acquire(timeout=1))
+        if locked[0]:
+            catalog.lock.release()
+
+    def write(path, data):
+        locked = []
+        other = threading.Thread(target=request, args=(locked,))
+        other.start()
+        other.join()
+        written.append(locked == [True])
+        writeSnapshot(path, data)
+
+    monkeypatch.setattr(catalog_module, "writeSnapshot", write)
+    assert catalog.saveSnapshot()
+    assert written == [True]
+    saved = LazyCatalog(catalog.snapshot_name)
+    assert saved["patients"][1]["name"] == "Verdi" and saved["patients"][1]["version"] == 2
+    assert saved.load() == catalog.catalog.load()
+    saved.close()
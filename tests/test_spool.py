@@ -0,0 +1,116 @@
+import threading
+import time
+import uuid
+
+import pytest
+
+from MQTT_base import MQTT_base
+from spool import Spool
+
+
+def drain(spool):
+    messages = []
+    while True:
+        message = spool.peek()
+        if message is None:
+            return messages
+        sequence, topic, payload, qos = message
+        messages.append((topic, payload, qos))
+        spool.pop(sequence)
+
+
+# the file is a ring: the slots are reused after the end, and a full spool overwrites the oldest message
+def test_wrap_around_drops_the_oldest(tmp_path):
+    spool = Spool(str(tmp_path / "mqtt.spool"), capacity=3, slotSize=64)
+    for i in range(5):
+        assert spool.append(f'topic/{i}', f'{{"i": {i}}}', 1)
+    assert len(spool) == 3 and spool.dropped == 2
+    assert drain(spool) == [(f'topic/{i}', f'{{"i": {i}}}'.encode(), 1) for i in range(2, 5)]
+    for i in range(5, 7):
+        spool.append(f'topic/{i}', str(i), 2)
+    assert drain(spool) == [('topic/5', b'5', 2), ('topic/6', b'6', 2)]
+    spool.close()
+
+
+def test_full_spool_discards_the_newest(tmp_path):
+    spool = Spool(str(tmp_path / "mqtt.spool"), capacity=2, slotSize=64, dropPolicy="newest")
+    assert [spool.append('topic', str(i), 1) for i in range(3)] == [True, True, False]
+    assert [payload for _, payload, _ in drain(spool)] == [b'0', b'1'] and spool.dropped == 1
+    spool.close()
+
+
+# a message overwritten while it was being published is not removed in place of the next one
+def test_pop_of_an_overwritten_message(tmp_path):
+    spool = Spool(str(tmp_path / "mqtt.spool"), capacity=2, slotSize=64)
+    spool.append('topic', '0', 1)
+    spool.append('topic', '1', 1)
+    sequence = spool.peek()[0]
+    spool.append('topic', '2', 1)
+    spool.pop(sequence)
+    assert [payload for _, payload, _ in drain(spool)] == [b'1', b'2']
+    spool.close()
+
+
+def test_message_larger_than_a_slot_is_discarded(tmp_path):
+    spool = Spool(str(tmp_path / "mqtt.spool"), capacity=2, slotSize=32)
+    assert not spool.append('topic', 'x' * 32, 1)
+    assert len(spool) == 0 and spool.dropped == 1
+    spool.close()
+
+
+# the messages left by a stopped service are replayed at the next start, a file of another size is discarded
+def test_messages_kept_across_restarts(tmp_path):
+    path = str(tmp_path / "mqtt.spool")
+    spool = Spool(path, capacity=3, slotSize=64)
+    for i in range(4):
+        spool.append('topic', str(i), 1)
+    spool.pop(spool.peek()[0])
+    spool.close()
+    spool = Spool(path, capacity=3, slotSize=64)
+    assert [payload for _, payload, _ in drain(spool)] == [b'2', b'3']
+    spool.append('topic', '4', 1)
+    spool.close()
+    spool = Spool(path, capacity=4, slotSize=64)
+    assert len(spool) == 0
+    spool.close()
+
+
+def test_invalid_settings(tmp_path):
+    with pytest.raises(ValueError):
+        Spool(str(tmp_path / "mqtt.spool"), dropPolicy="random")
+    with pytest.raises(ValueError):
+        Spool(str(tmp_path / "mqtt.spool"), slotSize=4)
+
+
+# the messages published while the client is disconnected are published in order after the reconnection,
+# the ones published meanwhile wait behind them
+def test_replay_after_the_reconnection(tmp_path):
+    broker = uuid.uuid4().hex
+    received = []
+    done = threading.Event()
+
+    def onMeasurement(message):
+        received.append(message.message['i'])
+        if len(received) == 20:
+            done.set()
+
+    consumer = MQTT_base("consumer", broker, 1883, settings={"transport": "loopback", "workers": 0})
+    consumer.route('project/sensors/{patientID}/{deviceID}/{field}', onMeasurement)
+    sensor = MQTT_base("sensor", broker, 1883, settings={
+        "transport": "loopback", "reconnectDelay": {"min": 0.2, "max": 0.2},
+        "spool": {"path": str(tmp_path / "mqtt.spool"), "capacity": 100, "slotSize": 128, "replayRate": 1000}})
+    deadline = time.time() + 5
+    while not sensor.mqttClient.is_connected():
+        assert time.time() < deadline
+        time.sleep(0.01)
+    sensor.mqttClient.disconnect()
+    for i in range(20):
+        sensor.publish('project/sensors/1/2/heart_rate', {'i': i})
+    assert len(sensor.spool) > 0
+    assert done.wait(5)
+    assert received == list(range(20))
+    metrics = sensor.metrics()
+    assert metrics["spooled"] == metrics["replayed"] == 20
+    assert metrics["spool_depth"] == 0
+    sensor.stop()
+    consumer.stop()
@@ -0,0 +1,54 @@
+from sweep import planSweep, restrictPlan
+
+NOW = 10000.0
+
+SNAPSHOT = {
+    "devices": [{"ID": 1, "patientID": 1, "last_update": NOW},
+                {"ID": 2, "patientID": 1, "last_update": NOW - 600},
+                {"ID": 3, "patientID": 9, "last_update": NOW - 600},
+                {"ID": "4", "patientID": "1", "last_update": NOW}],
+    "services": [{"ID": 1, "last_update": NOW - 600}, {"ID": 2, "last_update": NOW - 10}],
+    "patients": [{"ID": 1, "devices": [{"deviceID": 1}, {"deviceID": 2}, {"deviceID": 4}, {"deviceID": 7}],
+                  "medications": [{"medicationID": 1}], "version": 3},
+                 {"ID": 2, "devices": [], "medications": [{"medicationID": "8"}], "version": 1}],
+    "medications": [{"ID": 1, "patientID": 1}, {"ID": 2, "patientID": 9}],
+}
+
+
+# an orphan stale device is removed once, as an orphan; the IDs are compared as integers
+def test_plan_of_a_sweep():
+    plan = planSweep(SNAPSHOT, NOW, 300)
+    assert plan["devices"] == [(2, 'stale'), (3, 'orphan')]
+    assert plan["services"] == [(1, 'stale')]
+    assert plan["medications"] == [(2, 'orphan')]
+    assert plan["patients"] == [
+        {"ID": 1, "version": 3, "changes": {"devices": [{"deviceID": 1}, {"deviceID": 2}, {"deviceID": 4}]}},
+        {"ID": 2, "version": 1, "changes": {"medications": []}},
+    ]
+
+
+def test_consistent_catalog_has_an_empty_plan():
+    snapshot = {"devices": [{"ID": 1, "patientID": 1, "last_update": NOW}],
+                "patients": [{"ID": 1, "devices": [{"deviceID": 1}], "version": 1}]}
+    assert planSweep(snapshot, NOW, 300) == {"devices": [], "services": [], "medications": [], "leases": [], "patients": []}
+
+
+# a device seen on MQTT is not stale without heartbeats, an orphan is removed anyway
+def test_devices_alive_on_mqtt_are_kept():
+    plan = planSweep(SNAPSHOT, NOW, 300, alive={2, 3})
+    assert plan["devices"] == [(3, 'orphan')]
+
+
+def test_stale_leases():
+    snapshot = {"leases": [{"ID": 0, "expires": NOW - 600}, {"ID": 1, "expires": NOW - 10}, {"ID": 2, "expires": NOW + 30}]}
+    assert planSweep(snapshot, NOW, 300)["leases"] == [(0, 'stale')]
+
+
+# an instance applies only the part of the plan on its partitions, any instance removes the stale leases
+def test_plan_restricted_to_the_partitions_owned():
+    plan = planSweep(dict(SNAPSHOT, leases=[{"ID": 5, "expires": NOW - 600}]), NOW, 300)
+    restricted = restrictPlan(plan, lambda entityID: int(entityID) % 2 == 0)
+    assert restricted["devices"] == [(2, 'stale')]
+    assert restricted["services"] == [] and restricted["medications"] == [(2, 'orphan')]
+    assert restricted["leases"] == [(5, 'stale')]
+    assert [repair["ID"] for repair in restricted["patients"]] == [2]
@@ -0,0 +1,39 @@
+from timing_wheel import TimingWheel
+
+
+def test_keys_expire_after_the_timeout():
+    wheel = TimingWheel(10, tick=1, slots=8)
+    wheel.touch("a", 100)
+    wheel.touch("b", 103)
+    assert wheel.advance(109) == []
+    assert wheel.advance(110) == ["a"]
+    assert "a" not in wheel and "b" in wheel and len(wheel) == 1
+    assert wheel.advance(113.5) == ["b"] and len(wheel) == 0
+
+
+# a key seen again gets a new deadline, its old slot entry is dropped when visited
+def test_key_seen_again_expires_later():
+    wheel = TimingWheel(10, tick=1, slots=8)
+    wheel.touch("a", 100)
+    wheel.touch("a", 105)
+    assert wheel.advance(112) == []
+    assert wheel.advance(115) == ["a"]
+
+
+# the timeout is longer than the wheel: the keys stay in their slot for several turns
+def test_deadlines_beyond_one_turn_of_the_wheel():
+    wheel = TimingWheel(20, tick=1, slots=8)
+    wheel.touch("a", 100)
+    for now in range(101, 120):
+        assert wheel.advance(now) == []
+    assert wheel.advance(120) == ["a"]
+
+
+# after a pause longer than the wheel every slot is visited once, and removed keys never expire
+def test_long_pause_and_removal():
+    wheel = TimingWheel(10, tick=1, slots=8)
+    for i in range(20):
+        wheel.touch(i, 100 + i / 2)
+    wheel.remove(3)
+    assert sorted(wheel.advance(500)) == [i for i in range(20) if i != 3]
+    assert len(wheel) == 0
@@ -0,0 +1,68 @@
+import pytest
+
+from topic_router import TopicRouter, subscriptionFilter
+
+FILTERS = [
+    'project/sensors/{patientID}/{deviceID}/{field}',
+    'project/sensors/+/+/heart_rate',
+    'project/sensors/#',
+    'project/alarms/#',
+    'project/alarms/time_control',
+    '#',
+]
+
+
+@pytest.fixture
+def router():
+    router = TopicRouter()
+    for topicFilter in FILTERS:
+        router.add(topicFilter, topicFilter)
+    return router
+
+
+def matched(router, topic):
+    return {handler: params for handler, params in router.match(topic)}
+
+
+def test_parameters_and_wildcards(router):
+    assert matched(router, 'project/sensors/1/12/heart_rate') == {
+        'project/sensors/{patientID}/{deviceID}/{field}': {'patientID': '1', 'deviceID': '12', 'field': 'heart_rate'},
+        'project/sensors/+/+/heart_rate': {},
+        'project/sensors/#': {},
+        '#': {},
+    }
+    assert matched(router, 'project/sensors/1/12/temperature').keys() == {
+        'project/sensors/{patientID}/{deviceID}/{field}', 'project/sensors/#', '#'}
+
+
+@pytest.mark.parametrize("topic, handlers", [
+    # # matches the parent level too, + matches exactly one level
+    ('project/alarms', {'project/alarms/#', '#'}),
+    ('project/alarms/time_control', {'project/alarms/#', 'project/alarms/time_control', '#'}),
+    ('project/sensors/1/12', {'project/sensors/#', '#'}),
+    ('project/sensors/1/12/heart_rate/extra', {'project/sensors/#', '#'}),
+    ('project/sensors//12/heart_rate', {'project/sensors/{patientID}/{deviceID}/{field}', 'project/sensors/+/+/heart_rate',
+                                       'project/sensors/#', '#'}),
+    ('other', {'#'}),
+])
+def test_levels_matched(router, topic, handlers):
+    assert matched(router, topic).keys() == handlers
+
+
+# filters with different names on the same level share the nodes of the trie, each gets its own names
+def test_names_of_each_filter():
+    router = TopicRouter()
+    router.add('project/{a}/x', 'first')
+    router.add('project/{b}/y', 'second')
+    router.add('project/{c}/#', 'third')
+    assert router.match('project/1/y') == [('third', {'c': '1'}), ('second', {'b': '1'})]
+    assert len(router) == 3
+
+
+def test_multilevel_wildcard_only_at_the_end():
+    with pytest.raises(ValueError):
+        TopicRouter().add('project/#/x', 'handler')
+
+
+def test_subscription_filter():
+    assert subscriptionFilter('project/sensors/{patientID}/{deviceID}/#') == 'project/sensors/+/+/#'
@@ -3,8 +3,11 @@
 # "catalogURL": "http://catalog",
 import random
 import time
-from MQTT_base import *
+import json
 from sensor import Sensor
+from log import setupLogging, getLogger
+
+log = getLogger("THERMOMETER")
 
 class Thermometer(Sensor):
     def __init__(self, pi):
@@ -42,7 +45,7 @@ class Thermometer(Sensor):
         message['e'][0]['t']=time.time()
 
         self.client.publish(f'{self.topic}/temperature',message)
-        print(f"published Message: \n {message} on topic {self.topic}/temperature")
+        log.debug("published message: %s on topic %s/temperature", message, self.topic)
 
 # Signal handling for shutdown with stopping the container
 import signal
@@ -65,6 +68,7 @@ if __name__ == '__main__':
     except FileNotFoundError as e:
         print(f"THERMOMETER: Json settings file not found")
         exit(1)
+    setupLogging(settings.get('logging', {}))
     thermometer = None
     try:
         thermometer = Thermometer(settings)
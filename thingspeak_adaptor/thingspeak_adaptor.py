@@ -2,13 +2,20 @@
 # "catalogURL": "http://catalog",
 
 import requests
+import os
+import sys
+# the common modules are copied next to the service in the docker image, and are in ../common otherwise
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'common'))
+from catalog_client import CatalogClient
+from registration import register, unregister
 import json
 from MQTT_base import *
+from log import setupLogging, getLogger
 import random
 import time
-import uuid
 import cherrypy
-import threading
+
+log = getLogger("THINGSPEAK")
 
 class Thingspeak_Adaptor:
     exposed = True  
@@ -18,6 +25,9 @@ class Thingspeak_Adaptor:
         if 'catalogURL' not in settings or 'serviceInfo' not in settings or 'ThingspeakURL' not in settings or 'mqtt_data' not in settings or 'UserAPIKey' not in settings:
             raise ValueError("Settings must contain 'catalogURL', 'serviceInfo', 'ThingspeakURL', 'mqtt_data' and 'UserAPIKey'")
         self.catalogURL=settings['catalogURL']
+        self.catalog = CatalogClient(self.catalogURL, settings.get('catalogClient', {}))
+        # seconds a device lookup done for each measurement is cached by the catalog client
+        self.deviceCacheTTL = settings.get('deviceCacheTTL', 10)
         self.serviceInfo=settings['serviceInfo']
         self.ThingspeakURL=settings["ThingspeakURL"]
         self.userAPIKey=settings['UserAPIKey']
@@ -25,13 +35,13 @@ class Thingspeak_Adaptor:
             raise ValueError("Settings must contain 'port' in 'mqtt_data'")
         self.broker = settings["mqtt_data"]["broker"]
         self.port = settings["mqtt_data"]["port"]
-        self.topic = settings["mqtt_data"]["mqtt_topic"] # /# is added to indicate that all patients and sensors are read
+        self.topic = settings["mqtt_data"]["mqtt_topic"] # topic filter of all the sensors, with the patientID, deviceID and field levels
         if 'pingInterval' not in settings:
             self.pingInterval = 10
         else:
             self.pingInterval = settings['pingInterval']
-        self.clientID = str(uuid.uuid1())
-        self.client = MQTT_base(self.clientID, broker=self.broker, port=self.port, notifier=self)
+        self.clientID = clientIdentifier(settings['mqtt_data'])
+        self.client = MQTT_base(self.clientID, broker=self.broker, port=self.port, settings=settings['mqtt_data'])
         if 'thingspeak_fields' not in settings:
             self.thingspeak_fields = [
                 "temperature",
@@ -45,164 +55,72 @@ class Thingspeak_Adaptor:
             self.api_port = 8081
         else:
             self.api_port = settings['apiPort']
-        self.serviceID = None
-        self.serviceInfo['ID'] = self.assign_serviceID()  # Assign service ID
-        self.serviceID = self.serviceInfo['ID']
         self.start()
 
-# one additional thread needed to update the service in the catalog
     def start(self):
-        self.registerService()
-        self.update_thread = threading.Thread(target=self.update_loop,daemon=True)
-        self.update_thread.start()
+        self.registration = register(self.catalog, "services", self.serviceInfo, self.pingInterval)
         self.client.start()
-        self.client.subscribe(self.topic)
+        self.client.route(self.topic, self.onMeasurement)
         print(f"Thingspeak Adaptor started with ID {self.serviceInfo['ID']} on topic {self.topic}")
 
     def stop(self):
+        unregister(self.registration)
         self.client.stop()
-        self.update_thread.join()
-
-# assign an ID to the service   
-    def assign_serviceID(self):
-        # Loop until a valid service ID is obtained
-        while True: 
-            try:
-                response = requests.get(f'{self.catalogURL}/services')
-            except requests.exceptions.RequestException:
-                print("Failed request for services from catalog, retrying...")
-                time.sleep(5)
-                continue
-            if response.status_code != 200:
-                print(f"Failed to get services from catalog, status code {response.status_code}, retrying...")
-                time.sleep(5)
-                continue
-            services = response.json()['services']
-            # If serviceID is already assigned, check if it exists in the catalog
-            if self.serviceID != None:  
-                if not any(service['ID'] == self.serviceInfo['ID'] for service in services):
-                    return self.serviceID
-                else:
-                    print(f"Service ID {self.serviceID} already used, assigning a new one")
-                    # if the serviceID is already used, assign the next available service ID, or 1 if no services are present
-                    if services != []:
-                        return max(service['ID'] for service in services) + 1
-                    else:
-                        return 1
-            else:
-                # assign the next available service ID, or 1 if no services are present
-                if services != []:
-                    return max(service['ID'] for service in services) + 1
-                else:
-                    return 1
 
-# register the service in the catalog
-    def registerService(self):
-        print(f"Registering service {self.serviceInfo['ID']} in catalog")
-        registered = False
-        while not registered:
-            try:
-                request=requests.post(f'{self.catalogURL}/services',data=json.dumps(self.serviceInfo))
-            except requests.exceptions.RequestException:
-                print(f"Failed request for registering service {self.serviceID} in catalog, retrying...")
-                time.sleep(5)  # wait before retrying
-            if request.status_code != 200:
-                print(f"Failed to register service {self.serviceID} in catalog, retrying...")
-                registered = False
-                time.sleep(5) 
-                self.serviceID = self.assign_serviceID()  # try to assign new id if old one is already used
-                self.serviceInfo['ID'] = self.serviceID
-            else:
-                registered = True
-        print(f"Service {self.serviceID} registered in catalog")
-
-# update the service in the catalog every pingInterval seconds       
-    def update_loop(self):
-        print(f"THINGSPEAK: updating device {self.serviceID} in catalog every {self.pingInterval} seconds")
-        while True:
-            self.updateService()
-            time.sleep(self.pingInterval)
-
-    def updateService(self):
-        try:
-            request=requests.put(f'{self.catalogURL}/services',data=json.dumps(self.serviceInfo))
-        except requests.exceptions.RequestException:
-            print(f"THINGSPEAK: failed request for updating service {self.serviceInfo['ID']} in catalog, retrying...")
-            return
-        if request.status_code != 200:
-            print(f"THINGSPEAK: failed to update service {self.serviceInfo['ID']} in catalog, registering again")
-            self.registerService()  # If update fails, try to register the service again
-
-# thingspeak adaptor is subscribed to all topics of the sensors, and sorts the messages to the right field and the right patient
-    def notify(self,topic,payload): 
+# thingspeak adaptor is subscribed to all topics of the sensors, project/sensors/<patientID>/<deviceID>/<field>,
+# and sorts the messages to the right field and the right patient
+    def onMeasurement(self, measurement):
         #{'bn':f'SensorREST_MQTT_{self.deviceID}','e':[{'n':'','v':'', 't':'','u':''}]}
-        message = json.loads(payload)
-        print(f"THINGSPEAK: received message on topic {topic}: {message}")
-        field_name = message["e"][0]["n"]
-        deviceID = message["bn"]
+        message = measurement.message
+        log.debug("received message on topic %s: %s", measurement.topic, message)
+        field_name = measurement.params["field"]
+        deviceID = measurement.params["deviceID"]
         if field_name not in self.thingspeak_fields:
-            print(f"THINGSPEAK: field '{field_name}' not in thingspeak_fields")
+            log.warning("field '%s' not in thingspeak_fields", field_name)
             return  
         else:
             field_number = self.thingspeak_fields.index(field_name) + 1
-            print(f"\n{field_name} message")
-            print(f'request: {self.catalogURL}/devices/{deviceID}')
+            # device, patient and channel are resolved by the catalog with a single request
+            log.debug("%s message, request: %s/devices/%s/channel", field_name, self.catalogURL, deviceID)
             try:
-                response = requests.get(f'{self.catalogURL}/devices/{deviceID}')
+                response = self.catalog.get(f'/devices/{deviceID}/channel', ttl=self.deviceCacheTTL)
             except requests.exceptions.RequestException as e:
-                print(f"THINGSPEAK: Error retrieving sensor information from catalog: {e}")
+                log.error("Error retrieving sensor information from catalog: %s", e)
                 return
             if response.status_code != 200:
-                    print(f"THINGSPEAK: Catalog returned status {response.status_code}: {response.text}")
+                    log.error("Catalog returned status %d: %s", response.status_code, response.text)
                     return
-            print(response.json())
-            sensor = response.json()
-            print('uploading...')
-            self.uploadThingspeak(patientID=sensor['device']['patientID'], field_number=field_number, field_value=message["e"][0]['v'])
+            resolved = response.json()
+            log.debug("uploading...")
+            self.uploadThingspeak(patientID=resolved['patientID'], thingspeak_info=resolved['thingspeak_info'], field_number=field_number, field_value=message["e"][0]['v'])
         
 # function to upload data to Thingspeak
-    def uploadThingspeak(self,patientID,field_number,field_value):
+    def uploadThingspeak(self,patientID,thingspeak_info,field_number,field_value):
         # THINGSPEAK HAS A TIME LIMIT FOR SAVING DATA; EVERY 15 SECONDS IT SEEMS; NEED TO LIMIT SENSORS
 
         #GET https://api.thingspeak.com/update?api_key=N7GEPLVRH3PP72BP&field1=0
         #baseURL -> https://api.thingspeak.com/update?api_key=
         #Channel API KEY -> N7GEPLVRH3PP72BP Particular value for each Thingspeak channel
         #fieldnumber -> depends on the field (type of measurement) we want to upload the information to
-        urlToSend = f'{self.catalogURL}/patients/{patientID}'
-        try:
-            response = requests.get(urlToSend)
-        except requests.exceptions.RequestException as e:
-            print(f"THINGSPEAK: Error retrieving patient information from catalog: {e}")
-            return
-        if response.status_code == 404:
-            print(f"THINGSPEAK: Patient with ID {patientID} not found in catalog")
-            return
-        if response.status_code != 200:
-            print(f"THINGSPEAK: Catalog returned status {response.status_code}: {response.text}")
-            return
-        if 'patient' not in response.json():
-            print(f"THINGSPEAK: No patient field found with ID in catalog response")
-            return
-        patient = response.json()['patient']
-        if 'thingspeak_info' not in patient:
-            print(f"THINGSPEAK: Patient with ID {patientID} is missing thingspeak_info")
+        if not thingspeak_info:
+            log.warning("Patient with ID %s is missing thingspeak_info", patientID)
             return False
-        if 'channelID' not in patient['thingspeak_info'] or 'write_api_key' not in patient['thingspeak_info']:
-            print(f"THINGSPEAK: Patient with ID {patientID} is missing channelID or write_api_key")
+        if 'channelID' not in thingspeak_info or 'write_api_key' not in thingspeak_info:
+            log.warning("Patient with ID %s is missing channelID or write_api_key", patientID)
             return False
-        channelID = patient['thingspeak_info']['channelID']
-        channelWriteAPIkey = patient['thingspeak_info']['write_api_key']
+        channelID = thingspeak_info['channelID']
+        channelWriteAPIkey = thingspeak_info['write_api_key']
         if not channelID or not channelWriteAPIkey:
-            print(f"THINGSPEAK: Channel ID or Write API Key are empty for patientID {patientID}")
+            log.warning("Channel ID or Write API Key are empty for patientID %s", patientID)
             return
         urlToSend=f'{self.ThingspeakURL}/update?api_key={channelWriteAPIkey}&field{field_number}={field_value}'
         try:
             r=requests.get(urlToSend)
         except requests.exceptions.RequestException as e:
-            print(f"THINGSPEAK: Error uploading data to Thingspeak: {e}")
+            log.error("Error uploading data to Thingspeak: %s", e)
             return
         if r.status_code == 200:
-            print(f"Data uploaded successfully")
+            log.debug("Data uploaded successfully")
 
 # Create a new Thingspeak channel for the patientID
     def create_thingspeak_channel(self, patientID):
@@ -251,9 +169,9 @@ class Thingspeak_Adaptor:
         # First, find the channel ID for the given patientID
         # This assumes you have a way to map patientID to channelID, e.g., in self.patients or via catalog
         # For this example, let's assume you have a method to get the channelID by patientID
-        urlToSend = f"{self.catalogURL}/patients/{patientID}"
+        urlToSend = f"/patients/{patientID}"
         try:
-            response = requests.get(urlToSend)
+            response = self.catalog.get(urlToSend)
         except Exception as e:
             print(f"THINGSPEAK: Exception while retrieving patient information: {e}")
             return False
@@ -269,13 +187,13 @@ class Thingspeak_Adaptor:
             print(f"THINGSPEAK: Error decoding JSON response: {e}")
             return False
         if 'thingspeak_info' not in patient:
-            print(f"THINGSPEAK: Patient with ID {patientID} is missing thingspeak_info")
+            log.warning("Patient with ID %s is missing thingspeak_info", patientID)
             return False
         if 'channelID' not in patient['thingspeak_info'] or 'write_api_key' not in patient['thingspeak_info']:
-            print(f"THINGSPEAK: Patient with ID {patientID} is missing channelID or write_api_key")
+            log.warning("Patient with ID %s is missing channelID or write_api_key", patientID)
             return False
         if not patient['thingspeak_info']['channelID'] or not patient['thingspeak_info']['write_api_key']:
-            print(f"THINGSPEAK: Channel ID or Write API Key are empty for patientID {patientID}")
+            log.warning("Channel ID or Write API Key are empty for patientID %s", patientID)
             return False
         channelID = patient['thingspeak_info']['channelID']
         urlToSend = f"{self.ThingspeakURL}/channels/{channelID}.json"
@@ -290,11 +208,11 @@ class Thingspeak_Adaptor:
             return False
         if response.status_code == 200 or response.status_code == 202 or response.status_code == 204:
             print(f"THINGSPEAK: Channel {patient['thingspeak_info']['channelID']} for patientID {patientID} deleted successfully.")
-            # remove information from catalog patient
-            urlToSend = f"{self.catalogURL}/patients"
-            patient['thingspeak_info'] = {}  # Clear thingspeak_info from patient data
+            # remove information from catalog patient, only thingspeak_info is changed so that
+            # concurrent updates of the other fields of the patient are not overwritten
+            urlToSend = f"/patients/{patientID}"
             try:
-                response = requests.put(urlToSend, json=patient)
+                response = self.catalog.patch(urlToSend, {'thingspeak_info': {}})
             except Exception as e:
                 print(f"THINGSPEAK: Exception while updating catalog patient: {e}")
                 return False
@@ -327,9 +245,9 @@ class Thingspeak_Adaptor:
             if not N.isdigit() or int(N) <= 0:
                 raise cherrypy.HTTPError(status=400, message=f'THINGSPEAK ADAPTOR: Invalid samples_number {N}')
 
-        UrlToSend = f'{self.catalogURL}/patients/{patientID}'
+        UrlToSend = f'/patients/{patientID}'
         try:
-            response = requests.get(UrlToSend)
+            response = self.catalog.get(UrlToSend)
         except requests.exceptions.RequestException as e:
             raise cherrypy.HTTPError(status=500, message=f'THINGSPEAK ADAPTOR: Error retrieving patient information from catalog: {e}')
         if response.status_code != 200:
@@ -451,6 +369,7 @@ if __name__ == "__main__":
     except FileNotFoundError as e:
         print(f"THINGSPEAK ADAPTOR: Json settings file not found")
         exit(1)
+    setupLogging(settings.get('logging', {}))
     ts_adaptor = None
     try:
         ts_adaptor = Thingspeak_Adaptor(settings)
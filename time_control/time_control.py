@@ -1,22 +1,31 @@
 from sklearn.cluster import KMeans
 import numpy 
 import requests
+import os
+import sys
+# the common modules are copied next to the service in the docker image, and are in ../common otherwise
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'common'))
+from catalog_client import CatalogClient
+from registration import register, unregister
 import json
 import paho.mqtt.client as PahoMQTT
 from datetime import *
 # import cherrypy # not needed, will use mqtt for emergency messages
-import uuid
+import random
 from MQTT_base import *
+from log import setupLogging, getLogger
 from scipy import stats
 import time
 import threading
 
+log = getLogger("TIME CONTROL")
+
 def generate_zscore(mean, measurement, stddev):
     if mean is None:
-        print("TIME CONTROL: No normal values provided for z-score calculation")
+        log.error("No normal values provided for z-score calculation")
         return None
     if measurement is None:
-        print("TIME CONTROL: No measurement provided for z-score calculation")
+        log.error("No measurement provided for z-score calculation")
         return None
     data= numpy.random.normal(loc=mean, scale=stddev, size=100)
     data = numpy.append(data, measurement)
@@ -31,6 +40,9 @@ class TimeControl:
         if 'catalogURL' not in settings or 'ThingspeakAdaptorURL' not in settings or 'serviceInfo' not in settings or 'mqtt_data' not in settings or 'alarm_topic' not in settings:
             raise ValueError("Settings must contain catalogURL, ThingspeakAdaptorURL, serviceInfo, mqtt_data and alarm_topic")
         self.catalogURL = settings['catalogURL']
+        self.catalog = CatalogClient(self.catalogURL, settings.get('catalogClient', {}))
+        # seconds a device lookup done for each measurement is cached by the catalog client
+        self.deviceCacheTTL = settings.get('deviceCacheTTL', 10)
         self.ThingspeakAdaptorURL = settings['ThingspeakAdaptorURL']
         self.serviceInfo = settings['serviceInfo']
         self.alarm_topic = settings["alarm_topic"]
@@ -42,8 +54,8 @@ class TimeControl:
         self.broker = settings["mqtt_data"]["broker"]
         self.port = settings["mqtt_data"]["port"]
         self.topic = settings["mqtt_data"]["mqtt_topic"]
-        self.clientID=str(uuid.uuid1())
-        self.client=MQTT_base(self.clientID,self.broker,self.port,notifier=self)  # notifier is used to receive messages from the broker
+        self.clientID=clientIdentifier(settings['mqtt_data'])
+        self.client=MQTT_base(self.clientID,self.broker,self.port,settings=settings['mqtt_data'])  # the measurements are received by onMeasurement
         if 'thingspeak_fields' not in settings:
             self.thingspeak_fields = [
                 "temperature",
@@ -89,84 +101,18 @@ class TimeControl:
             self.heart_rate_std = 7
         else:
             self.heart_rate_std = settings["heart_rate_std"]
-        self.serviceID = None 
-        self.serviceInfo['ID'] = self.assign_serviceID()
-        self.serviceID = self.serviceInfo['ID']
         self.start()
 
     def start(self):
-        self.registerService()
+        self.registration = register(self.catalog, "services", self.serviceInfo, self.pingInterval)
         self.client.start()
-        self.client.subscribe(self.topic)
+        self.client.route(self.topic, self.onMeasurement)
         print(f"Time Control started with ID {self.serviceInfo['ID']} on topic {self.topic}")
 
     def stop(self):
+        unregister(self.registration)
         self.client.stop()
 
- # function to register the service to the catalog
-    def registerService(self):
-        print(f"Registering service {self.serviceInfo['ID']} in catalog")
-        registered = False
-        while not registered:
-            try:
-                request=requests.post(f'{self.catalogURL}/services',data=json.dumps(self.serviceInfo))
-            except requests.exceptions.RequestException:
-                print(f"Failed request for registering service {self.serviceID} in catalog, retrying...")
-                time.sleep(5)  # wait before retrying
-            if request.status_code != 200:
-                print(f"Failed to register service {self.serviceID} in catalog, retrying...")
-                registered = False
-                time.sleep(5) 
-                self.serviceID = self.assign_serviceID()  # try to assign new id if old one is already used
-                self.serviceInfo['ID'] = self.serviceID
-            else:
-                registered = True
-        print(f"Service {self.serviceID} registered in catalog")
-
-# assign an ID to the service   
-    def assign_serviceID(self):
-        # Loop until a valid service ID is obtained
-        while True: 
-            try:
-                response = requests.get(f'{self.catalogURL}/services')
-            except requests.exceptions.RequestException:
-                print("Failed request for services from catalog, retrying...")
-                time.sleep(5)
-                continue
-            if response.status_code != 200:
-                print(f"Failed to get services from catalog, status code {response.status_code}, retrying...")
-                time.sleep(5)
-                continue
-            services = response.json()['services']
-            # If serviceID is already assigned, check if it exists in the catalog
-            if self.serviceID != None:  
-                if not any(service['ID'] == self.serviceInfo['ID'] for service in services):
-                    return self.serviceID
-                else:
-                    print(f"Service ID {self.serviceID} already used, assigning a new one")
-                    # if the serviceID is already used, assign the next available service ID, or 1 if no services are present
-                    if services != []:
-                        return max(service['ID'] for service in services) + 1
-                    else:
-                        return 1
-            else:
-                # assign the next available service ID, or 1 if no services are present
-                if services != []:
-                    return max(service['ID'] for service in services) + 1
-                else:
-                    return 1     
-
-# function to update the service to catalog
-    def updateService(self):
-        try:
-            request=requests.put(f'{self.catalogURL}/services',data=json.dumps(self.serviceInfo))
-        except requests.exceptions.RequestException:
-            print(f"Failed request for updating service {self.serviceInfo['ID']} in catalog")
-            return
-        if request.status_code != 200:
-            print(f"Failed to update service {self.serviceInfo['ID']} in catalog, registering again")
-            self.registerService()  # If update fails, try to register the service again
-
 # function to detect an anomaly value
     def detect_anomaly(self,sensorID, patientID, value, timestamp, field):
         if field not in self.normal_values:
@@ -186,7 +132,7 @@ class TimeControl:
         if field == 'temperature':
             z_score = generate_zscore(self.normal_values[field], value, self.temperature_std)
             if z_score is None:
-                print(f"TIME CONTROL: Error generating z-score for patient {patientID}")
+                log.error("Error generating z-score for patient %s", patientID)
                 return
             # if the patient already has a fever, avoid to re-trigger the alarm
             if patientID in self.fever_patients:
@@ -205,18 +151,18 @@ class TimeControl:
             try:
                 response = requests.get(UrlToSend)
             except requests.exceptions.RequestException as e:
-                print(f"TIME CONTROL: Error in request for field {field} from Thingspeak: {e}")
+                log.error("Error in request for field %s from Thingspeak: %s", field, e)
                 return None
             if response.status_code != 200:
-                print(f"TIME CONTROL: Error in response for field {field} from Thingspeak: {response.text}")
+                log.error("Error in response for field %s from Thingspeak: %s", field, response.text)
                 return None
             if "feeds" not in response.json():
-                print(f"TIME CONTROL: No feeds found for field {field} from Thingspeak")
+                log.warning("No feeds found for field %s from Thingspeak", field)
                 return None
             # Check the values in the feeds
             feeds = response.json()["feeds"]
             if not feeds:
-                print(f"TIME CONTROL: No valid feeds found for field {field} from Thingspeak")
+                log.warning("No valid feeds found for field %s from Thingspeak", field)
                 return None
             # print(feeds)
             average = sum(float(feed['field']) for feed in feeds) / len(feeds)
@@ -229,7 +175,7 @@ class TimeControl:
             # the check is done on the z_score of the measurement with respect to the value present in normal_values
             z_score = generate_zscore(self.normal_values[field], value, self.heart_rate_std)
             if z_score is None:
-                print(f"TIME CONTROL: Error generating z-score for patient {patientID}")
+                log.error("Error generating z-score for patient %s", patientID)
                 return
             # if the z_score is too high, send an alarm on alarm_topic
             if abs(z_score) >=self.z_score_threshold:
@@ -237,41 +183,41 @@ class TimeControl:
             else:
                 return False
 
-# time control is subscribed to the topics of the sensors
-    def notify(self, topic, msg):
+# time control is subscribed to the topics of the sensors, project/sensors/<patientID>/<deviceID>/<field>
+    def onMeasurement(self, measurement):
         # request device info to know what patientID is associated with the sensorID
-        message = json.loads(msg)
-        sensorID = message["bn"]
-        field = message["e"][0]["n"]
+        message = measurement.message
+        sensorID = measurement.params["deviceID"]
+        field = measurement.params["field"]
         value = message["e"][0]["v"]
         timestamp = message["e"][0]["t"]
         try:
-            response = requests.get(f'{self.catalogURL}/devices/{sensorID}')
+            response = self.catalog.get(f'/devices/{sensorID}', ttl=self.deviceCacheTTL)
             device_info = response.json()
         except requests.exceptions.RequestException as e:
-            print(f"TIME CONTROL: Error in request device info for sensor {sensorID}: {e}")
+            log.error("Error in request device info for sensor %s: %s", sensorID, e)
             return
         if response.status_code == 404:
-            print(f"TIME CONTROL: Device {sensorID} not found in catalog")
+            log.warning("Device %s not found in catalog", sensorID)
             return
         if response.status_code != 200:
-            print(f"TIME CONTROL: catalog error getting device info for sensor {sensorID}, error: {response.text}")
+            log.error("catalog error getting device info for sensor %s, error: %s", sensorID, response.text)
             return
-        print(device_info)
+        log.debug("%s", device_info)
         if "patientID" not in device_info["device"] or device_info["device"]["patientID"] is None:
-            print(f"TIME CONTROL: No patientID found in device info for sensor {sensorID}")
+            log.warning("No patientID found in device info for sensor %s", sensorID)
             return
         patientID = device_info["device"]["patientID"]
         if field not in self.thingspeak_fields:
-            print(f"TIME CONTROL: field {field} for message {message} not in Thingspeak fields")
+            log.warning("field %s for message %s not in Thingspeak fields", field, message)
             return
         anomaly = self.detect_anomaly(sensorID, patientID, value, timestamp, field)
         if anomaly is None:
             return
         if not anomaly:
-            print(f"TIME CONTROL: Normal value for patient {patientID} sensor {sensorID}, field {field}, value {value} at {timestamp}")
+            log.debug("Normal value for patient %s sensor %s, field %s, value %s at %s", patientID, sensorID, field, value, timestamp)
         else:
-            print(f"TIME CONTROL: Warning for patient {patientID}, sensor {sensorID}, field {field}, value {value} at {timestamp}")
+            log.info("Warning for patient %s, sensor %s, field %s, value %s at %s", patientID, sensorID, field, value, timestamp)
             message = {'alarmType': "time_control",
                             'patientID': patientID,
                             'sensorID': sensorID,
@@ -301,12 +247,12 @@ if __name__ == "__main__":
     except FileNotFoundError as e:
         print(f"TIME CONTROL: Error loading json settings file")
         exit(1)
+    setupLogging(settings.get('logging', {}))
     time_control = None
     try:
         time_control = TimeControl(settings)
         while True:
-            time.sleep(time_control.pingInterval)
-            time_control.updateService()
+            time.sleep(5)
     except (KeyboardInterrupt, SystemExit):
         print("Shutting down Time Control...")
         if time_control is not None:
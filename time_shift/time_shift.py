@@ -1,11 +1,17 @@
 from sklearn.cluster import KMeans
 import numpy 
 import requests
+import os
+import sys
+# the common modules are copied next to the service in the docker image, and are in ../common otherwise
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'common'))
+from catalog_client import CatalogClient
+from registration import register, unregister
 import json
 import paho.mqtt.client as PahoMQTT
 from datetime import *
-import uuid
 from MQTT_base import *
+from log import setupLogging
 import threading
 import time
 import cherrypy
@@ -26,6 +32,7 @@ class TimeShift:
         self.broker=settings["mqtt_data"]["broker"]
         self.port=settings["mqtt_data"]["port"]
         self.catalogURL=settings['catalogURL']
+        self.catalog = CatalogClient(self.catalogURL, settings.get('catalogClient', {}))
         self.serviceInfo=settings['serviceInfo']
         self.ThingspeakAdaptorURL=settings["ThingspeakAdaptorURL"]
         self.alarm_topic = settings["alarm_topic"]  # topic to send alarms
@@ -57,25 +64,20 @@ class TimeShift:
         for field in self.thingspeak_fields:
             if field not in self.normal_values.keys():
                 raise ValueError(f"Missing normal value for field {field} in settings.")
-        self.clientID=str(uuid.uuid1())
-        self.client=MQTT_base(self.clientID,self.broker,self.port,None) # deve mandare, non ricevere
-        self.serviceID = None  
-        self.serviceInfo['ID'] = self.assign_serviceID()
-        self.serviceID = self.serviceInfo['ID']
+        self.clientID=clientIdentifier(settings['mqtt_data'])
+        self.client=MQTT_base(self.clientID,self.broker,self.port,None,settings['mqtt_data']) # deve mandare, non ricevere
         self.start()
         
     def start(self):
         self.client.start()
-        self.registerService()
-        # two threads are needed, one to update to catalog, the other to send alarms if the current hour is an important time for one of the patients
-        self.update_thread = threading.Thread(target=self.update_loop,daemon=True)
-        self.update_thread.start()
+        self.registration = register(self.catalog, "services", self.serviceInfo, self.pingInterval)
+        # thread to send alarms if the current hour is an important time for one of the patients
         self.send_alarm_thread = threading.Thread(target=self.send_alarm_loop,daemon=True)
         self.send_alarm_thread.start()
 
     def stop(self):
+        unregister(self.registration)
         self.client.stop()
-        self.update_thread.join()
         self.send_alarm_thread.join()
 
 # loop to send alarms on alarm_topic if the current hour is an important time for one of the patients
@@ -90,9 +92,9 @@ class TimeShift:
 
     def send_alarm(self):
         hour=int(time.strftime('%H', time.localtime()))
-        UrlToSend = f'{self.catalogURL}/patients'
+        UrlToSend = '/patients'
         try:
-            response = requests.get(UrlToSend)
+            response = self.catalog.get(UrlToSend)
         except requests.exceptions.RequestException as e:
             print(f"TIME SHIFT: Error retrieving patients from catalog: {e}")
             return
@@ -122,75 +124,6 @@ class TimeShift:
                         }
                         self.client.publish(self.alarm_topic, message)
 
-# loop to update the service to the catalog
-    def update_loop(self):
-        while True:
-            time.sleep(self.pingInterval)
-            self.updateService()
-
-    def updateService(self):
-        try:
-            request=requests.put(f'{self.catalogURL}/services',data=json.dumps(self.serviceInfo))
-        except requests.exceptions.RequestException:
-            print(f"TIME SHIFT: failed request for updating service {self.serviceInfo['ID']} in catalog")
-            return
-        if request.status_code != 200:
-            print(f"TIME SHIFT: failed to update service {self.serviceInfo['ID']} in catalog, registering again")
-            self.registerService()  # If update fails, try to register the service again
-
-# Function register the service to the catalog
-    def registerService(self):
-        print(f"Registering service {self.serviceInfo['ID']} in catalog")
-        registered = False
-        while not registered:
-            try:
-                request=requests.post(f'{self.catalogURL}/services',data=json.dumps(self.serviceInfo))
-            except requests.exceptions.RequestException:
-                print(f"Failed request for registering service {self.serviceID} in catalog, retrying...")
-                time.sleep(5)  # wait before retrying
-            if request.status_code != 200:
-                print(f"Failed to register service {self.serviceID} in catalog, retrying...")
-                registered = False
-                time.sleep(5) 
-                self.serviceID = self.assign_serviceID()  # try to assign new id if old one is already used
-                self.serviceInfo['ID'] = self.serviceID
-            else:
-                registered = True
-        print(f"Service {self.serviceID} registered in catalog")
-    
-# assign an ID to the service   
-    def assign_serviceID(self):
-        # Loop until a valid service ID is obtained
-        while True: 
-            try:
-                response = requests.get(f'{self.catalogURL}/services')
-            except requests.exceptions.RequestException:
-                print("Failed request for services from catalog, retrying...")
-                time.sleep(5)
-                continue
-            if response.status_code != 200:
-                print(f"Failed to get services from catalog, status code {response.status_code}, retrying...")
-                time.sleep(5)
-                continue
-            services = response.json()['services']
-            # If serviceID is already assigned, check if it exists in the catalog
-            if self.serviceID != None:  
-                if not any(service['ID'] == self.serviceInfo['ID'] for service in services):
-                    return self.serviceID
-                else:
-                    print(f"Service ID {self.serviceID} already used, assigning a new one")
-                    # if the serviceID is already used, assign the next available service ID, or 1 if no services are present
-                    if services != []:
-                        return max(service['ID'] for service in services) + 1
-                    else:
-                        return 1
-            else:
-                # assign the next available service ID, or 1 if no services are present
-                if services != []:
-                    return max(service['ID'] for service in services) + 1
-                else:
-                    return 1   
-
 # using clustering on thingspeak data, creates a dictionary for each patient that contains all fields, and for each field a list of important times
     def get_anomaly_times(self, patientID): 
         # retrieve thingspeak data
@@ -339,6 +272,7 @@ if __name__ == "__main__":
     except FileNotFoundError as e:
         print(f"TIME SHIFT: Json settings file not found")
         exit(1)
+    setupLogging(settings.get('logging', {}))
     time_shift = None
     try:
         time_shift = TimeShift(settings)